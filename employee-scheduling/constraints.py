@@ -2,8 +2,8 @@ from optapy import constraint_provider
 from optapy.score import HardSoftScore
 from optapy.constraint import Joiners, ConstraintFactory
 
-from domain import Shift, Availability, AvailabilityType
-from datetime import timedelta, datetime
+from domain import Shift, Availability, AvailabilityType, AvailabilityIndex
+from datetime import datetime
 
 
 def get_start_of_availability(availability: Availability):
@@ -15,24 +15,28 @@ def get_end_of_availability(availability: Availability):
 
 
 def get_minute_overlap(shift1: Shift, shift2: Shift) -> int:
-    duration_of_overlap: timedelta = min(shift1.end, shift2.end) - max(shift1.start, shift2.start)
-    return int(duration_of_overlap.total_seconds() // 60)
+    return min(shift1.end_minute, shift2.end_minute) - max(shift1.start_minute, shift2.start_minute)
+
+
+def get_availability_type(shift: Shift, availability_index: AvailabilityIndex):
+    return availability_index.get_availability_type(shift.employee, shift.day)
 
 
 def get_shift_duration_in_minutes(shift: Shift) -> int:
-    return int((shift.end - shift.start).total_seconds() // 60)
+    return shift.end_minute - shift.start_minute
 
 
 @constraint_provider
 def employee_scheduling_constraints(constraint_factory: ConstraintFactory):
+    shift_availability = shift_availability_type(constraint_factory)
     return [
         required_skill(constraint_factory),
         no_overlapping_shifts(constraint_factory),
         at_least_10_hours_between_two_shifts(constraint_factory),
         one_shift_per_day(constraint_factory),
-        unavailable_employee(constraint_factory),
-        desired_day_for_employee(constraint_factory),
-        undesired_day_for_employee(constraint_factory),
+        unavailable_employee(constraint_factory, shift_availability),
+        desired_day_for_employee(constraint_factory, shift_availability),
+        undesired_day_for_employee(constraint_factory, shift_availability),
     ]
 
 
@@ -47,73 +51,78 @@ def no_overlapping_shifts(constraint_factory: ConstraintFactory):
     return constraint_factory \
         .for_each_unique_pair(Shift,
                               Joiners.equal(lambda shift: shift.employee),
-                              Joiners.overlapping(lambda shift: shift.start,
-                                                  lambda shift: shift.end)
+                              Joiners.overlapping(lambda shift: shift.start_minute,
+                                                  lambda shift: shift.end_minute)
                               ) \
         .penalize("Overlapping shift", HardSoftScore.ONE_HARD, get_minute_overlap)
 
 
 def at_least_10_hours_between_two_shifts(constraint_factory: ConstraintFactory):
-    TEN_HOURS_IN_SECONDS = 60 * 60 * 10
+    TEN_HOURS_IN_MINUTES = 60 * 10
+    # Shifts padded with 10 hours of rest overlap exactly when the second starts too soon after the first,
+    # so the join only looks at an employee's shifts in that window, and only adjacent shifts are penalized
     return constraint_factory \
-        .for_each_unique_pair(Shift,
-                              Joiners.equal(lambda shift: shift.employee),
-                              Joiners.less_than_or_equal(lambda shift: shift.end,
-                                                         lambda shift: shift.start)
-                              ) \
-        .filter(lambda first_shift, second_shift:
-                (second_shift.start - first_shift.end).total_seconds() < TEN_HOURS_IN_SECONDS) \
+        .for_each(Shift) \
+        .join(Shift,
+              Joiners.equal(lambda shift: shift.employee),
+              Joiners.overlapping(lambda shift: shift.start_minute,
+                                  lambda shift: shift.end_minute + TEN_HOURS_IN_MINUTES),
+              Joiners.less_than_or_equal(lambda shift: shift.end_minute,
+                                         lambda shift: shift.start_minute)
+              ) \
+        .if_not_exists(Shift,
+                       Joiners.equal(lambda first_shift, second_shift: first_shift.employee,
+                                     lambda shift: shift.employee),
+                       Joiners.less_than_or_equal(lambda first_shift, second_shift: first_shift.end_minute,
+                                                  lambda shift: shift.start_minute),
+                       Joiners.greater_than_or_equal(lambda first_shift, second_shift: second_shift.start_minute,
+                                                     lambda shift: shift.end_minute)
+                       ) \
         .penalize("At least 10 hours between 2 shifts", HardSoftScore.ONE_HARD,
                   lambda first_shift, second_shift:
-                  (TEN_HOURS_IN_SECONDS - (second_shift.start - first_shift.end).total_seconds()) // 60)
+                  TEN_HOURS_IN_MINUTES - (second_shift.start_minute - first_shift.end_minute))
 
 
 def one_shift_per_day(constraint_factory: ConstraintFactory):
     return constraint_factory \
         .for_each_unique_pair(Shift,
                               Joiners.equal(lambda shift: shift.employee),
-                              Joiners.equal(lambda shift: shift.start.date())
+                              Joiners.equal(lambda shift: shift.day)
                               ) \
         .penalize("Max one shift per day", HardSoftScore.ONE_HARD)
 
 
-def unavailable_employee(constraint_factory: ConstraintFactory):
+# Each shift with the availability type of its employee on its day, looked up once per shift.
+# The availability constraints below share this stream and only compare the type.
+def shift_availability_type(constraint_factory: ConstraintFactory):
     return constraint_factory \
         .for_each(Shift) \
-        .join(Availability,
-              Joiners.equal(lambda shift: shift.employee,
-                            lambda availability: availability.employee),
-              Joiners.equal(lambda shift: shift.start.date(),
-                            lambda availability: availability.date)
-              ) \
-        .filter(lambda shift, availability: availability.availability_type == AvailabilityType.UNAVAILABLE) \
+        .join(AvailabilityIndex) \
+        .group_by(lambda shift, availability_index: shift, get_availability_type)
+
+
+def unavailable_employee(constraint_factory: ConstraintFactory, shift_availability=None):
+    if shift_availability is None:
+        shift_availability = shift_availability_type(constraint_factory)
+    return shift_availability \
+        .filter(lambda shift, availability_type: availability_type == AvailabilityType.UNAVAILABLE) \
         .penalize('Unavailable employee', HardSoftScore.ONE_HARD,
-                  lambda shift, availability: get_shift_duration_in_minutes(shift))
+                  lambda shift, availability_type: get_shift_duration_in_minutes(shift))
 
 
-def desired_day_for_employee(constraint_factory: ConstraintFactory):
-    return constraint_factory \
-        .for_each(Shift) \
-        .join(Availability,
-              Joiners.equal(lambda shift: shift.employee,
-                            lambda availability: availability.employee),
-              Joiners.equal(lambda shift: shift.start.date(),
-                            lambda availability: availability.date)
-              ) \
-        .filter(lambda shift, availability: availability.availability_type == AvailabilityType.DESIRED) \
+def desired_day_for_employee(constraint_factory: ConstraintFactory, shift_availability=None):
+    if shift_availability is None:
+        shift_availability = shift_availability_type(constraint_factory)
+    return shift_availability \
+        .filter(lambda shift, availability_type: availability_type == AvailabilityType.DESIRED) \
         .reward('Desired day for employee', HardSoftScore.ONE_SOFT,
-                lambda shift, availability: get_shift_duration_in_minutes(shift))
+                lambda shift, availability_type: get_shift_duration_in_minutes(shift))
 
 
-def undesired_day_for_employee(constraint_factory: ConstraintFactory):
-    return constraint_factory \
-        .for_each(Shift) \
-        .join(Availability,
-              Joiners.equal(lambda shift: shift.employee,
-                            lambda availability: availability.employee),
-              Joiners.equal(lambda shift: shift.start.date(),
-                            lambda availability: availability.date)
-              ) \
-        .filter(lambda shift, availability: availability.availability_type == AvailabilityType.UNDESIRED) \
+def undesired_day_for_employee(constraint_factory: ConstraintFactory, shift_availability=None):
+    if shift_availability is None:
+        shift_availability = shift_availability_type(constraint_factory)
+    return shift_availability \
+        .filter(lambda shift, availability_type: availability_type == AvailabilityType.UNDESIRED) \
         .penalize('Undesired day for employee', HardSoftScore.ONE_SOFT,
-                  lambda shift, availability: get_shift_duration_in_minutes(shift))
+                  lambda shift, availability_type: get_shift_duration_in_minutes(shift))
@@ -1,8 +1,23 @@
 import optapy
 import optapy.types
 import optapy.score
+import array
 import datetime
 import enum
+import sys
+
+EPOCH = datetime.datetime(1970, 1, 1)
+ONE_MINUTE = datetime.timedelta(minutes=1)
+# The furthest a constraint looks back from a shift: the 10 hours of rest of at_least_10_hours_between_two_shifts
+REST_WINDOW_IN_MINUTES = 60 * 10
+
+
+def to_epoch_minute(date_time: datetime.datetime) -> int:
+    return (date_time - EPOCH) // ONE_MINUTE
+
+
+def from_epoch_minute(epoch_minute: int) -> datetime.datetime:
+    return EPOCH + epoch_minute * ONE_MINUTE
 
 
 @optapy.problem_fact
@@ -14,6 +29,11 @@ class Employee:
         self.name = name
         self.skill_set = skill_set
 
+    # Names are unique; multithreaded solving needs an id to look up each move thread's copy of an employee
+    @optapy.planning_id
+    def get_name(self):
+        return self.name
+
     def __str__(self):
         return f'Employee(name={self.name})'
 
@@ -34,7 +54,7 @@ class AvailabilityType(enum.Enum):
         return list(map(lambda at: at, AvailabilityType))
 
 
-@optapy.problem_fact
+# Kept for display only: the constraints read availabilities through the AvailabilityIndex
 class Availability:
     employee: Employee
     date: datetime.date
@@ -57,21 +77,69 @@ class Availability:
         }
 
 
+# The availability type of each employee and date, so a shift looks up its availability instead of
+# joining every Availability fact. Employees are keyed by name, as the solver may hand out copies of them.
+@optapy.problem_fact
+class AvailabilityIndex:
+    # There is one index per schedule; the id lets a problem change look up the solver's copy of it
+    ID = 0
+
+    def __init__(self, availability_list: list[Availability] = None):
+        self.id = AvailabilityIndex.ID
+        self.availability_type_by_employee_date = dict()
+        for availability in availability_list or []:
+            self.add(availability)
+
+    @optapy.planning_id
+    def get_id(self):
+        return self.id
+
+    def add(self, availability: Availability):
+        self.set_availability_type(availability.employee.name, availability.date.toordinal(),
+                                   availability.availability_type)
+
+    def set_availability_type(self, employee_name: str, day: int, availability_type: AvailabilityType):
+        if availability_type is None:
+            self.availability_type_by_employee_date.pop((employee_name, day), None)
+        else:
+            self.availability_type_by_employee_date[(employee_name, day)] = availability_type
+
+    # day is the date's ordinal, as in Shift.day
+    def get_availability_type(self, employee: Employee, day: int):
+        if employee is None:
+            return None
+        return self.availability_type_by_employee_date.get((employee.name, day))
+
+
 class ScheduleState:
     publish_length: int
     draft_length: int
     first_draft_date: datetime.date
+    first_draft_day: int
+    first_draft_minute: int
     last_historic_date: datetime.date
 
     def __init__(self, publish_length: int = None, draft_length: int = None, first_draft_date: datetime.date = None,
                  last_historic_date: datetime.date = None):
         self.publish_length = publish_length
         self.draft_length = draft_length
-        self.first_draft_date = first_draft_date
+        self.set_first_draft_date(first_draft_date)
         self.last_historic_date = last_historic_date
 
+    # first_draft_day (the ordinal of first_draft_date, as in Shift.day) and first_draft_minute (the epoch minute
+    # it starts at, as in Shift.start_minute) mirror first_draft_date as plain ints
+    def set_first_draft_date(self, first_draft_date: datetime.date):
+        self.first_draft_date = first_draft_date
+        if first_draft_date is None:
+            self.first_draft_day = None
+            self.first_draft_minute = None
+        else:
+            self.first_draft_day = first_draft_date.toordinal()
+            self.first_draft_minute = to_epoch_minute(datetime.datetime.combine(first_draft_date, datetime.time.min))
+
+    # Called by the pinning filter for every shift a move selector looks at
     def is_draft(self, shift):
-        return shift.start >= datetime.datetime.combine(self.first_draft_date, datetime.time.min)
+        return shift.start_minute >= self.first_draft_minute
 
     def to_dict(self):
         return {
@@ -82,8 +150,10 @@ class ScheduleState:
         }
 
 
+# During a repair solve only the shifts in the solution's repair_shift_id_set may change
 def shift_pinning_filter(solution, shift):
-    return not solution.schedule_state.is_draft(shift)
+    return not solution.schedule_state.is_draft(shift) or \
+        (solution.repair_shift_id_set is not None and shift.id not in solution.repair_shift_id_set)
 
 
 @optapy.planning_entity(pinning_filter=shift_pinning_filter)
@@ -91,6 +161,9 @@ class Shift:
     id: int
     start: datetime.datetime
     end: datetime.datetime
+    start_minute: int
+    end_minute: int
+    day: int
     location: str
     required_skill: str
     employee: Employee
@@ -98,12 +171,20 @@ class Shift:
     def __init__(self, id: int = None, start: datetime.datetime = None, end: datetime.datetime = None,
                  location: str = None, required_skill: str = None, employee: Employee = None):
         self.id = id
-        self.start = start
-        self.end = end
+        self.set_start_and_end(start, end)
         self.location = location
         self.required_skill = required_skill
         self.employee = employee
 
+    # start_minute and end_minute (minutes since the epoch) and day (the ordinal of the start date)
+    # mirror start and end as plain ints, so the constraints never do datetime arithmetic
+    def set_start_and_end(self, start: datetime.datetime, end: datetime.datetime):
+        self.start = start
+        self.end = end
+        self.start_minute = to_epoch_minute(start) if start is not None else None
+        self.end_minute = to_epoch_minute(end) if end is not None else None
+        self.day = start.toordinal() if start is not None else None
+
     @optapy.planning_id
     def get_id(self):
         return self.id
@@ -121,6 +202,7 @@ class Shift:
 
     def to_dict(self):
         return {
+            'id': self.id,
             'start': self.start.isoformat(),
             'end': self.end.isoformat(),
             'location': self.location,
@@ -129,20 +211,67 @@ class Shift:
         }
 
 
+# Shifts that no constraint can see anymore, moved out of the working solution. They are kept column by column
+# (epoch minutes in int arrays, interned strings), so months of history stay compact.
+class HistoricShiftStore:
+    def __init__(self):
+        self.id_array = array.array('q')
+        self.start_minute_array = array.array('q')
+        self.end_minute_array = array.array('q')
+        self.location_list = []
+        self.required_skill_list = []
+        self.employee_list = []
+        self.availability_list = []
+
+    def __len__(self):
+        return len(self.id_array)
+
+    def add_shift(self, shift: Shift):
+        self.id_array.append(shift.id)
+        self.start_minute_array.append(shift.start_minute)
+        self.end_minute_array.append(shift.end_minute)
+        self.location_list.append(sys.intern(shift.location))
+        self.required_skill_list.append(sys.intern(shift.required_skill))
+        self.employee_list.append(shift.employee)
+
+    def add_availability(self, availability: Availability):
+        self.availability_list.append(availability)
+
+    def get_shift_list(self) -> list[Shift]:
+        return [Shift(self.id_array[i], from_epoch_minute(self.start_minute_array[i]),
+                      from_epoch_minute(self.end_minute_array[i]), self.location_list[i],
+                      self.required_skill_list[i], self.employee_list[i])
+                for i in range(len(self))]
+
+    def to_dict(self):
+        return {
+            'shift_list': list(map(lambda shift: shift.to_dict(), self.get_shift_list())),
+            'availability_list': list(map(lambda availability: availability.to_dict(), self.availability_list)),
+        }
+
+
 @optapy.planning_solution
 class EmployeeSchedule:
     schedule_state: ScheduleState
     availability_list: list[Availability]
+    availability_index: AvailabilityIndex
     employee_list: list[Employee]
     shift_list: list[Shift]
+    historic_shift_store: HistoricShiftStore
+    changed_shift_id_set: set
+    repair_shift_id_set: set
     solver_status: optapy.types.SolverStatus
     score: optapy.score.SimpleScore
 
     def __init__(self, schedule_state, availability_list, employee_list, shift_list, solver_status, score=None):
         self.employee_list = employee_list
         self.availability_list = availability_list
+        self.availability_index = AvailabilityIndex(availability_list)
         self.schedule_state = schedule_state
         self.shift_list = shift_list
+        self.historic_shift_store = HistoricShiftStore()
+        self.changed_shift_id_set = set()
+        self.repair_shift_id_set = None
         self.solver_status = solver_status
         self.score = score
 
@@ -151,9 +280,94 @@ class EmployeeSchedule:
     def get_employee_list(self):
         return self.employee_list
 
-    @optapy.problem_fact_collection_property(Availability)
-    def get_availability_list(self):
-        return self.availability_list
+    @optapy.problem_fact_property(AvailabilityIndex)
+    def get_availability_index(self):
+        return self.availability_index
+
+    def add_availability(self, availability: Availability):
+        self.availability_list = self.availability_list + [availability]
+        self.availability_index.add(availability)
+
+    def find_employee(self, employee_name: str):
+        return next((employee for employee in self.employee_list if employee.name == employee_name), None)
+
+    # Sets, or with availability_type None removes, the availability of an employee on a date
+    def set_availability(self, employee: Employee, date: datetime.date, availability_type: AvailabilityType):
+        availability_list = [availability for availability in self.availability_list
+                             if availability.employee.name != employee.name or availability.date != date]
+        if availability_type is not None:
+            availability_list.append(Availability(employee, date, availability_type))
+        self.availability_list = availability_list
+        self.availability_index.set_availability_type(employee.name, date.toordinal(), availability_type)
+        self.mark_date_changed(date)
+
+    def find_shift(self, shift_id: int):
+        return next((shift for shift in self.shift_list if shift.id == shift_id), None)
+
+    def add_shift(self, shift: Shift):
+        self.shift_list.append(shift)
+        self.mark_shifts_changed([shift])
+
+    def remove_shift(self, shift_id: int):
+        self.shift_list = [shift for shift in self.shift_list if shift.id != shift_id]
+        self.changed_shift_id_set.discard(shift_id)
+
+    def mark_shifts_changed(self, shift_list: list[Shift]):
+        self.changed_shift_id_set.update(shift.id for shift in shift_list)
+
+    # An availability change can make any shift of its day better or worse for its employee
+    def mark_availability_changed(self, availability: Availability):
+        self.mark_date_changed(availability.date)
+
+    def mark_date_changed(self, date: datetime.date):
+        day = date.toordinal()
+        self.mark_shifts_changed([shift for shift in self.shift_list if shift.day == day])
+
+    # Unpins the draft shifts within a day of a changed shift for a repair solve, so the changed shifts
+    # can swap employees with their neighbours while everything else keeps its assignment.
+    # Returns the number of shifts to repair.
+    def start_repair(self):
+        changed_day_set = {shift.day for shift in self.shift_list if shift.id in self.changed_shift_id_set}
+        affected_day_set = {day + offset for day in changed_day_set for offset in (-1, 0, 1)}
+        self.repair_shift_id_set = {shift.id for shift in self.shift_list
+                                    if shift.day in affected_day_set and self.schedule_state.is_draft(shift)}
+        return len(self.repair_shift_id_set)
+
+    def finish_repair(self):
+        if self.repair_shift_id_set is not None:
+            self.changed_shift_id_set -= self.repair_shift_id_set
+        self.repair_shift_id_set = None
+
+    # Unpins everything again, keeping the changed shifts for the next repair
+    def cancel_repair(self):
+        self.repair_shift_id_set = None
+
+    # Rolling horizon: moves the historic shifts that end before the rest window preceding the draft,
+    # and the availabilities of their days, into the historic shift store. The remaining historic shifts
+    # are the pinned boundary the draft is solved against, so the working solution stays the same size
+    # however many times the schedule is published.
+    def archive_historic_shifts(self):
+        cutoff_minute = self.schedule_state.first_draft_minute - REST_WINDOW_IN_MINUTES
+        kept_shift_list = []
+        kept_day_set = set()
+        for shift in self.shift_list:
+            if shift.end_minute <= cutoff_minute:
+                self.historic_shift_store.add_shift(shift)
+            else:
+                kept_shift_list.append(shift)
+                kept_day_set.add(shift.day)
+        self.shift_list = kept_shift_list
+
+        first_draft_day = self.schedule_state.first_draft_day
+        kept_availability_list = []
+        for availability in self.availability_list:
+            day = availability.date.toordinal()
+            if day >= first_draft_day or day in kept_day_set:
+                kept_availability_list.append(availability)
+            else:
+                self.historic_shift_store.add_availability(availability)
+        self.availability_list = kept_availability_list
+        self.availability_index = AvailabilityIndex(kept_availability_list)
 
     @optapy.planning_entity_collection_property(Shift)
     def get_shift_list(self):
@@ -1,5 +1,5 @@
-from services import app, generate_demo_data
+from services import app, generate_demo_data, problem_registry, DEFAULT_SCHEDULE_ID
 
 if __name__ == "__main__":
-    generate_demo_data()
+    problem_registry.add(generate_demo_data(), DEFAULT_SCHEDULE_ID)
     app.run()
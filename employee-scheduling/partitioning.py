@@ -0,0 +1,81 @@
+import concurrent.futures
+import threading
+from optapy import solver_factory_create
+from domain import Shift, EmployeeSchedule
+
+DEFAULT_WINDOW_LENGTH_IN_DAYS = 7
+
+
+def get_partition_key(schedule_state, shift, window_length_in_days=DEFAULT_WINDOW_LENGTH_IN_DAYS):
+    window = (shift.day - schedule_state.first_draft_day) // window_length_in_days
+    return shift.location, window
+
+
+# Splits the draft shifts of a schedule into one sub-schedule per location and window of
+# window_length_in_days days. The sub-schedules hold copies of the shifts, so they can be solved
+# while the schedule itself is read or changed.
+def partition_schedule(schedule, window_length_in_days=DEFAULT_WINDOW_LENGTH_IN_DAYS) -> list[EmployeeSchedule]:
+    schedule_state = schedule.schedule_state
+    shift_list_by_key = dict()
+    for shift in schedule.shift_list:
+        if schedule_state.is_draft(shift):
+            key = get_partition_key(schedule_state, shift, window_length_in_days)
+            shift_list_by_key.setdefault(key, []).append(Shift(shift.id, shift.start, shift.end, shift.location,
+                                                               shift.required_skill, shift.employee))
+    availability_list_by_day = dict()
+    for availability in schedule.availability_list:
+        availability_list_by_day.setdefault(availability.date.toordinal(), []).append(availability)
+
+    partition_list = []
+    for shift_list in shift_list_by_key.values():
+        day_set = {shift.day for shift in shift_list}
+        availability_list = [availability for day in sorted(day_set)
+                             for availability in availability_list_by_day.get(day, [])]
+        partition_list.append(EmployeeSchedule(schedule_state, availability_list, schedule.employee_list,
+                                               shift_list, None))
+    return partition_list
+
+
+# Copies the employees assigned in the solved partitions back onto the schedule.
+# Employees are matched by name, as the solver returns its own copies of them.
+def merge_partitions(schedule, partition_list):
+    employee_by_name = {employee.name: employee for employee in schedule.employee_list}
+    employee_name_by_shift_id = {shift.id: shift.employee.name if shift.employee is not None else None
+                                 for partition in partition_list for shift in partition.shift_list}
+    for shift in schedule.shift_list:
+        if shift.id in employee_name_by_shift_id:
+            employee_name = employee_name_by_shift_id[shift.id]
+            shift.employee = employee_by_name[employee_name] if employee_name is not None else None
+    return schedule
+
+
+# Solves the partitions of one schedule in parallel, each with its own solver, on at most
+# partition_thread_count threads. Constraints between partitions (an employee working at two locations,
+# rest time across a window boundary) are left to the global solve that follows.
+class PartitionedSearch:
+    def __init__(self, partition_solver_config, partition_thread_count):
+        self.solver_factory = solver_factory_create(partition_solver_config)
+        self.partition_thread_count = partition_thread_count
+        self.lock = threading.Lock()
+        self.solver_list = []
+        self.is_terminated_early = False
+
+    def solve(self, partition_list):
+        if not partition_list:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.partition_thread_count) as executor:
+            return list(executor.map(self._solve_partition, partition_list))
+
+    def _solve_partition(self, partition):
+        solver = self.solver_factory.buildSolver()
+        with self.lock:
+            if self.is_terminated_early:
+                return partition
+            self.solver_list.append(solver)
+        return solver.solve(partition)
+
+    def terminate_early(self):
+        with self.lock:
+            self.is_terminated_early = True
+            for solver in self.solver_list:
+                solver.terminateEarly()
@@ -0,0 +1,53 @@
+from optapy import problem_change
+
+# Each change does its work in apply(working_solution, problem_change_director), so the same change can be
+# submitted to a running solver (doChange) or applied to a schedule that is not being solved
+# (ProblemRegistry.apply_problem_change). Shifts and employees are referenced by id and name, as the solver
+# works on its own copies of them. Changed shifts are marked for the next repair solve.
+
+
+@problem_change
+class AddShiftProblemChange:
+    def __init__(self, shift):
+        self.shift = shift
+
+    def apply(self, working_solution, problem_change_director):
+        problem_change_director.addEntity(self.shift, lambda shift: working_solution.add_shift(shift))
+
+    def doChange(self, working_solution, problem_change_director):
+        self.apply(working_solution, problem_change_director)
+
+
+@problem_change
+class RemoveShiftProblemChange:
+    def __init__(self, shift_id):
+        self.shift_id = shift_id
+
+    def apply(self, working_solution, problem_change_director):
+        working_shift = working_solution.find_shift(self.shift_id)
+        if working_shift is not None:
+            problem_change_director.removeEntity(working_shift,
+                                                 lambda shift: working_solution.remove_shift(self.shift_id))
+
+    def doChange(self, working_solution, problem_change_director):
+        self.apply(working_solution, problem_change_director)
+
+
+# The constraints only read availabilities through the AvailabilityIndex, so that is the only fact that changes;
+# the Availability list, which is not a problem fact, is updated alongside it for display
+@problem_change
+class ChangeAvailabilityProblemChange:
+    def __init__(self, employee_name, date, availability_type):
+        self.employee_name = employee_name
+        self.date = date
+        self.availability_type = availability_type
+
+    def apply(self, working_solution, problem_change_director):
+        working_employee = working_solution.find_employee(self.employee_name)
+        problem_change_director.changeProblemProperty(
+            working_solution.availability_index,
+            lambda availability_index: working_solution.set_availability(working_employee, self.date,
+                                                                         self.availability_type))
+
+    def doChange(self, working_solution, problem_change_director):
+        self.apply(working_solution, problem_change_director)
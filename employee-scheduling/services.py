@@ -1,13 +1,19 @@
 from domain import Employee, Shift, Availability, AvailabilityType, ScheduleState, EmployeeSchedule
+from problem_registry import ProblemRegistry, UnknownProblemError, SolverCapacityError
+from solver_job_queue import SolverJobQueue
+from solver_config_factory import SolverSettings, build_solver_config, parse_bool
+from partitioning import PartitionedSearch, partition_schedule, merge_partitions
+from problem_changes import AddShiftProblemChange, RemoveShiftProblemChange, ChangeAvailabilityProblemChange
 import datetime
+import itertools
+import os
+import threading
 from random import Random
 from optapy import solver_manager_create, score_manager_create
-import optapy.config
-from optapy.types import Duration, SolverStatus
+from optapy.types import SolverStatus
 from optapy.score import HardSoftScore
 from constraints import employee_scheduling_constraints
-from typing import Optional
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request, abort
 
 app = Flask(__name__)
 
@@ -37,17 +43,16 @@ SHIFT_START_TIME_COMBOS = (
 )
 
 location_to_shift_start_time_list_dict = dict()
-id_generator = 0
-schedule: Optional[EmployeeSchedule] = None
+# Requests are served on several threads; next() on a count is atomic, unlike reading and incrementing an int
+shift_id_sequence = itertools.count()
 
 
-def generate_demo_data():
-    global schedule
+def generate_demo_data() -> EmployeeSchedule:
     INITIAL_ROSTER_LENGTH_IN_DAYS = 14
     START_DATE = next_weekday(datetime.date.today(), 0)  # next Monday
 
     schedule_state = ScheduleState()
-    schedule_state.first_draft_date = START_DATE
+    schedule_state.set_first_draft_date(START_DATE)
     schedule_state.draft_length = INITIAL_ROSTER_LENGTH_IN_DAYS
     schedule_state.publish_length = 7
     schedule_state.last_historic_date = START_DATE
@@ -84,7 +89,7 @@ def generate_demo_data():
             availability.availability_type = availability_type
             availability_list.append(availability)
         shift_list.extend(generate_shifts_for_day(date, random))
-    schedule = EmployeeSchedule(
+    return EmployeeSchedule(
         schedule_state,
         availability_list,
         employee_list,
@@ -106,7 +111,6 @@ def generate_shifts_for_day(date: datetime.date, random: Random):
 
 def generate_shift_for_timeslot(timeslot_start: datetime.datetime, timeslot_end: datetime.datetime,
                                 location: str, random: Random):
-    global id_generator
     shift_count = random.choices([1, 2], [0.8, 0.2])[0]
 
     for i in range(shift_count):
@@ -118,18 +122,15 @@ def generate_shift_for_timeslot(timeslot_start: datetime.datetime, timeslot_end:
             required_skill = pick_random(OPTIONAL_SKILLS, random)
 
         shift = Shift()
-        shift.id = id_generator
-        shift.start = timeslot_start
-        shift.end = timeslot_end
+        shift.id = next(shift_id_sequence)
+        shift.set_start_and_end(timeslot_start, timeslot_end)
         shift.required_skill = required_skill
         shift.location = location
         shift.employee = None
-        id_generator += 1
         return shift
 
 
-def generate_draft_shifts():
-    global schedule
+def generate_draft_shifts(schedule: EmployeeSchedule):
     random = Random(0)
     for i in range(schedule.schedule_state.publish_length):
         employees_with_availabilities_on_day = pick_subset(schedule.employee_list, random, 4, 3, 2, 1)
@@ -140,8 +141,10 @@ def generate_draft_shifts():
             availability.date = date
             availability.employee = employee
             availability.availability_type = availability_type
-            schedule.availability_list.append(availability)
-        schedule.shift_list.extend(generate_shifts_for_day(date, random))
+            schedule.add_availability(availability)
+        shift_list = generate_shifts_for_day(date, random)
+        schedule.shift_list.extend(shift_list)
+        schedule.mark_shifts_changed(shift_list)
 
 
 def pick_random(source: list, random: Random):
@@ -165,32 +168,103 @@ def join_all_combinations(*part_arrays: list[str]):
     return combinations
 
 
-SINGLETON_ID = 1
-solver_config = optapy.config.solver.SolverConfig()
-solver_config\
-    .withSolutionClass(EmployeeSchedule)\
-    .withEntityClasses(Shift)\
-    .withConstraintProviderClass(employee_scheduling_constraints)\
-    .withTerminationSpentLimit(Duration.ofSeconds(60))
+DEFAULT_SCHEDULE_ID = 1
+solver_settings = SolverSettings.load('SCHEDULING', spent_limit_seconds=60, partition_spent_limit_seconds=20,
+                                      repair_spent_limit_seconds=10)
+solver_config = build_solver_config(EmployeeSchedule, [Shift], employee_scheduling_constraints, solver_settings)
+partition_solver_config = build_solver_config(EmployeeSchedule, [Shift], employee_scheduling_constraints,
+                                              solver_settings, solver_settings.partition_spent_limit_seconds)
+# A repair solve only reassigns the shifts around an edit and stops as soon as the schedule is feasible
+repair_solver_config = build_solver_config(EmployeeSchedule, [Shift], employee_scheduling_constraints,
+                                           solver_settings, solver_settings.repair_spent_limit_seconds,
+                                           terminate_when_feasible=True)
+
+# In rolling horizon mode publishing moves shifts no constraint can see anymore out of the working solution
+rolling_horizon = parse_bool(os.environ.get('SCHEDULING_ROLLING_HORIZON', 'false'))
+# Whether publishing starts a repair solve of the new draft shifts right away
+repair_after_edit = parse_bool(os.environ.get('SCHEDULING_REPAIR_AFTER_EDIT', 'false'))
 
 solver_manager = solver_manager_create(solver_config)
+repair_solver_manager = solver_manager_create(repair_solver_config)
 score_manager = score_manager_create(solver_manager)
 last_score = HardSoftScore.ZERO
+# By default as many solver slots as there are cores left over by the move threads of each solve
+solver_slot_count = int(os.environ.get('SCHEDULING_MAX_CONCURRENT_SOLVES',
+                                       str(solver_settings.get_solver_slot_count())))
+problem_registry = ProblemRegistry(solver_manager,
+                                   max_problem_count=int(os.environ.get('SCHEDULING_MAX_PROBLEM_COUNT', '32')),
+                                   max_concurrent_solves=solver_slot_count,
+                                   pinned_problem_ids={DEFAULT_SCHEDULE_ID})
+solver_job_queue = SolverJobQueue(problem_registry, solver_slot_count,
+                                  max_queued_job_count=int(os.environ.get('SCHEDULING_MAX_QUEUED_JOB_COUNT', '64')))
+
+
+@app.errorhandler(UnknownProblemError)
+def handle_unknown_schedule(error):
+    return jsonify({'details': str(error), 'stack': ''}), 404
+
 
+@app.errorhandler(SolverCapacityError)
+def handle_solver_capacity(error):
+    return jsonify({'details': str(error), 'stack': ''}), 429
 
-@app.route('/schedule')
-def get_schedule():
-    global schedule
-    solver_status = get_solver_status()
-    solution = schedule
-    score = score_manager.updateScore(solution)
-    solution.solver_status = solver_status
-    solution.score = score
-    return jsonify(solution.to_dict())
 
+@app.route('/schedules', methods=['GET'])
+def get_schedules():
+    return jsonify(problem_registry.get_problem_ids())
 
-def get_solver_status():
-    return solver_manager.getSolverStatus(SINGLETON_ID)
+
+@app.route('/schedules', methods=['POST'])
+def create_schedule():
+    return {'id': problem_registry.add(generate_demo_data())}
+
+
+@app.route('/schedules/<int:schedule_id>', methods=['DELETE'])
+def delete_schedule(schedule_id):
+    problem_registry.remove(schedule_id)
+    return dict()
+
+
+@app.route('/schedule', defaults={'schedule_id': DEFAULT_SCHEDULE_ID})
+@app.route('/schedules/<int:schedule_id>')
+def get_schedule(schedule_id):
+    entry = problem_registry.get_entry(schedule_id)
+    with entry.lock:
+        solution = entry.solution
+        solver_status = get_solver_status(schedule_id)
+        score = score_manager.updateScore(solution)
+        solution.solver_status = solver_status
+        solution.score = score
+        return jsonify(solution.to_dict())
+
+
+def get_solver_status(schedule_id):
+    if problem_registry.get_entry(schedule_id).is_queued:
+        return SolverStatus.SOLVING_SCHEDULED
+    return problem_registry.get_solver_manager(schedule_id).getSolverStatus(schedule_id)
+
+
+# The partitioned searches in progress by schedule id, read by stop_solving from request threads
+partitioned_searches = dict()
+partitioned_search_lock = threading.Lock()
+
+
+# With partitioned search enabled, each location and week of the draft is first solved on its own in parallel;
+# the merged result is then the starting point of the global solve
+def find_schedule_with_partitioned_search(schedule_id):
+    entry = problem_registry.get_entry(schedule_id)
+    with entry.lock:
+        partition_list = partition_schedule(entry.solution)
+    partitioned_search = PartitionedSearch(partition_solver_config, solver_settings.get_partition_thread_count())
+    with partitioned_search_lock:
+        partitioned_searches[schedule_id] = partitioned_search
+    try:
+        solved_partition_list = partitioned_search.solve(partition_list)
+    finally:
+        with partitioned_search_lock:
+            partitioned_searches.pop(schedule_id, None)
+    with entry.lock:
+        return merge_partitions(entry.solution, solved_partition_list)
 
 
 def error_handler(problem_id, exception):
@@ -198,41 +272,150 @@ def error_handler(problem_id, exception):
     exception.printStackTrace()
 
 
-@app.route('/solve', methods=['POST'])
-def solve():
-    solver_manager.solveAndListen(SINGLETON_ID, find_by_id, save, error_handler)
+@app.route('/solve', methods=['POST'], defaults={'schedule_id': DEFAULT_SCHEDULE_ID})
+@app.route('/schedules/<int:schedule_id>/solve', methods=['POST'])
+def solve(schedule_id):
+    entry = problem_registry.get_entry(schedule_id)
+    with entry.lock:
+        if not entry.is_solving and not entry.is_queued:
+            # A full solve never keeps the pins of a cancelled repair
+            entry.solution.cancel_repair()
+    job = solver_job_queue.submit(schedule_id,
+                                  priority=request.args.get('priority', 0, type=int),
+                                  time_budget_seconds=request.args.get('timeBudgetSeconds', type=float),
+                                  exception_handler=error_handler,
+                                  problem_finder=find_schedule_with_partitioned_search
+                                  if solver_settings.partitioned_search else None)
+    return job.to_dict()
+
+
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+def get_solver_job(job_id):
+    job = solver_job_queue.get_job(job_id)
+    if job is None:
+        abort(404, f'There is no solver job with id ({job_id})')
+    return job.to_dict()
+
+
+@app.route('/publish', methods=['POST'], defaults={'schedule_id': DEFAULT_SCHEDULE_ID})
+@app.route('/schedules/<int:schedule_id>/publish', methods=['POST'])
+def publish(schedule_id):
+    entry = problem_registry.get_entry(schedule_id)
+    with entry.lock:
+        if entry.is_solving or entry.is_queued or get_solver_status(schedule_id) != SolverStatus.NOT_SOLVING:
+            raise RuntimeError('Cannot publish a schedule while solving in progress.')
+        schedule = entry.solution
+        schedule_state = schedule.schedule_state
+        new_historic_date = schedule_state.first_draft_date
+        new_draft_date = schedule_state.first_draft_date + datetime.timedelta(days=schedule_state.publish_length)
+
+        schedule_state.last_historic_date = new_historic_date
+        schedule_state.set_first_draft_date(new_draft_date)
+
+        generate_draft_shifts(schedule)
+        if rolling_horizon:
+            schedule.archive_historic_shifts()
+    if repair_after_edit:
+        return repair(schedule_id)
     return dict()
 
 
-@app.route('/publish', methods=['POST'])
-def publish():
-    global schedule
-    if get_solver_status() != SolverStatus.NOT_SOLVING:
-        raise RuntimeError('Cannot publish a schedule while solving in progress.')
-    schedule_state = schedule.schedule_state
-    new_historic_date = schedule_state.first_draft_date
-    new_draft_date = schedule_state.first_draft_date + datetime.timedelta(days=schedule_state.publish_length)
-
-    schedule_state.last_historic_date = new_historic_date
-    schedule_state.first_draft_date = new_draft_date
-
-    generate_draft_shifts()
+def finish_repair(schedule_id, schedule):
+    entry = problem_registry.get_entry(schedule_id)
+    with entry.lock:
+        entry.solution.finish_repair()
+
+
+def repair_error_handler(schedule_id, exception):
+    entry = problem_registry.get_entry(schedule_id)
+    with entry.lock:
+        entry.solution.cancel_repair()
+    error_handler(schedule_id, exception)
+
+
+# Re-solves only the shifts changed since the last repair (new draft shifts, shifts on days with edited
+# availabilities) and their neighbours, starting from the current assignment
+@app.route('/repair', methods=['POST'], defaults={'schedule_id': DEFAULT_SCHEDULE_ID})
+@app.route('/schedules/<int:schedule_id>/repair', methods=['POST'])
+def repair(schedule_id):
+    entry = problem_registry.get_entry(schedule_id)
+    with entry.lock:
+        if entry.is_solving or entry.is_queued:
+            raise RuntimeError('Cannot repair a schedule while solving in progress.')
+        if entry.solution.start_repair() == 0:
+            entry.solution.cancel_repair()
+            return dict()
+    job = solver_job_queue.submit(schedule_id,
+                                  priority=request.args.get('priority', 0, type=int),
+                                  final_best_solution_consumer=finish_repair,
+                                  exception_handler=repair_error_handler,
+                                  solver_manager=repair_solver_manager)
+    return job.to_dict()
+
+
+def get_json_field(data, name, parse):
+    try:
+        return parse(data[name])
+    except (KeyError, TypeError, ValueError):
+        abort(400, f'Field ({name}) is missing or invalid.')
+
+
+# Edits go through the solver as problem changes while solving, so it keeps its state and score caches.
+# The edited shifts are marked changed, so a repair solve reassigns them once solving stopped.
+@app.route('/shifts', methods=['POST'], defaults={'schedule_id': DEFAULT_SCHEDULE_ID})
+@app.route('/schedules/<int:schedule_id>/shifts', methods=['POST'])
+def add_shift(schedule_id):
+    problem_registry.get_entry(schedule_id)
+    data = request.get_json(silent=True) or dict()
+    start = get_json_field(data, 'start', datetime.datetime.fromisoformat)
+    end = get_json_field(data, 'end', datetime.datetime.fromisoformat)
+    if end <= start:
+        abort(400, f'The shift end ({end}) must be after its start ({start}).')
+    shift = Shift(next(shift_id_sequence), start, end, get_json_field(data, 'location', str),
+                  get_json_field(data, 'required_skill', str))
+    problem_registry.apply_problem_change(schedule_id, AddShiftProblemChange(shift))
+    return shift.to_dict()
+
+
+@app.route('/shifts/<int:shift_id>', methods=['DELETE'], defaults={'schedule_id': DEFAULT_SCHEDULE_ID})
+@app.route('/schedules/<int:schedule_id>/shifts/<int:shift_id>', methods=['DELETE'])
+def remove_shift(schedule_id, shift_id):
+    if problem_registry.find_by_id(schedule_id).find_shift(shift_id) is None:
+        abort(404, f'There is no shift with id ({shift_id})')
+    problem_registry.apply_problem_change(schedule_id, RemoveShiftProblemChange(shift_id))
     return dict()
 
 
-@app.route('/stopSolving', methods=['POST'])
-def stop_solving():
-    solver_manager.terminateEarly(SINGLETON_ID)
+# Sets the availability of an employee on a date; an availability_type of null removes it
+@app.route('/availabilities', methods=['PUT'], defaults={'schedule_id': DEFAULT_SCHEDULE_ID})
+@app.route('/schedules/<int:schedule_id>/availabilities', methods=['PUT'])
+def set_availability(schedule_id):
+    data = request.get_json(silent=True) or dict()
+    employee_name = get_json_field(data, 'employee', str)
+    date = get_json_field(data, 'date', datetime.date.fromisoformat)
+    availability_type = None if data.get('availability_type') is None else \
+        get_json_field(data, 'availability_type', AvailabilityType)
+    if problem_registry.find_by_id(schedule_id).find_employee(employee_name) is None:
+        abort(404, f'There is no employee named ({employee_name})')
+    problem_registry.apply_problem_change(schedule_id,
+                                          ChangeAvailabilityProblemChange(employee_name, date, availability_type))
     return dict()
 
 
-def find_by_id(schedule_id):
-    global schedule
-    if schedule_id != SINGLETON_ID:
-        raise ValueError(f'There is no schedule with id ({schedule_id})')
-    return schedule
+@app.route('/history', defaults={'schedule_id': DEFAULT_SCHEDULE_ID})
+@app.route('/schedules/<int:schedule_id>/history')
+def get_history(schedule_id):
+    entry = problem_registry.get_entry(schedule_id)
+    with entry.lock:
+        return jsonify(entry.solution.historic_shift_store.to_dict())
 
 
-def save(solution):
-    global schedule
-    schedule = solution
+@app.route('/stopSolving', methods=['POST'], defaults={'schedule_id': DEFAULT_SCHEDULE_ID})
+@app.route('/schedules/<int:schedule_id>/stopSolving', methods=['POST'])
+def stop_solving(schedule_id):
+    with partitioned_search_lock:
+        partitioned_search = partitioned_searches.get(schedule_id)
+    if partitioned_search is not None:
+        partitioned_search.terminate_early()
+    solver_job_queue.stop(schedule_id)
+    return dict()
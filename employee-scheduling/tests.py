@@ -1,9 +1,18 @@
-from domain import AvailabilityType, Availability, Employee, Shift, EmployeeSchedule
+from domain import AvailabilityType, Availability, AvailabilityIndex, Employee, Shift, EmployeeSchedule, \
+    ScheduleState, shift_pinning_filter, to_epoch_minute
+from partitioning import partition_schedule, merge_partitions
+from problem_changes import AddShiftProblemChange, RemoveShiftProblemChange, ChangeAvailabilityProblemChange
+from problem_registry import ProblemRegistry
+from solver_config_factory import SolverSettings, build_solver_config
 from constraints import employee_scheduling_constraints, required_skill, no_overlapping_shifts, \
     at_least_10_hours_between_two_shifts, desired_day_for_employee, undesired_day_for_employee, unavailable_employee
 
+from optapy import solver_factory_create
+from optapy.score import HardSoftScore
 from optapy.test import ConstraintVerifier, constraint_verifier_build
 from datetime import date, time, datetime, timedelta
+import glob
+import os
 
 DAY_1 = date(2021, 2, 1)
 DAY_2 = date(2021, 2, 2)
@@ -119,6 +128,16 @@ def test_at_least_10_hours_between_consecutive_shifts():
                      "Location 2", "Skill", employee1)) \
         .penalizes(0)
 
+    # Only the rest time between adjacent shifts counts: 8 hours after the first and 7 after the second
+    constraint_verifier.verify_that(at_least_10_hours_between_two_shifts) \
+        .given(employee1,
+               Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee1),
+               Shift(2, DAY_END_TIME + timedelta(hours=2), DAY_END_TIME + timedelta(hours=3), "Location 2", "Skill",
+                     employee1),
+               Shift(3, DAY_END_TIME + timedelta(hours=6), DAY_END_TIME + timedelta(hours=7), "Location", "Skill",
+                     employee1)) \
+        .penalizes_by(480 + 420)
+
 
 def test_unavailable_employee():
     employee1 = Employee("Amy", ["Skill"])
@@ -127,26 +146,26 @@ def test_unavailable_employee():
     desired = Availability(employee1, DAY_1, AvailabilityType.DESIRED)
     constraint_verifier.verify_that(unavailable_employee) \
         .given(employee1,
-               unavailability,
+               AvailabilityIndex([unavailability]),
                Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee1)) \
         .penalizes_by(int(timedelta(hours=8).total_seconds() // 60))
 
     constraint_verifier.verify_that(unavailable_employee) \
         .given(employee1,
-               unavailability,
+               AvailabilityIndex([unavailability]),
                Shift(1, DAY_START_TIME + timedelta(days=1), DAY_END_TIME + timedelta(days=1),
                      "Location", "Skill", employee1)) \
         .penalizes(0)
 
     constraint_verifier.verify_that(unavailable_employee) \
         .given(employee1,
-               unavailability,
+               AvailabilityIndex([unavailability]),
                Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee2)) \
         .penalizes(0)
 
     constraint_verifier.verify_that(unavailable_employee) \
         .given(employee1,
-               desired,
+               AvailabilityIndex([desired]),
                Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee1)) \
         .penalizes(0)
 
@@ -158,26 +177,26 @@ def test_desired_day_for_employee():
     desired = Availability(employee1, DAY_1, AvailabilityType.DESIRED)
     constraint_verifier.verify_that(desired_day_for_employee) \
         .given(employee1,
-               desired,
+               AvailabilityIndex([desired]),
                Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee1)) \
         .rewards_with(int(timedelta(hours=8).total_seconds() // 60))
 
     constraint_verifier.verify_that(desired_day_for_employee) \
         .given(employee1,
-               desired,
+               AvailabilityIndex([desired]),
                Shift(1, DAY_START_TIME + timedelta(days=1), DAY_END_TIME + timedelta(days=1),
                      "Location", "Skill", employee1)) \
         .rewards(0)
 
     constraint_verifier.verify_that(desired_day_for_employee) \
         .given(employee1,
-               desired,
+               AvailabilityIndex([desired]),
                Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee2)) \
         .rewards(0)
 
     constraint_verifier.verify_that(desired_day_for_employee) \
         .given(employee1,
-               unavailability,
+               AvailabilityIndex([unavailability]),
                Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee1)) \
         .rewards(0)
 
@@ -189,25 +208,198 @@ def test_undesired_day_for_employee():
     undesired = Availability(employee1, DAY_1, AvailabilityType.UNDESIRED)
     constraint_verifier.verify_that(undesired_day_for_employee) \
         .given(employee1,
-               undesired,
+               AvailabilityIndex([undesired]),
                Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee1)) \
         .penalizes_by(int(timedelta(hours=8).total_seconds() // 60))
 
     constraint_verifier.verify_that(undesired_day_for_employee) \
         .given(employee1,
-               undesired,
+               AvailabilityIndex([undesired]),
                Shift(1, DAY_START_TIME + timedelta(days=1), DAY_END_TIME + timedelta(days=1),
                      "Location", "Skill", employee1)) \
         .penalizes(0)
 
     constraint_verifier.verify_that(undesired_day_for_employee) \
         .given(employee1,
-               undesired,
+               AvailabilityIndex([undesired]),
                Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee2)) \
         .penalizes(0)
 
     constraint_verifier.verify_that(undesired_day_for_employee) \
         .given(employee1,
-               unavailability,
+               AvailabilityIndex([unavailability]),
                Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee1)) \
         .penalizes(0)
+
+
+def test_shift_minutes_and_day():
+    shift = Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill")
+    assert shift.end_minute - shift.start_minute == 8 * 60
+    assert shift.day == DAY_1.toordinal()
+
+    shift.set_start_and_end(AFTERNOON_START_TIME + timedelta(days=1), AFTERNOON_END_TIME + timedelta(days=1))
+    assert shift.start_minute - (DAY_START_TIME - datetime(1970, 1, 1)) // timedelta(minutes=1) == 28 * 60
+    assert shift.day == DAY_2.toordinal()
+
+
+def test_archive_historic_shifts():
+    employee1 = Employee("Amy", ["Skill"])
+    night_start_time = datetime.combine(DAY_2, time(22, 0))
+    shift_list = [
+        Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee1),
+        Shift(2, night_start_time, night_start_time + timedelta(hours=8), "Location", "Skill", employee1),
+        Shift(3, DAY_START_TIME + timedelta(days=2), DAY_END_TIME + timedelta(days=2), "Location", "Skill"),
+    ]
+    availability_list = [Availability(employee1, DAY_1, AvailabilityType.DESIRED),
+                         Availability(employee1, DAY_2, AvailabilityType.UNDESIRED),
+                         Availability(employee1, DAY_3, AvailabilityType.UNAVAILABLE)]
+    schedule = EmployeeSchedule(ScheduleState(7, 14, DAY_3, DAY_2), availability_list, [employee1], shift_list,
+                                None)
+
+    schedule.archive_historic_shifts()
+    assert [shift.id for shift in schedule.shift_list] == [2, 3]
+    assert schedule.availability_list == availability_list[1:]
+    assert schedule.availability_index.get_availability_type(employee1, DAY_1.toordinal()) is None
+    assert len(schedule.historic_shift_store) == 1
+    historic_shift = schedule.historic_shift_store.get_shift_list()[0]
+    assert (historic_shift.id, historic_shift.start, historic_shift.end, historic_shift.employee) == \
+           (1, DAY_START_TIME, DAY_END_TIME, employee1)
+    assert schedule.historic_shift_store.availability_list == availability_list[:1]
+
+
+def test_repair_neighbourhood():
+    employee1 = Employee("Amy", ["Skill"])
+    shift_list = [Shift(i, DAY_START_TIME + timedelta(days=i), DAY_END_TIME + timedelta(days=i), "Location", "Skill",
+                        employee1) for i in range(7)]
+    schedule = EmployeeSchedule(ScheduleState(7, 14, DAY_2, DAY_2), [], [employee1], shift_list, None)
+
+    schedule.mark_shifts_changed(shift_list[5:6])
+    schedule.mark_availability_changed(Availability(employee1, DAY_2, AvailabilityType.UNAVAILABLE))
+    assert schedule.start_repair() == 5
+    assert schedule.repair_shift_id_set == {1, 2, 4, 5, 6}
+    assert shift_pinning_filter(schedule, shift_list[0])
+    assert shift_pinning_filter(schedule, shift_list[3])
+    assert not shift_pinning_filter(schedule, shift_list[4])
+
+    schedule.finish_repair()
+    assert schedule.repair_shift_id_set is None
+    assert schedule.changed_shift_id_set == set()
+    assert not shift_pinning_filter(schedule, shift_list[3])
+
+
+def test_problem_changes_without_solver():
+    employee1 = Employee("Amy", ["Skill"])
+    shift1 = Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee1)
+    schedule = EmployeeSchedule(ScheduleState(7, 14, DAY_1, DAY_1), [], [employee1], [shift1], None)
+    problem_registry = ProblemRegistry(None)
+    schedule_id = problem_registry.add(schedule)
+
+    shift2 = Shift(2, DAY_START_TIME + timedelta(days=1), DAY_END_TIME + timedelta(days=1), "Location", "Skill")
+    assert problem_registry.apply_problem_change(schedule_id, AddShiftProblemChange(shift2))
+    assert schedule.find_shift(2) is shift2
+    assert schedule.changed_shift_id_set == {2}
+
+    original_availability_list = schedule.availability_list
+    assert problem_registry.apply_problem_change(
+        schedule_id, ChangeAvailabilityProblemChange("Amy", DAY_1, AvailabilityType.UNAVAILABLE))
+    assert schedule.availability_index.get_availability_type(employee1, DAY_1.toordinal()) == \
+        AvailabilityType.UNAVAILABLE
+    assert [availability.availability_type for availability in schedule.availability_list] == \
+        [AvailabilityType.UNAVAILABLE]
+    # The list shared with earlier copies of the schedule is left unchanged
+    assert original_availability_list == []
+    assert schedule.changed_shift_id_set == {1, 2}
+
+    problem_registry.apply_problem_change(schedule_id, ChangeAvailabilityProblemChange("Amy", DAY_1, None))
+    assert schedule.availability_index.get_availability_type(employee1, DAY_1.toordinal()) is None
+    assert schedule.availability_list == []
+
+    assert problem_registry.apply_problem_change(schedule_id, RemoveShiftProblemChange(1))
+    assert schedule.shift_list == [shift2]
+    assert schedule.changed_shift_id_set == {2}
+
+
+def test_is_draft():
+    schedule_state = ScheduleState(7, 14, DAY_2, DAY_1)
+    assert schedule_state.first_draft_minute == to_epoch_minute(datetime.combine(DAY_2, time.min))
+    assert schedule_state.is_draft(Shift(1, datetime.combine(DAY_2, time.min), DAY_END_TIME + timedelta(days=1),
+                                         "Location", "Skill"))
+    assert not schedule_state.is_draft(Shift(2, datetime.combine(DAY_1, time(23, 59)),
+                                             datetime.combine(DAY_2, time(7, 59)), "Location", "Skill"))
+    schedule_state.set_first_draft_date(DAY_1)
+    assert schedule_state.is_draft(Shift(3, DAY_START_TIME, DAY_END_TIME, "Location", "Skill"))
+
+
+def test_availability_constraints_share_lookup():
+    employee1 = Employee("Amy", ["Skill"])
+    availability_index = AvailabilityIndex([Availability(employee1, DAY_1, AvailabilityType.UNAVAILABLE),
+                                            Availability(employee1, DAY_2, AvailabilityType.DESIRED)])
+    shift_minutes = int(timedelta(hours=8).total_seconds() // 60)
+    constraint_verifier.verify_that() \
+        .given(employee1, availability_index,
+               Shift(1, DAY_START_TIME, DAY_END_TIME, "Location", "Skill", employee1),
+               Shift(2, DAY_START_TIME + timedelta(days=1), DAY_END_TIME + timedelta(days=1),
+                     "Location", "Skill", employee1),
+               Shift(3, DAY_START_TIME + timedelta(days=2), DAY_END_TIME + timedelta(days=2),
+                     "Location", "Skill", employee1)) \
+        .scores(HardSoftScore.of(-shift_minutes, shift_minutes))
+
+
+def test_partition_schedule():
+    employee1 = Employee("Amy", ["Skill"])
+    employee2 = Employee("Beth", ["Skill"])
+    schedule_state = ScheduleState(7, 14, DAY_2, DAY_2)
+    week_2_start_time = DAY_START_TIME + timedelta(days=8)
+    shift_list = [
+        Shift(1, DAY_START_TIME, DAY_END_TIME, "Location A", "Skill", employee1),
+        Shift(2, DAY_START_TIME + timedelta(days=1), DAY_END_TIME + timedelta(days=1), "Location A", "Skill"),
+        Shift(3, DAY_START_TIME + timedelta(days=1), DAY_END_TIME + timedelta(days=1), "Location B", "Skill"),
+        Shift(4, week_2_start_time, week_2_start_time + timedelta(hours=8), "Location A", "Skill"),
+    ]
+    availability_list = [Availability(employee1, DAY_2, AvailabilityType.DESIRED),
+                         Availability(employee2, DAY_3, AvailabilityType.UNAVAILABLE)]
+    schedule = EmployeeSchedule(schedule_state, availability_list, [employee1, employee2], shift_list, None)
+
+    partition_list = partition_schedule(schedule)
+    assert [[shift.id for shift in partition.shift_list] for partition in partition_list] == [[2], [3], [4]]
+    assert partition_list[0].availability_list == availability_list[:1]
+    assert partition_list[2].availability_list == []
+
+    partition_list[0].shift_list[0].employee = Employee("Beth", ["Skill"])
+    partition_list[2].shift_list[0].employee = Employee("Amy", ["Skill"])
+    merge_partitions(schedule, partition_list)
+    assert [shift.employee for shift in shift_list] == [employee1, employee2, None, employee1]
+
+    # Moving the draft start moves the windows, which are counted in days from it
+    schedule_state.set_first_draft_date(DAY_1)
+    assert schedule_state.first_draft_day == DAY_1.toordinal()
+    assert [[shift.id for shift in partition.shift_list] for partition in partition_schedule(schedule)] == \
+           [[1, 2], [3], [4]]
+
+
+def test_solve_with_move_threads():
+    solver_settings = SolverSettings(spent_limit_seconds=1, move_thread_count='2')
+    solver_config = build_solver_config(EmployeeSchedule, [Shift], employee_scheduling_constraints, solver_settings)
+    assert solver_config.getMoveThreadCount() == '2'
+
+    employee_list = [Employee("Amy", ["Skill"]), Employee("Beth", ["Skill"])]
+    shift_list = [Shift(i, DAY_START_TIME + timedelta(days=i), DAY_END_TIME + timedelta(days=i), "Location", "Skill")
+                  for i in range(4)]
+    schedule = EmployeeSchedule(ScheduleState(7, 14, DAY_1, DAY_1), [], employee_list, shift_list, None)
+    solution = solver_factory_create(solver_config).buildSolver().solve(schedule)
+    assert all(shift.employee is not None for shift in solution.shift_list)
+
+
+# The modules shared by the apps are copied into each app, so that every app runs on its own;
+# this fails when one copy is changed without the others
+SHARED_MODULE_LIST = ['solver_config_factory.py', 'problem_registry.py', 'solver_job_queue.py']
+
+
+def test_shared_modules_are_identical():
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    for shared_module in SHARED_MODULE_LIST:
+        with open(os.path.join(app_dir, shared_module), 'rb') as file:
+            content = file.read()
+        for copy_path in glob.glob(os.path.join(app_dir, '..', '*', shared_module)):
+            with open(copy_path, 'rb') as file:
+                assert file.read() == content, f'{os.path.normpath(copy_path)} differs from {shared_module}.'
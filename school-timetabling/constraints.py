@@ -2,26 +2,9 @@ from datetime import datetime, date, timedelta
 from optapy import constraint_provider, get_class
 from optapy.constraint import ConstraintFactory, Joiners
 from optapy.score import HardSoftScore
-from domain import Lesson, Subjective, Teacher, Nucleo
+from domain import Lesson, Subjective, Teacher, Nucleo, TeacherHistory
 from utils import *
 
-# TODO: ID disciplina, Code disciplina, List(): Id Professores interessados
-possibilite_lesson_list = [
-    (1, "INF0291", [1, 2, 3]),
-    (2, "INF0292", [4, 5]),
-    (3, "INF0287", [6, 7, 8]),
-    (4, "INF0018", [9, 7]),
-    (5, "INF0283", [7, 6, 10]),
-    (6, "INF0294", [11, 12]),
-    (7, "INF0056", [2, 1]),
-    (8, "INF0299", [10, 6, 7]),
-    (9, "INF0285", [13, 14]),
-    (10, "INF0293", [15, 4]),
-    (11, "INF0300", [16, 13]),
-    (12, "INF0284", [17, 18]),
-    (13, "INF0288", [19, 20]),
-]
-
 # TODO: ID professor, name Professor, ENTRADA NUCLEO, id Nucleo
 nucleo_restriction_list = [
     (19, "Juliano Lopes de Oliveira", "dez./2022", [1]),
@@ -73,48 +56,41 @@ def define_constraints(constraint_factory):
     constraints.extend([
         # Restrições de conflitos de interesse de professores
         ## Garante que nenhum professor ensine a mesma disciplina mais de uma vez no mesmo ano.
-        constraint_factory.for_each(Lesson)
-                         .join(Lesson,
-                               Joiners.equal(lambda lesson: lesson.subject),
-                               Joiners.equal(lambda lesson: lesson.teacher))
-                         .penalize("Same teacher for the same subject", HardSoftScore.ofSoft(10)),
+        same_teacher_same_subject(constraint_factory),
 
         # Restrição de última aula ministrada
         ## Garante que professores que ministraram a disciplina na última vez que foi oferecida não a ministrem 
+        ## Uma consulta ao TeacherHistory por aula, em vez de uma junção com as aulas de todos os anos.
         constraint_factory.for_each(Lesson)
-                         .join(Lesson,
-                               Joiners.equal(lambda lesson: lesson.subject),
-                               Joiners.equal(lambda lesson: lesson.teacher),
-                               Joiners.filtering(lambda l1, l2: l1.year == l2.year - 1))
+                         .join(TeacherHistory)
+                         .filter(lambda lesson, teacher_history: teacher_history.get_run_length(lesson) >= 1)
                          .penalize("Teacher taught last time", HardSoftScore.ofSoft(10)),
 
         # Restrição de últimas duas aulas ministradas
         ## Garante que professores que ministraram a disciplina nas duas últimas vezes que foi oferecida não a ministrem novamente.
         constraint_factory.for_each(Lesson)
-                         .join(Lesson,
-                               Joiners.equal(lambda lesson: lesson.subject),
-                               Joiners.equal(lambda lesson: lesson.teacher),
-                               Joiners.filtering(lambda l1, l2: l1.year == l2.year - 2))
+                         .join(TeacherHistory)
+                         .filter(lambda lesson, teacher_history: teacher_history.get_run_length(lesson) >= 2)
                          .penalize("Teacher taught the last two times", HardSoftScore.ofSoft(10)),
 
     ])
     # Restrições de professores válidos para a disciplina
-    ## Garante que apenas professores permitidos podem ministrar certas disciplinas.
-    for possibility in possibilite_lesson_list:
-        subject_id, subject_code, allowed_teacher_ids = possibility
-        constraints.append(
-            constraint_factory.for_each(Lesson)
-                             .filter(lambda lesson: lesson.subject.id == subject_id)
-                             .filter(lambda lesson: lesson.teacher is not None)
-                             .filter(lambda lesson: lesson.teacher.id not in allowed_teacher_ids)
-                             .penalize("Invalid teacher for subject {}".format(subject_code), HardSoftScore.ONE_HARD)
-        )
+    ## Não é uma restrição: cada aula só pode receber os professores permitidos (Lesson.get_teacher_range).
 
     # Restrição de conflito de interesse de núcleo
     # constraints.append(conflicting_nucleo_interest(constraint_factory, nucleo_restriction_list))
     
     return constraints
 
+# Cada par de aulas do mesmo ano, disciplina e professor é penalizado uma vez;
+# for_each_unique_pair já ignora as aulas ainda sem professor
+def same_teacher_same_subject(constraint_factory: ConstraintFactory):
+    return constraint_factory.for_each_unique_pair(Lesson,
+                                                   Joiners.equal(lambda lesson: lesson.year),
+                                                   Joiners.equal(lambda lesson: lesson.subject_id),
+                                                   Joiners.equal(lambda lesson: lesson.get_teacher_id())) \
+        .penalize("Same teacher for the same subject", HardSoftScore.ofSoft(10))
+
 # Restrições de conflito de interesse de núcleo
 ## Garante que professores dentro do mesmo núcleo que já ministraram a disciplina no último ano não a ministrem novamente.
 def conflicting_nucleo_interest(constraint_factory: ConstraintFactory, nucleo_restriction_list):
@@ -128,11 +104,11 @@ def conflicting_nucleo_interest(constraint_factory: ConstraintFactory, nucleo_re
                     if constraint_id not in added_constraints:
                         return constraint_factory.for_each(Lesson)\
                                              .join(Lesson,
-                                                   Joiners.equal(lambda lesson: lesson.subject),
-                                                   Joiners.equal(lambda lesson: lesson.teacher),
+                                                   Joiners.equal(lambda lesson: lesson.subject_id),
+                                                   Joiners.equal(lambda lesson: lesson.get_teacher_id()),
                                                    Joiners.filtering(lambda l1, l2:
-                                                                     l1.teacher.id == teacher1_id and
-                                                                     l2.teacher.id == teacher2_id and
+                                                                     l1.get_teacher_id() == teacher1_id and
+                                                                     l2.get_teacher_id() == teacher2_id and
                                                                      l1.year == l2.year - 1))\
                                              .penalize(constraint_id, HardSoftScore.ONE_HARD)
                     added_constraints.add(constraint_id)
@@ -3,10 +3,11 @@ import datetime
 import optapy
 from optapy import problem_fact, planning_id, planning_entity, planning_variable, \
     planning_solution, planning_entity_collection_property, \
-    problem_fact_collection_property, \
+    problem_fact_collection_property, problem_fact_property, \
     value_range_provider, planning_score
 from optapy.types import HardSoftScore
 from datetime import time
+from timetabling_dataset import TimetablingDataset, NO_TEACHER_ID, get_default_dataset
 
 @problem_fact
 class Nucleo:
@@ -48,25 +49,42 @@ class Subjective:
     def __str__(self):
         return f"Subjective(id={self.id}, name={self.name})"
 
-@planning_entity
+# Lessons of the years before the timetable's target year already happened, so the solver never changes them
+def lesson_pinning_filter(timetable, lesson):
+    return timetable.target_year is not None and lesson.year < timetable.target_year
+
+
+@planning_entity(pinning_filter=lesson_pinning_filter)
 class Lesson:
-    def __init__(self, id: int, year: int, subject: Subjective, teacher: Teacher = None):
+    def __init__(self, id: int, year: int, subject: Subjective, teacher: Teacher = None,
+                 teacher_range: list[Teacher] = None):
         self.id = id
         self.year = year
         self.subject = subject
+        # Constraints join lessons on these integer keys instead of on the fact objects
+        self.subject_id = subject.id
         self.teacher = teacher
+        self.teacher_range = teacher_range if teacher_range is not None else []
 
     @planning_id
     def get_id(self):
         return self.id
 
-    @planning_variable(Teacher, ["teacherRange"])
+    # The solver only ever assigns a lesson one of the teachers allowed for its subject
+    @value_range_provider("lessonTeacherRange", value_range_type=Teacher)
+    def get_teacher_range(self):
+        return self.teacher_range
+
+    @planning_variable(Teacher, ["lessonTeacherRange"])
     def get_teacher(self):
         return self.teacher
 
     def set_teacher(self, new_teacher):
         self.teacher = new_teacher
 
+    def get_teacher_id(self):
+        return self.teacher.id if self.teacher is not None else None
+
     def __str__(self):
         return (
             f"Lesson("
@@ -78,6 +96,72 @@ class Lesson:
         )
 
 
+# The teachers allowed to teach each subject, as one frozenset of teacher ids per subject id.
+# Subjects without an entry allow every teacher. It is not a problem fact: the solver only sees
+# the teacher range it builds for each lesson.
+class SubjectEligibility:
+    def __init__(self, allowed_teacher_ids_by_subject_id: dict = None):
+        self.allowed_teacher_ids_by_subject_id = {subject_id: frozenset(teacher_ids) for subject_id, teacher_ids
+                                                  in (allowed_teacher_ids_by_subject_id or dict()).items()}
+
+    def is_allowed(self, subject_id, teacher_id):
+        allowed_teacher_ids = self.allowed_teacher_ids_by_subject_id.get(subject_id)
+        return allowed_teacher_ids is None or teacher_id in allowed_teacher_ids
+
+    # The teachers of teacher_list allowed to teach the lesson, plus the teacher it already has, if any
+    def get_teacher_range(self, lesson: Lesson, teacher_list: list[Teacher]):
+        return [teacher for teacher in teacher_list
+                if teacher is lesson.teacher or self.is_allowed(lesson.subject_id, teacher.id)]
+
+
+# Who taught each subject in the years before the target year, built once when the problem is loaded.
+# run_length_by_subject_teacher holds how many of the subject's latest offerings in a row the teacher taught,
+# so scoring a lesson is a single lookup.
+@problem_fact
+class TeacherHistory:
+    # There is one per timetable
+    ID = 0
+
+    def __init__(self, run_length_by_subject_teacher: dict = None, target_year: int = None):
+        self.id = TeacherHistory.ID
+        self.run_length_by_subject_teacher = run_length_by_subject_teacher or dict()
+        self.target_year = target_year
+
+    @staticmethod
+    def build(lesson_list: list[Lesson], target_year: int):
+        if target_year is None:
+            return TeacherHistory()
+        teacher_ids_by_subject_year = dict()
+        for lesson in lesson_list:
+            if lesson.year < target_year and lesson.teacher is not None:
+                teacher_ids_by_subject_year.setdefault((lesson.subject_id, lesson.year), set()) \
+                    .add(lesson.get_teacher_id())
+        offering_years_by_subject = dict()
+        for subject_id, year in sorted(teacher_ids_by_subject_year):
+            offering_years_by_subject.setdefault(subject_id, []).append(year)
+        run_length_by_subject_teacher = dict()
+        for subject_id, offering_years in offering_years_by_subject.items():
+            for teacher_id in teacher_ids_by_subject_year[(subject_id, offering_years[-1])]:
+                run_length = 0
+                for year in reversed(offering_years):
+                    if teacher_id not in teacher_ids_by_subject_year[(subject_id, year)]:
+                        break
+                    run_length += 1
+                run_length_by_subject_teacher[(subject_id, teacher_id)] = run_length
+        return TeacherHistory(run_length_by_subject_teacher, target_year)
+
+    @planning_id
+    def get_id(self):
+        return self.id
+
+    # How many of the latest offerings of the lesson's subject its teacher taught in a row;
+    # lessons that are history themselves are not scored against it
+    def get_run_length(self, lesson: Lesson):
+        if self.target_year is None or lesson.year < self.target_year:
+            return 0
+        return self.run_length_by_subject_teacher.get((lesson.subject_id, lesson.get_teacher_id()), 0)
+
+
 def format_list(a_list):
     return ',\n'.join(map(str, a_list))
 
@@ -86,15 +170,22 @@ def format_list(a_list):
 class TimeTable:
     teacher_list: list[Teacher]
     lesson_list: list[Lesson]
+    subject_eligibility: SubjectEligibility
+    target_year: int
+    teacher_history: TeacherHistory
     score: HardSoftScore
 
-    def __init__(self, teacher_list: list[Teacher], lesson_list: list[Lesson], score: HardSoftScore = None):
+    def __init__(self, teacher_list: list[Teacher], lesson_list: list[Lesson], score: HardSoftScore = None,
+                 subject_eligibility: SubjectEligibility = None, target_year: int = None):
         self.teacher_list = teacher_list
         self.lesson_list = lesson_list
         self.score = score
+        self.subject_eligibility = subject_eligibility if subject_eligibility is not None else SubjectEligibility()
+        # The year being planned; None plans the lessons of every year
+        self.target_year = target_year
+        self.teacher_history = TeacherHistory.build(lesson_list, target_year)
 
     @problem_fact_collection_property(Teacher)
-    @value_range_provider("teacherRange")
     def get_teacher_list(self):
         return self.teacher_list
     
@@ -102,6 +193,10 @@ class TimeTable:
     def get_lesson_list(self):
         return self.lesson_list
 
+    @problem_fact_property(TeacherHistory)
+    def get_teacher_history(self):
+        return self.teacher_history
+
 
     @planning_score(HardSoftScore)
     def get_score(self):
@@ -121,150 +216,33 @@ class TimeTable:
 
 
 
-def generate_problem():
-    subjective_list = [
-        Subjective(1, "INF0291"),
-        Subjective(2, "INF0292"),
-        Subjective(3, "INF0287"),
-        Subjective(4, "INF0018"),
-        Subjective(5, "INF0283"),
-        Subjective(6, "INF0294"),
-        Subjective(7, "INF0056"),
-        Subjective(8, "INF0299"),
-        Subjective(9, "INF0285"),
-        Subjective(10, "INF0293"),
-        Subjective(11, "INF0300"),
-        Subjective(12, "INF0284"),
-        Subjective(13, "INF0288"),
-    ]
-    teacher_list = [
-        Teacher(1, "Plínio de Sá Leitão Júnior"),
-        Teacher(2, "Reinaldo de Souza Júnior"),
-        Teacher(3, "Fábio Nogueira de Lucena"),
-        Teacher(4, "Taciana Novo Kudo"),
-        Teacher(5, "Renata Dutra Braga"),
-        Teacher(6, "Ana Claudia Bastos Loureiro Monção"),
-        Teacher(7, "Sofia Larissa da Costa Paiva"),
-        Teacher(8, "Leonardo Andrade Ribeiro"),
-        Teacher(9, "Jacson Rodrigues Barbosa"),
-        Teacher(10, "Renato Bulcão"),
-        Teacher(11, "Eliomar Araújo de Lima"),
-        Teacher(12, "Evellin Cardoso"),
-        Teacher(13, "William Divino Ferreira"),
-        Teacher(14, "Rubens de Castro Pereira"),
-        Teacher(15, "Edison Andrade Martins Morais"),
-        Teacher(16, "Adailton Ferreira de Araújo"),
-        Teacher(17, "Hugo Nascimento"),
-        Teacher(18, "Leonardo Antonio Alves"),
-        Teacher(19, "Juliano Lopes de Oliveira"),
-        Teacher(20, "Alessandro Cruvinel Machado de Araújo"),
-    ]
+# Subjects and teachers are interned by the dataset, so every lesson of a subject or teacher shares one fact
+def generate_problem(dataset: TimetablingDataset = None):
+    if dataset is None:
+        dataset = get_default_dataset()
+    subjective_list = [Subjective(subject_id, code) for subject_id, code in enumerate(dataset.subject_code_list, 1)]
+    teacher_list = [Teacher(teacher_id, name) for teacher_id, name in enumerate(dataset.teacher_name_list, 1)]
 
     nucleo_list = [
         Nucleo(1, "2.1 - Núcleo de Fundamentos de Sistemas e Software"),
         Nucleo(2, "2.2 - Núcleo de Aplicações e Tecnologias de Sistemas e Software")
     ]
 
+    # Lessons of past years keep the teacher that gave them; lessons of the target year have none yet
     lesson_list = [
-        Lesson(1, 2020, Subjective(3, "INF0287"), Teacher(8, "Leonardo Andrade Ribeiro")),
-        Lesson(2, 2020, Subjective(4, "INF0018"), Teacher(7, "Sofia Larissa da Costa Paiva")),
-        Lesson(3, 2020, Subjective(5, "INF0283"), Teacher(6, "Ana Claudia Bastos Loureiro Monção")),
-        Lesson(4, 2020, Subjective(1, "INF0291"), Teacher(3, "Fábio Nogueira de Lucena")),
-        Lesson(5, 2020, Subjective(6, "INF0294"), Teacher(2, "Reinaldo de Souza Júnior")),
-        Lesson(6, 2020, Subjective(7, "INF0056"), Teacher(3, "Fábio Nogueira de Lucena")),
-        Lesson(7, 2020, Subjective(8, "INF0299"), Teacher(7, "Sofia Larissa da Costa Paiva")),
-        Lesson(8, 2020, Subjective(9, "INF0285"), Teacher(13, "William Divino Ferreira")),
-        Lesson(9, 2020, Subjective(11, "INF0300"), Teacher(3, "Fábio Nogueira de Lucena")),
-        Lesson(10, 2020, Subjective(12, "INF0284"), Teacher(13, "William Divino Ferreira")),
-        Lesson(11, 2020, Subjective(13, "INF0288"), Teacher(16, "Adailton Ferreira de Araújo")),
-        Lesson(12, 2020, Subjective(2, "INF0292"), Teacher(18, "Leonardo Antonio Alves")),
-        Lesson(13, 2020, Subjective(10, "INF0293"), Teacher(15, "Edison Andrade Martins Morais")),
-        Lesson(14, 2021, Subjective(3, "INF0287"), Teacher(7, "Sofia Larissa da Costa Paiva")),
-        Lesson(15, 2021, Subjective(4, "INF0018"), Teacher(7, "Sofia Larissa da Costa Paiva")),
-        Lesson(16, 2021, Subjective(5, "INF0283"), Teacher(6, "Ana Claudia Bastos Loureiro Monção")),
-        Lesson(17, 2021, Subjective(1, "INF0291"), Teacher(11, "Eliomar Araújo de Lima")),
-        Lesson(18, 2021, Subjective(6, "INF0294"), Teacher(11, "Eliomar Araújo de Lima")),
-        Lesson(19, 2021, Subjective(7, "INF0056"), Teacher(1, "Plínio de Sá Leitão Júnior")),
-        Lesson(20, 2021, Subjective(8, "INF0299"), Teacher(10, "Renato Bulcão")),
-        Lesson(21, 2021, Subjective(9, "INF0285"), Teacher(14, "Rubens de Castro Pereira")),
-        Lesson(22, 2021, Subjective(11, "INF0300"), Teacher(14, "Rubens de Castro Pereira")),
-        Lesson(23, 2021, Subjective(12, "INF0284"), Teacher(16, "Adailton Ferreira de Araújo")),
-        Lesson(24, 2021, Subjective(13, "INF0288"), Teacher(18, "Leonardo Antonio Alves")),
-        Lesson(25, 2021, Subjective(2, "INF0292"), Teacher(18, "Leonardo Antonio Alves")),
-        Lesson(26, 2021, Subjective(10, "INF0293"), Teacher(4, "Taciana Novo Kudo")),
-        Lesson(27, 2022, Subjective(3, "INF0287"), Teacher(6, "Ana Claudia Bastos Loureiro Monção")),
-        Lesson(28, 2022, Subjective(4, "INF0018"), Teacher(9, "Jacson Rodrigues Barbosa")),
-        Lesson(29, 2022, Subjective(5, "INF0283"), Teacher(10, "Renato Bulcão")),
-        Lesson(30, 2022, Subjective(1, "INF0291"), Teacher(11, "Eliomar Araújo de Lima")),
-        Lesson(31, 2022, Subjective(6, "INF0294"), Teacher(11, "Eliomar Araújo de Lima")),
-        Lesson(32, 2022, Subjective(7, "INF0056"), Teacher(1, "Plínio de Sá Leitão Júnior")),
-        Lesson(33, 2022, Subjective(8, "INF0299"), Teacher(10, "Renato Bulcão")),
-        Lesson(34, 2022, Subjective(9, "INF0285"), Teacher(14, "Rubens de Castro Pereira")),
-        Lesson(35, 2022, Subjective(11, "INF0300"), Teacher(14, "Rubens de Castro Pereira")),
-        Lesson(36, 2022, Subjective(12, "INF0284"), Teacher(16, "Adailton Ferreira de Araújo")),
-        Lesson(37, 2022, Subjective(13, "INF0288"), Teacher(18, "Leonardo Antonio Alves")),
-        Lesson(38, 2022, Subjective(2, "INF0292"), Teacher(18, "Leonardo Antonio Alves")),
-        Lesson(39, 2022, Subjective(10, "INF0293"), Teacher(4, "Taciana Novo Kudo")),
-        Lesson(40, 2023, Subjective(3, "INF0287"), Teacher(6, "Ana Claudia Bastos Loureiro Monção")),
-        Lesson(41, 2023, Subjective(4, "INF0018"), Teacher(9, "Jacson Rodrigues Barbosa")),
-        Lesson(42, 2023, Subjective(5, "INF0283"), Teacher(10, "Renato Bulcão")),
-        Lesson(43, 2023, Subjective(1, "INF0291"), Teacher(3, "Fábio Nogueira de Lucena")),
-        Lesson(44, 2023, Subjective(6, "INF0294"), Teacher(11, "Eliomar Araújo de Lima")),
-        Lesson(45, 2023, Subjective(7, "INF0056"), Teacher(1, "Plínio de Sá Leitão Júnior")),
-        Lesson(46, 2023, Subjective(8, "INF0299"), Teacher(10, "Renato Bulcão")),
-        Lesson(47, 2023, Subjective(9, "INF0285"), Teacher(14, "Rubens de Castro Pereira")),
-        Lesson(48, 2023, Subjective(11, "INF0300"), Teacher(14, "Rubens de Castro Pereira")),
-        Lesson(49, 2023, Subjective(12, "INF0284"), Teacher(16, "Adailton Ferreira de Araújo")),
-        Lesson(50, 2023, Subjective(13, "INF0288"), Teacher(18, "Leonardo Antonio Alves")),
-        Lesson(51, 2023, Subjective(2, "INF0292"), Teacher(4, "Taciana Novo Kudo")),
-        Lesson(52, 2023, Subjective(10, "INF0293"), Teacher(4, "Taciana Novo Kudo")),
-        Lesson(53, 2024, Subjective(3, "INF0287")),
-        Lesson(54, 2024, Subjective(4, "INF0018")),
-        Lesson(55, 2024, Subjective(5, "INF0283")),
-        Lesson(56, 2024, Subjective(1, "INF0291")),
-        Lesson(57, 2024, Subjective(6, "INF0294")),
-        Lesson(58, 2024, Subjective(7, "INF0056")),
-        Lesson(59, 2024, Subjective(8, "INF0299")),
-        Lesson(60, 2024, Subjective(9, "INF0285")),
-        Lesson(61, 2024, Subjective(11, "INF0300")),
-        Lesson(62, 2024, Subjective(12, "INF0284")),
-        Lesson(63, 2024, Subjective(13, "INF0288")),
-        Lesson(64, 2024, Subjective(2, "INF0292")),
-        Lesson(65, 2024, Subjective(10, "INF0293")),
+        Lesson(lesson_id, year, subjective_list[subject_id - 1],
+               teacher_list[teacher_id - 1] if teacher_id != NO_TEACHER_ID else None)
+        for lesson_id, (year, subject_id, teacher_id) in enumerate(zip(dataset.lesson_year.tolist(),
+                                                                       dataset.lesson_subject_id.tolist(),
+                                                                       dataset.lesson_teacher_id.tolist()), 1)
     ]
 
-    # interest_lesson_list = [
-    #     Interest(Subjective(1, "INF0291"), Teacher(1, "Plínio de Sá Leitão Júnior")),
-    #     Interest(Subjective(1, "INF0291"), Teacher(2, "Reinaldo de Souza Júnior")),
-    #     Interest(Subjective(1, "INF0291"), Teacher(3, "Fábio Nogueira de Lucena")),
-    #     Interest(Subjective(2, "INF0292"), Teacher(4, "Taciana Novo Kudo")),
-    #     Interest(Subjective(2, "INF0292"), Teacher(5, "Renata Dutra Braga")),
-    #     Interest(Subjective(3, "INF0287"), Teacher(6, "Ana Claudia Bastos Loureiro Monção")),
-    #     Interest(Subjective(3, "INF0287"), Teacher(7, "Sofia Larissa da Costa Paiva")),
-    #     Interest(Subjective(3, "INF0287"), Teacher(8, "Leonardo Andrade Ribeiro")),
-    #     Interest(Subjective(4, "INF0018"), Teacher(9, "Jacson Rodrigues Barbosa")),
-    #     Interest(Subjective(4, "INF0018"), Teacher(7, "Sofia Larissa da Costa Paiva")),
-    #     Interest(Subjective(5, "INF0283"), Teacher(7, "Sofia Larissa da Costa Paiva")),
-    #     Interest(Subjective(5, "INF0283"), Teacher(6, "Ana Claudia Bastos Loureiro Monção")),
-    #     Interest(Subjective(5, "INF0283"), Teacher(10, "Renato Bulcão")),
-    #     Interest(Subjective(6, "INF0294"), Teacher(11, "Eliomar Araújo de Lima")),
-    #     Interest(Subjective(6, "INF0294"), Teacher(12, "Evellin Cardoso")),
-    #     Interest(Subjective(7, "INF0056"), Teacher(2, "Reinaldo de Souza Júnior")),
-    #     Interest(Subjective(7, "INF0056"), Teacher(1, "Plínio de Sá Leitão Júnior")),
-    #     Interest(Subjective(8, "INF0299"), Teacher(10, "Renato Bulcão")),
-    #     Interest(Subjective(8, "INF0299"), Teacher(6, "Ana Claudia Bastos Loureiro Monção")),
-    #     Interest(Subjective(8, "INF0299"), Teacher(7, "Sofia Larissa da Costa Paiva")),
-    #     Interest(Subjective(9, "INF0285"), Teacher(13, "William Divino Ferreira")),
-    #     Interest(Subjective(9, "INF0285"), Teacher(14, "Rubens de Castro Pereira")),
-    #     Interest(Subjective(10, "INF0293"), Teacher(15, "Edison Andrade Martins Morais")),
-    #     Interest(Subjective(10, "INF0293"), Teacher(4, "Taciana Novo Kudo")),
-    #     Interest(Subjective(11, "INF0300"), Teacher(16, "Adailton Ferreira de Araújo")),
-    #     Interest(Subjective(11, "INF0300"), Teacher(13, "William Divino Ferreira")),
-    #     Interest(Subjective(12, "INF0284"), Teacher(17, "Hugo Nascimento")),
-    #     Interest(Subjective(12, "INF0284"), Teacher(18, "Leonardo Antonio Alves")),
-    #     Interest(Subjective(13, "INF0288"), Teacher(19, "Juliano Lopes de Oliveira")),
-    #     Interest(Subjective(13, "INF0288"), Teacher(20, "Alessandro Cruvinel Machado de Araújo")),
-    # ]
-
-
-    return TimeTable(teacher_list, lesson_list)
\ No newline at end of file
+    # Only the teachers interested in a subject may teach it
+    subject_eligibility = SubjectEligibility({subject_id: teacher_ids for subject_id, teacher_ids
+                                              in dataset.get_interested_teacher_ids_by_subject_id().items()
+                                              if teacher_ids})
+    for lesson in lesson_list:
+        lesson.teacher_range = subject_eligibility.get_teacher_range(lesson, teacher_list)
+
+    return TimeTable(teacher_list, lesson_list, subject_eligibility=subject_eligibility,
+                     target_year=dataset.target_year)
@@ -1,26 +1,27 @@
 from functools import reduce
 
 from optapy import solver_factory_create
-from optapy.types import SolverConfig, Duration
+from solver_config_factory import SolverSettings, build_solver_config
 from domain import TimeTable, Lesson, generate_problem
 from constraints import define_constraints
 
 
 def print_timetable(timetable: TimeTable):
     lesson_list = timetable.lesson_list
-    lesson_list_2024 = list(filter(lambda the_lesson: the_lesson.year == 2024, lesson_list))
+    target_year_lesson_list = list(filter(lambda the_lesson: the_lesson.year == timetable.target_year, lesson_list))
 
     print("|-------------------|-------------------|")
     print("| Subject           | Teacher           |")
     print("|-------------------|-------------------|")
-    for lesson in lesson_list_2024:
+    for lesson in target_year_lesson_list:
         out = "| " + "{:<15}".format(lesson.subject.name)[0:15] + " | "
         out += "{:<15}".format(lesson.teacher.name)[0:15] + " | "
         print(out)
     print("|-------------------|-------------------|")
 
     unassigned_lessons = list(
-        filter(lambda unassigned_lesson: unassigned_lesson.year == 2024 and unassigned_lesson.teacher is None,
+        filter(lambda unassigned_lesson: unassigned_lesson.year == timetable.target_year and
+                                         unassigned_lesson.teacher is None,
                lesson_list))
     if len(unassigned_lessons) > 0:
         print()
@@ -30,10 +31,8 @@ def print_timetable(timetable: TimeTable):
 
 
 
-solver_config = SolverConfig().withEntityClasses(Lesson) \
-    .withSolutionClass(TimeTable) \
-    .withConstraintProviderClass(define_constraints) \
-    .withTerminationSpentLimit(Duration.ofSeconds(30))
+solver_settings = SolverSettings.load('TIMETABLING', spent_limit_seconds=30)
+solver_config = build_solver_config(TimeTable, [Lesson], define_constraints, solver_settings)
 
 solver = solver_factory_create(solver_config).buildSolver()
 
@@ -0,0 +1,117 @@
+import os
+import optapy.config
+from optapy.types import Duration
+
+MOVE_THREAD_COUNT_NONE = 'NONE'
+MOVE_THREAD_COUNT_AUTO = 'AUTO'
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    if str(value).strip().lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if str(value).strip().lower() in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError(f'Expected a boolean but got ({value}).')
+
+
+def parse_move_thread_count(value):
+    value = str(value).strip().upper()
+    if value in (MOVE_THREAD_COUNT_NONE, MOVE_THREAD_COUNT_AUTO):
+        return value
+    if not value.isdigit() or int(value) < 1:
+        raise ValueError(f'The move thread count ({value}) must be {MOVE_THREAD_COUNT_NONE}, '
+                         f'{MOVE_THREAD_COUNT_AUTO} or a positive integer.')
+    return value
+
+
+# Solver settings shared by every solve of an app. Each setting is read, in order of precedence, from the
+# environment variable <env_prefix>_<SETTING NAME>, the YAML file named by <env_prefix>_SOLVER_CONFIG_FILE
+# and the app's defaults. The partition settings are used by apps that split a problem into
+# sub-problems solved in parallel, the repair settings by apps that re-solve only what an edit touched.
+class SolverSettings:
+    SETTING_PARSERS = {
+        'spent_limit_seconds': int,
+        'move_thread_count': parse_move_thread_count,
+        'environment_mode': lambda value: str(value).strip().upper(),
+        'partitioned_search': parse_bool,
+        'partition_thread_count': int,
+        'partition_spent_limit_seconds': int,
+        'repair_spent_limit_seconds': int,
+    }
+
+    def __init__(self, spent_limit_seconds=30, move_thread_count=MOVE_THREAD_COUNT_NONE,
+                 environment_mode='REPRODUCIBLE', partitioned_search=False, partition_thread_count=None,
+                 partition_spent_limit_seconds=None, repair_spent_limit_seconds=None):
+        self.spent_limit_seconds = spent_limit_seconds
+        self.move_thread_count = move_thread_count
+        self.environment_mode = environment_mode
+        self.partitioned_search = partitioned_search
+        self.partition_thread_count = partition_thread_count
+        self.partition_spent_limit_seconds = partition_spent_limit_seconds
+        self.repair_spent_limit_seconds = repair_spent_limit_seconds
+
+    @staticmethod
+    def load(env_prefix, yaml_file=None, **defaults):
+        settings = dict(defaults)
+        yaml_file = os.environ.get(f'{env_prefix}_SOLVER_CONFIG_FILE', yaml_file)
+        if yaml_file is not None:
+            settings.update(load_yaml_settings(yaml_file))
+        for name in SolverSettings.SETTING_PARSERS:
+            value = os.environ.get(f'{env_prefix}_{name.upper()}')
+            if value is not None:
+                settings[name] = value
+        unknown_names = set(settings) - set(SolverSettings.SETTING_PARSERS)
+        if unknown_names:
+            raise ValueError(f'Unknown solver settings ({", ".join(sorted(unknown_names))}).')
+        return SolverSettings(**{name: None if value is None else SolverSettings.SETTING_PARSERS[name](value)
+                                 for name, value in settings.items()})
+
+    # The number of cores one solve keeps busy, used to size the solver worker pool
+    def get_cores_per_solve(self):
+        if self.move_thread_count == MOVE_THREAD_COUNT_NONE:
+            return 1
+        if self.move_thread_count == MOVE_THREAD_COUNT_AUTO:
+            # OptaPlanner's AUTO uses the available processors minus two, at most four
+            return max(min((os.cpu_count() or 1) - 2, 4), 1)
+        return int(self.move_thread_count)
+
+    def get_solver_slot_count(self):
+        return max((os.cpu_count() or 1) // self.get_cores_per_solve(), 1)
+
+    # A partitioned solve runs in one solver slot, so by default its partitions share that slot's cores
+    def get_partition_thread_count(self):
+        return self.partition_thread_count or self.get_cores_per_solve()
+
+
+def load_yaml_settings(yaml_file):
+    try:
+        import yaml
+    except ImportError as e:
+        raise RuntimeError(f'Reading the solver config file ({yaml_file}) requires PyYAML '
+                           f'(pip install pyyaml).') from e
+    with open(yaml_file) as file:
+        settings = yaml.safe_load(file) or dict()
+    if not isinstance(settings, dict):
+        raise ValueError(f'The solver config file ({yaml_file}) must contain a mapping of settings.')
+    return settings
+
+
+# With terminate_when_feasible, solving also stops as soon as the best score breaks no hard constraint
+def build_solver_config(solution_class, entity_class_list, constraint_provider, settings,
+                        spent_limit_seconds=None, terminate_when_feasible=False):
+    if spent_limit_seconds is None:
+        spent_limit_seconds = settings.spent_limit_seconds
+    solver_config = optapy.config.solver.SolverConfig()
+    solver_config \
+        .withSolutionClass(solution_class) \
+        .withEntityClasses(*entity_class_list) \
+        .withConstraintProviderClass(constraint_provider) \
+        .withEnvironmentMode(optapy.config.solver.EnvironmentMode.valueOf(settings.environment_mode)) \
+        .withTerminationSpentLimit(Duration.ofSeconds(spent_limit_seconds))
+    if terminate_when_feasible:
+        solver_config.getTerminationConfig().setBestScoreFeasible(True)
+    if settings.move_thread_count != MOVE_THREAD_COUNT_NONE:
+        solver_config.withMoveThreadCount(settings.move_thread_count)
+    return solver_config
@@ -1,79 +1,236 @@
-from domain import Timeslot, Room, Lesson, TimeTable
-from constraints import define_constraints, room_conflict, teacher_conflict, student_group_conflict, \
-    teacher_room_stability, teacher_time_efficiency, student_group_subject_variety
+import glob
+import os
+import unicodedata
+
+from timetabling_dataset import load_timetabling_dataset, get_default_csv_file_list, TimetablingDatasetCache, \
+    NO_TEACHER_ID
+from domain import Subjective, Teacher, Lesson, TimeTable, TeacherHistory, lesson_pinning_filter
+from constraints import define_constraints, same_teacher_same_subject
 
-from datetime import time
 from optapy.test import ConstraintVerifier, constraint_verifier_build
 
 constraint_verifier: ConstraintVerifier = constraint_verifier_build(define_constraints, TimeTable, Lesson)
 
-ROOM1 = Room(1, "Room1")
-ROOM2 = Room(2, "Room2")
-TIMESLOT1 = Timeslot(1, 'MONDAY', time(12, 0), time(13, 0))
-TIMESLOT2 = Timeslot(2, 'TUESDAY', time(12, 0), time(13, 0))
-TIMESLOT3 = Timeslot(3, 'TUESDAY', time(13, 0), time(14, 0))
-TIMESLOT4 = Timeslot(4, 'TUESDAY', time(15, 0), time(16, 0))
-
-
-def test_room_conflict():
-    first_lesson = Lesson(1, "Subject1", "Teacher1", "Group1", TIMESLOT1, ROOM1)
-    conflicting_lesson = Lesson(2, "Subject2", "Teacher2", "Group2", TIMESLOT1, ROOM1)
-    non_conflicting_lesson = Lesson(3, "Subject3", "Teacher3", "Group3", TIMESLOT2, ROOM1)
-    constraint_verifier.verify_that(room_conflict) \
-        .given(first_lesson, conflicting_lesson, non_conflicting_lesson) \
-        .penalizes_by(1)
-
-
-def test_teacher_conflict():
-    conflicting_teacher = "Teacher1"
-    first_lesson = Lesson(1, "Subject1", conflicting_teacher, "Group1", TIMESLOT1, ROOM1)
-    conflicting_lesson = Lesson(2, "Subject2", conflicting_teacher, "Group2", TIMESLOT1, ROOM2)
-    non_conflicting_lesson = Lesson(3, "Subject3", "Teacher2", "Group3", TIMESLOT2, ROOM1)
-    constraint_verifier.verify_that(teacher_conflict) \
-        .given(first_lesson, conflicting_lesson, non_conflicting_lesson) \
-        .penalizes_by(1)
-
-
-def test_student_group_conflict():
-    conflicting_group = "Group1"
-    first_lesson = Lesson(1, "Subject1", "Teacher1", conflicting_group, TIMESLOT1, ROOM1)
-    conflicting_lesson = Lesson(2, "Subject2", "Teacher2", conflicting_group, TIMESLOT1, ROOM2)
-    non_conflicting_lesson = Lesson(3, "Subject3", "Teacher3", "Group3", TIMESLOT2, ROOM1)
-    constraint_verifier.verify_that(student_group_conflict) \
-        .given(first_lesson, conflicting_lesson, non_conflicting_lesson) \
-        .penalizes_by(1)
-
-
-def test_teacher_room_stability():
-    teacher = "Teacher1"
-    lesson_in_first_room = Lesson(1, "Subject1", teacher, "Group1", TIMESLOT1, ROOM1)
-    lesson_in_same_room = Lesson(2, "Subject2", teacher, "Group2", TIMESLOT1, ROOM1)
-    lesson_in_different_room = Lesson(3, "Subject3", teacher, "Group3", TIMESLOT1, ROOM2)
-    constraint_verifier.verify_that(teacher_room_stability) \
-        .given(lesson_in_first_room, lesson_in_different_room, lesson_in_same_room) \
-        .penalizes_by(2)
-
-
-def test_teacher_time_efficiency():
-    teacher = "Teacher1"
-    single_lesson_on_monday = Lesson(1, "Subject1", teacher, "Group1", TIMESLOT1, ROOM1)
-    first_tuesday_lesson = Lesson(2, "Subject2", teacher, "Group2", TIMESLOT2, ROOM1)
-    second_tuesday_lesson = Lesson(3, "Subject3", teacher, "Group3", TIMESLOT3, ROOM1)
-    third_tuesday_lesson_with_gap = Lesson(4, "Subject4", teacher, "Group4", TIMESLOT4, ROOM1)
-    constraint_verifier.verify_that(teacher_time_efficiency) \
-        .given(single_lesson_on_monday, first_tuesday_lesson, second_tuesday_lesson, third_tuesday_lesson_with_gap) \
-        .rewards_with(1)  # Second tuesday lesson immediately follows the first.
-
-
-def test_student_group_subject_variety():
-    student_group = "Group1"
-    repeated_subject = "Subject1"
-    monday_lesson = Lesson(1, repeated_subject, "Teacher1", student_group, TIMESLOT1, ROOM1)
-    first_tuesday_lesson = Lesson(2, repeated_subject, "Teacher2", student_group, TIMESLOT2, ROOM1)
-    second_tuesday_lesson = Lesson(3, repeated_subject, "Teacher3", student_group, TIMESLOT3, ROOM1)
-    third_tuesday_lesson_with_different_subject = Lesson(4, "Subject2", "Teacher4", student_group, TIMESLOT4, ROOM1)
-    lesson_in_another_group = Lesson(5, repeated_subject, "Teacher5", "Group2", TIMESLOT1, ROOM1)
-    constraint_verifier.verify_that(student_group_subject_variety) \
-        .given(monday_lesson, first_tuesday_lesson, second_tuesday_lesson, third_tuesday_lesson_with_different_subject,
-               lesson_in_another_group) \
-        .penalizes_by(1)  # Second tuesday lesson immediately follows the first.
+SUBJECT1 = Subjective(1, 'INF0287')
+SUBJECT2 = Subjective(2, 'INF0018')
+TEACHER1 = Teacher(1, 'Teacher1')
+TEACHER2 = Teacher(2, 'Teacher2')
+TEACHER3 = Teacher(3, 'Teacher3')
+
+DISTRIBUTION_HEADER = 'Curso,Matriz,Cód Disc,Nome Disc,Horário,CH Total,Professor\n'
+INTEREST_HEADER = 'Curso,Matriz,Cód Disc,Nome Disc,Horário,CH Total,INTERESSADOS,,,RESOLUCAO\n'
+
+
+def write_csv_file(directory, file_name, content):
+    csv_path = directory / file_name
+    csv_path.write_text(content, encoding='utf-8')
+    return str(csv_path)
+
+
+def get_lessons(dataset):
+    return list(zip(dataset.lesson_year.tolist(), dataset.lesson_subject_id.tolist(),
+                    dataset.lesson_teacher_id.tolist()))
+
+
+def test_multi_line_cells(tmp_path):
+    csv_file = write_csv_file(tmp_path, 'Distribuicoes - 2023-1.csv', DISTRIBUTION_HEADER +
+                              'ES,2017,INF0287,Algoritmos,"Qui 18h50 às 22h\nSex 18h50 às 20h30",64,Teacher A\n'
+                              'ES,2017,INF0018,Arquitetura,Seg 18:50 às 22h,64,Teacher B\n')
+    dataset = load_timetabling_dataset([csv_file])
+    assert dataset.subject_code_list == ['INF0287', 'INF0018']
+    assert dataset.teacher_name_list == ['Teacher A', 'Teacher B']
+    assert get_lessons(dataset) == [(2023, 1, 1), (2023, 2, 2)]
+
+
+def test_names_are_normalized(tmp_path):
+    decomposed_name = unicodedata.normalize('NFD', 'Fábio Nogueira')
+    csv_file = write_csv_file(tmp_path, 'Distribuicoes - 2023-1.csv', DISTRIBUTION_HEADER +
+                              'ES,2017,INF0287,Algoritmos,Qui,64,Fábio Nogueira\n'
+                              f'ES,2017,inf0018 ,Arquitetura,Seg,64,"  Fábio\n Nogueira "\n'
+                              f'ES,2017,INF0283,Computação,Sex,64,{decomposed_name}\n'
+                              'ES,2017,INF0285,Engenharia,Sex,64,\n')
+    dataset = load_timetabling_dataset([csv_file])
+    assert dataset.subject_code_list == ['INF0287', 'INF0018', 'INF0283', 'INF0285']
+    assert dataset.teacher_name_list == ['Fábio Nogueira']
+    assert get_lessons(dataset) == [(2023, 1, 1), (2023, 2, 1), (2023, 3, 1), (2023, 4, NO_TEACHER_ID)]
+
+
+def test_course_filter(tmp_path):
+    csv_file = write_csv_file(tmp_path, 'Distribuicoes - 2023-1.csv', DISTRIBUTION_HEADER +
+                              'ES,2017,INF0287,Algoritmos,Qui,64,Teacher A\n'
+                              'CC,2017,INF0018,Arquitetura,Seg,64,Teacher B\n'
+                              ' ES ,2017,INF0283,Computação,Sex,64,Teacher C\n')
+    dataset = load_timetabling_dataset([csv_file], course='ES')
+    assert dataset.subject_code_list == ['INF0287', 'INF0283']
+    assert dataset.teacher_name_list == ['Teacher A', 'Teacher C']
+    assert dataset.get_lesson_count() == 2
+    assert load_timetabling_dataset([csv_file]).get_lesson_count() == 3
+
+
+def test_interest_sheet_numbers_first(tmp_path):
+    distribution_file = write_csv_file(tmp_path, 'Distribuicoes - 2023-1.csv', DISTRIBUTION_HEADER +
+                                       'ES,2017,INF0018,Arquitetura,Seg,64,Teacher B\n'
+                                       'ES,2017,INF0287,Algoritmos,Qui,64,Teacher C\n')
+    interest_file = write_csv_file(tmp_path, 'Distribuicoes - 2024-1.csv', INTEREST_HEADER +
+                                   'ES,2017,INF0287,Algoritmos,Qui,64,Teacher A,Teacher C,,CONFLITO\n'
+                                   'ES,2017,INF0018,Arquitetura,Seg,64,Teacher B,,,\n')
+    dataset = load_timetabling_dataset([distribution_file, interest_file])
+    assert dataset.subject_code_list == ['INF0287', 'INF0018']
+    assert dataset.teacher_name_list == ['Teacher A', 'Teacher C', 'Teacher B']
+    assert dataset.target_year == 2024
+    # Lessons are in chronological order, whatever the order of the files
+    assert get_lessons(dataset) == [(2023, 2, 3), (2023, 1, 2), (2024, 1, NO_TEACHER_ID), (2024, 2, NO_TEACHER_ID)]
+    assert dataset.get_interested_teacher_ids_by_subject_id() == {1: [1, 2], 2: [3]}
+
+
+def test_dataset_cache(tmp_path):
+    distribution_file = write_csv_file(tmp_path, 'Distribuicoes - 2023-1.csv', DISTRIBUTION_HEADER +
+                                       'ES,2017,INF0287,Algoritmos,Qui,64,Teacher A\n')
+    interest_file = write_csv_file(tmp_path, 'Distribuicoes - 2024-1.csv', INTEREST_HEADER +
+                                   'ES,2017,INF0287,Algoritmos,Qui,64,Teacher A,Teacher B,,\n')
+    csv_file_list = [distribution_file, interest_file]
+    dataset_cache = TimetablingDatasetCache(str(tmp_path / 'cache'))
+
+    parsed_dataset = dataset_cache.load_or_parse(csv_file_list)
+    cache_key = dataset_cache.get_cache_key(csv_file_list)
+    assert os.listdir(dataset_cache.cache_dir) == [f'{cache_key}.npz']
+    cached_dataset = dataset_cache.load_or_parse(csv_file_list)
+    for name, array in parsed_dataset.to_arrays().items():
+        assert (cached_dataset.to_arrays()[name] == array).all()
+    assert cached_dataset.target_year == 2024
+
+    # The key follows the contents of the files, not their modification times
+    os.utime(distribution_file, (0, 0))
+    assert dataset_cache.get_cache_key(csv_file_list) == cache_key
+    assert dataset_cache.get_cache_key(csv_file_list, course='ES') != cache_key
+    write_csv_file(tmp_path, 'Distribuicoes - 2023-1.csv', DISTRIBUTION_HEADER +
+                   'ES,2017,INF0287,Algoritmos,Qui,64,Teacher B\n')
+    edited_key = dataset_cache.get_cache_key(csv_file_list)
+    assert edited_key != cache_key
+    assert get_lessons(dataset_cache.load_or_parse(csv_file_list))[0] == (2023, 1, 2)
+
+    added_file = write_csv_file(tmp_path, 'Distribuicoes - 2022-1.csv', DISTRIBUTION_HEADER +
+                                'ES,2017,INF0287,Algoritmos,Qui,64,Teacher A\n')
+    added_key = dataset_cache.get_cache_key([added_file] + csv_file_list)
+    assert added_key not in (cache_key, edited_key)
+    assert dataset_cache.load_or_parse([added_file] + csv_file_list).get_lesson_count() == 3
+    assert dataset_cache.get_cache_key([interest_file]) not in (cache_key, edited_key, added_key)
+    assert dataset_cache.load_or_parse([interest_file]).get_lesson_count() == 1
+    assert len(os.listdir(dataset_cache.cache_dir)) == 4
+
+
+def test_same_teacher_same_subject():
+    first_lesson = Lesson(1, 2024, SUBJECT1, TEACHER1)
+    conflicting_lesson = Lesson(2, 2024, SUBJECT1, TEACHER1)
+    lesson_of_another_year = Lesson(3, 2023, SUBJECT1, TEACHER1)
+    lesson_of_another_subject = Lesson(4, 2024, SUBJECT2, TEACHER1)
+    lesson_of_another_teacher = Lesson(5, 2024, SUBJECT1, TEACHER2)
+    first_lesson_without_teacher = Lesson(6, 2024, SUBJECT2)
+    second_lesson_without_teacher = Lesson(7, 2024, SUBJECT2)
+    constraint_verifier.verify_that(same_teacher_same_subject) \
+        .given(first_lesson, conflicting_lesson, lesson_of_another_year, lesson_of_another_subject,
+               lesson_of_another_teacher, first_lesson_without_teacher, second_lesson_without_teacher) \
+        .penalizes(1)
+
+
+def test_lesson_pinning_filter():
+    history_lesson = Lesson(1, 2023, SUBJECT1, TEACHER1)
+    target_year_lesson = Lesson(2, 2024, SUBJECT1)
+    assigned_target_year_lesson = Lesson(3, 2024, SUBJECT2, TEACHER2)
+    lesson_list = [history_lesson, target_year_lesson, assigned_target_year_lesson]
+    timetable = TimeTable([TEACHER1, TEACHER2], lesson_list, target_year=2024)
+    assert lesson_pinning_filter(timetable, history_lesson)
+    assert not lesson_pinning_filter(timetable, target_year_lesson)
+    assert not lesson_pinning_filter(timetable, assigned_target_year_lesson)
+    # Without a target year every lesson is planned
+    timetable_of_every_year = TimeTable([TEACHER1, TEACHER2], lesson_list)
+    assert not any(lesson_pinning_filter(timetable_of_every_year, lesson) for lesson in lesson_list)
+
+
+def test_teacher_history():
+    lesson_list = [
+        # SUBJECT1 was not offered in 2021, so 2020 and 2022 are its last two offerings
+        Lesson(1, 2019, SUBJECT1, TEACHER2),
+        Lesson(2, 2020, SUBJECT1, TEACHER1),
+        Lesson(3, 2022, SUBJECT1, TEACHER1),
+        # Two teachers shared SUBJECT2 in 2023; only TEACHER3 also taught it in 2022
+        Lesson(4, 2022, SUBJECT2, TEACHER3),
+        Lesson(5, 2023, SUBJECT2, TEACHER2),
+        Lesson(6, 2023, SUBJECT2, TEACHER3),
+        Lesson(7, 2023, SUBJECT2),
+    ]
+    teacher_history = TeacherHistory.build(lesson_list, 2024)
+    assert teacher_history.run_length_by_subject_teacher == {
+        (SUBJECT1.id, TEACHER1.id): 2,
+        (SUBJECT2.id, TEACHER2.id): 1,
+        (SUBJECT2.id, TEACHER3.id): 2,
+    }
+    assert teacher_history.get_run_length(Lesson(8, 2024, SUBJECT1, TEACHER1)) == 2
+    assert teacher_history.get_run_length(Lesson(9, 2024, SUBJECT1, TEACHER2)) == 0
+    assert teacher_history.get_run_length(Lesson(10, 2024, SUBJECT2, TEACHER2)) == 1
+    assert teacher_history.get_run_length(Lesson(11, 2024, SUBJECT2)) == 0
+    # History lessons are not scored against it
+    assert teacher_history.get_run_length(lesson_list[2]) == 0
+
+    # Lessons of the target year and after are not history
+    assert TeacherHistory.build(lesson_list, 2023).run_length_by_subject_teacher == {
+        (SUBJECT1.id, TEACHER1.id): 2,
+        (SUBJECT2.id, TEACHER3.id): 1,
+    }
+
+    teacher_history_of_every_year = TeacherHistory.build(lesson_list, None)
+    assert teacher_history_of_every_year.run_length_by_subject_teacher == {}
+    assert teacher_history_of_every_year.get_run_length(Lesson(8, 2024, SUBJECT1, TEACHER1)) == 0
+
+
+# The lessons and interests that generate_problem() used to list by hand, before they were read from the CSVs
+EXPECTED_SUBJECT_CODE_LIST = ['INF0291', 'INF0292', 'INF0287', 'INF0018', 'INF0283', 'INF0294', 'INF0056', 'INF0299',
+                              'INF0285', 'INF0293', 'INF0300', 'INF0284', 'INF0288']
+EXPECTED_TEACHER_NAME_LIST = [
+    'Plínio de Sá Leitão Júnior', 'Reinaldo de Souza Júnior', 'Fábio Nogueira de Lucena', 'Taciana Novo Kudo',
+    'Renata Dutra Braga', 'Ana Claudia Bastos Loureiro Monção', 'Sofia Larissa da Costa Paiva',
+    'Leonardo Andrade Ribeiro', 'Jacson Rodrigues Barbosa', 'Renato Bulcão', 'Eliomar Araújo de Lima',
+    'Evellin Cardoso', 'William Divino Ferreira', 'Rubens de Castro Pereira', 'Edison Andrade Martins Morais',
+    'Adailton Ferreira de Araújo', 'Hugo Nascimento', 'Leonardo Antonio Alves', 'Juliano Lopes de Oliveira',
+    'Alessandro Cruvinel Machado de Araújo',
+]
+# The yearly distributions list the subjects in this order
+EXPECTED_SUBJECT_ID_ORDER = [3, 4, 5, 1, 6, 7, 8, 9, 11, 12, 13, 2, 10]
+EXPECTED_TEACHER_IDS_BY_YEAR = {
+    2020: [8, 7, 6, 3, 2, 3, 7, 13, 3, 13, 16, 18, 15],
+    2021: [7, 7, 6, 11, 11, 1, 10, 14, 14, 16, 18, 18, 4],
+    2022: [6, 9, 10, 11, 11, 1, 10, 14, 14, 16, 18, 18, 4],
+    2023: [6, 9, 10, 3, 11, 1, 10, 14, 14, 16, 18, 4, 4],
+}
+EXPECTED_INTERESTED_TEACHER_IDS_BY_SUBJECT_ID = {
+    1: [1, 2, 3], 2: [4, 5], 3: [6, 7, 8], 4: [9, 7], 5: [7, 6, 10], 6: [11, 12], 7: [2, 1], 8: [10, 6, 7],
+    9: [13, 14], 10: [15, 4], 11: [16, 13], 12: [17, 18], 13: [19, 20],
+}
+
+
+def test_default_dataset_matches_hand_written_lists():
+    dataset = load_timetabling_dataset(get_default_csv_file_list())
+    assert dataset.subject_code_list == EXPECTED_SUBJECT_CODE_LIST
+    assert dataset.teacher_name_list == EXPECTED_TEACHER_NAME_LIST
+    # The lessons to plan come from the interest sheet, which lists the subjects in id order
+    assert get_lessons(dataset) == [(year, subject_id, teacher_id)
+                                    for year, teacher_id_list in EXPECTED_TEACHER_IDS_BY_YEAR.items()
+                                    for subject_id, teacher_id in zip(EXPECTED_SUBJECT_ID_ORDER, teacher_id_list)] + \
+           [(2024, subject_id, NO_TEACHER_ID) for subject_id in range(1, len(EXPECTED_SUBJECT_CODE_LIST) + 1)]
+    assert dataset.get_interested_teacher_ids_by_subject_id() == EXPECTED_INTERESTED_TEACHER_IDS_BY_SUBJECT_ID
+    assert dataset.target_year == 2024
+
+
+# The modules shared by the apps are copied into each app, so that every app runs on its own;
+# this fails when one copy is changed without the others
+SHARED_MODULE_LIST = ['solver_config_factory.py']
+
+
+def test_shared_modules_are_identical():
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    for shared_module in SHARED_MODULE_LIST:
+        with open(os.path.join(app_dir, shared_module), 'rb') as file:
+            content = file.read()
+        for copy_path in glob.glob(os.path.join(app_dir, '..', '*', shared_module)):
+            with open(copy_path, 'rb') as file:
+                assert file.read() == content, f'{os.path.normpath(copy_path)} differs from {shared_module}.'
@@ -0,0 +1,275 @@
+import csv
+import functools
+import glob
+import hashlib
+import os
+import re
+import tempfile
+import unicodedata
+import numpy as np
+
+REPOSITORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DATA_DIR = os.path.join(REPOSITORY_DIR, 'data')
+
+SUBJECT_CODE_COLUMN = 'Cód Disc'
+SUBJECT_NAME_COLUMN = 'Nome Disc'
+COURSE_COLUMN = 'Curso'
+TEACHER_COLUMN = 'Professor'
+# In an interest sheet the interested teachers fill this column and the unnamed columns after it
+INTEREST_COLUMN = 'INTERESSADOS'
+YEAR_PATTERN = re.compile(r'(\d{4})-\d')
+
+# Id of "no teacher" in the teacher columns; interned ids start at 1
+NO_TEACHER_ID = 0
+# Bump when the parsing changes, so datasets cached by an older loader are rebuilt
+DATASET_FORMAT_VERSION = 1
+
+
+# Collapses line breaks, repeated and trailing whitespace, and composes accents the same way
+# in every file, so the same teacher typed twice gets the same id
+def normalize_name(name):
+    return unicodedata.normalize('NFC', ' '.join(name.split()))
+
+
+class InternTable:
+    def __init__(self):
+        self.id_by_key = dict()
+        self.key_list = []
+
+    def intern(self, key):
+        interned_id = self.id_by_key.get(key)
+        if interned_id is None:
+            self.key_list.append(key)
+            interned_id = len(self.key_list)
+            self.id_by_key[key] = interned_id
+        return interned_id
+
+    def get_key(self, interned_id):
+        return self.key_list[interned_id - 1]
+
+
+# The lessons and interests of a set of distribution CSVs as integer columns. Subjects and teachers are
+# interned: subject_code_list[subject_id - 1] is the code of a subject id, teacher_name_list[teacher_id - 1]
+# the name of a teacher id. Lessons of target_year are the ones to plan and have no teacher.
+class TimetablingDataset:
+    def __init__(self, subject_code_list, subject_name_list, teacher_name_list, lesson_year, lesson_subject_id,
+                 lesson_teacher_id, interest_subject_id, interest_teacher_id, target_year):
+        self.subject_code_list = subject_code_list
+        self.subject_name_list = subject_name_list
+        self.teacher_name_list = teacher_name_list
+        self.lesson_year = lesson_year
+        self.lesson_subject_id = lesson_subject_id
+        self.lesson_teacher_id = lesson_teacher_id
+        self.interest_subject_id = interest_subject_id
+        self.interest_teacher_id = interest_teacher_id
+        self.target_year = target_year
+
+    def to_arrays(self):
+        return {
+            'subject_code_list': np.array(self.subject_code_list, dtype=str),
+            'subject_name_list': np.array(self.subject_name_list, dtype=str),
+            'teacher_name_list': np.array(self.teacher_name_list, dtype=str),
+            'lesson_year': self.lesson_year,
+            'lesson_subject_id': self.lesson_subject_id,
+            'lesson_teacher_id': self.lesson_teacher_id,
+            'interest_subject_id': self.interest_subject_id,
+            'interest_teacher_id': self.interest_teacher_id,
+            'target_year': np.array([] if self.target_year is None else [self.target_year], dtype=np.int32),
+        }
+
+    @staticmethod
+    def from_arrays(arrays):
+        return TimetablingDataset(
+            arrays['subject_code_list'].tolist(),
+            arrays['subject_name_list'].tolist(),
+            arrays['teacher_name_list'].tolist(),
+            arrays['lesson_year'],
+            arrays['lesson_subject_id'],
+            arrays['lesson_teacher_id'],
+            arrays['interest_subject_id'],
+            arrays['interest_teacher_id'],
+            int(arrays['target_year'][0]) if len(arrays['target_year']) else None)
+
+    def get_lesson_count(self):
+        return len(self.lesson_year)
+
+    # The ids of the teachers interested in each subject, in the order they were listed
+    def get_interested_teacher_ids_by_subject_id(self):
+        interested_teacher_ids_by_subject_id = {subject_id: [] for subject_id in
+                                                range(1, len(self.subject_code_list) + 1)}
+        for subject_id, teacher_id in zip(self.interest_subject_id.tolist(), self.interest_teacher_id.tolist()):
+            interested_teacher_ids_by_subject_id[subject_id].append(teacher_id)
+        return interested_teacher_ids_by_subject_id
+
+
+class TimetablingDatasetBuilder:
+    def __init__(self, course=None):
+        self.course = course
+        self.subject_codes = InternTable()
+        self.subject_name_by_id = dict()
+        self.teacher_names = InternTable()
+        self.lesson_year = []
+        self.lesson_subject_id = []
+        self.lesson_teacher_id = []
+        self.interest_subject_id = []
+        self.interest_teacher_id = []
+        self.target_year_set = set()
+
+    def add_file(self, csv_file, header, row_list):
+        if INTEREST_COLUMN in header:
+            self.add_interest_rows(get_year(csv_file), header, row_list)
+        elif TEACHER_COLUMN in header:
+            self.add_distribution_rows(get_year(csv_file), header, row_list)
+        else:
+            raise ValueError(f'The file ({csv_file}) has neither a {TEACHER_COLUMN} '
+                             f'nor an {INTEREST_COLUMN} column.')
+
+    def add_distribution_rows(self, year, header, row_list):
+        teacher_index = header.index(TEACHER_COLUMN)
+        for row in self.get_course_rows(header, row_list):
+            teacher_name = normalize_name(get_cell(row, teacher_index))
+            self.add_lesson(year, self.intern_subject(header, row),
+                            self.teacher_names.intern(teacher_name) if teacher_name else NO_TEACHER_ID)
+
+    # A row of an interest sheet is a lesson of the year to plan, with the teachers that would like to teach it
+    def add_interest_rows(self, year, header, row_list):
+        first_interest_index = header.index(INTEREST_COLUMN)
+        # The interest columns end at the next named column (RESOLUCAO), if any
+        end_interest_index = next((index for index in range(first_interest_index + 1, len(header))
+                                   if header[index].strip()), len(header))
+        self.target_year_set.add(year)
+        for row in self.get_course_rows(header, row_list):
+            subject_id = self.intern_subject(header, row)
+            self.add_lesson(year, subject_id, NO_TEACHER_ID)
+            for index in range(first_interest_index, end_interest_index):
+                teacher_name = normalize_name(get_cell(row, index))
+                if teacher_name:
+                    self.interest_subject_id.append(subject_id)
+                    self.interest_teacher_id.append(self.teacher_names.intern(teacher_name))
+
+    def get_course_rows(self, header, row_list):
+        subject_code_index = header.index(SUBJECT_CODE_COLUMN)
+        course_index = header.index(COURSE_COLUMN) if COURSE_COLUMN in header else None
+        for row in row_list:
+            if not get_cell(row, subject_code_index).strip():
+                continue
+            if self.course is not None and course_index is not None and \
+                    normalize_name(get_cell(row, course_index)) != self.course:
+                continue
+            yield row
+
+    def intern_subject(self, header, row):
+        subject_id = self.subject_codes.intern(get_cell(row, header.index(SUBJECT_CODE_COLUMN)).strip().upper())
+        if SUBJECT_NAME_COLUMN in header:
+            self.subject_name_by_id.setdefault(subject_id,
+                                               normalize_name(get_cell(row, header.index(SUBJECT_NAME_COLUMN))))
+        return subject_id
+
+    def add_lesson(self, year, subject_id, teacher_id):
+        self.lesson_year.append(year)
+        self.lesson_subject_id.append(subject_id)
+        self.lesson_teacher_id.append(teacher_id)
+
+    def build(self):
+        if len(self.target_year_set) > 1:
+            raise ValueError(f'Expected the interests of one year to plan, but got interests for the years '
+                             f'({", ".join(map(str, sorted(self.target_year_set)))}).')
+        lesson_year = np.array(self.lesson_year, dtype=np.int32)
+        # Lessons in chronological order; lessons of the same year keep their order in the files
+        lesson_order = np.argsort(lesson_year, kind='stable')
+        return TimetablingDataset(
+            list(self.subject_codes.key_list),
+            [self.subject_name_by_id.get(subject_id, '')
+             for subject_id in range(1, len(self.subject_codes.key_list) + 1)],
+            list(self.teacher_names.key_list),
+            lesson_year[lesson_order],
+            np.array(self.lesson_subject_id, dtype=np.int32)[lesson_order],
+            np.array(self.lesson_teacher_id, dtype=np.int32)[lesson_order],
+            np.array(self.interest_subject_id, dtype=np.int32),
+            np.array(self.interest_teacher_id, dtype=np.int32),
+            next(iter(self.target_year_set), None))
+
+
+def get_cell(row, index):
+    return row[index] if index < len(row) else ''
+
+
+def get_year(csv_file):
+    match = YEAR_PATTERN.search(os.path.basename(csv_file))
+    if match is None:
+        raise ValueError(f'Cannot tell the year of the file ({csv_file}): its name has no <year>-<semester>.')
+    return int(match.group(1))
+
+
+# The csv module keeps quoted multi-line cells (such as Horário) in one row
+def read_csv_file(csv_file):
+    with open(csv_file, newline='', encoding='utf-8-sig') as file:
+        reader = csv.reader(file)
+        header = [column.strip() for column in next(reader, [])]
+        return header, list(reader)
+
+
+# The yearly distributions in data/ and the interest sheets of the year to plan next to them
+def get_default_csv_file_list():
+    return sorted(glob.glob(os.path.join(DATA_DIR, '*.csv'))) + \
+        sorted(glob.glob(os.path.join(REPOSITORY_DIR, '*Distribuicoes*.csv')))
+
+
+# Interest sheets are read first, so subjects and teachers are numbered in the order the interest sheet
+# lists them
+def load_timetabling_dataset(csv_file_list, course=None):
+    builder = TimetablingDatasetBuilder(course)
+    file_list = [(csv_file, *read_csv_file(csv_file)) for csv_file in csv_file_list]
+    for csv_file, header, row_list in sorted(file_list, key=lambda file: INTEREST_COLUMN not in file[1]):
+        builder.add_file(csv_file, header, row_list)
+    return builder.build()
+
+
+# Stores parsed datasets as .npz files keyed by a hash of the contents of the source CSVs, so a run only
+# parses the CSVs again when one of them changed (or was added or removed).
+class TimetablingDatasetCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def get_cache_key(self, csv_file_list, course=None):
+        digest = hashlib.sha256()
+        digest.update(f'{DATASET_FORMAT_VERSION}:{course}'.encode('utf-8'))
+        for csv_file in csv_file_list:
+            with open(csv_file, 'rb') as file:
+                content = file.read()
+            # The file name carries the year, so it is part of the key
+            digest.update(os.path.basename(csv_file).encode('utf-8'))
+            digest.update(len(content).to_bytes(8, 'little'))
+            digest.update(content)
+        return digest.hexdigest()
+
+    def get_cache_path(self, csv_file_list, course=None):
+        return os.path.join(self.cache_dir, f'{self.get_cache_key(csv_file_list, course)}.npz')
+
+    def load_or_parse(self, csv_file_list, course=None):
+        cache_path = self.get_cache_path(csv_file_list, course)
+        if not os.path.exists(cache_path):
+            dataset = load_timetabling_dataset(csv_file_list, course)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file first so concurrent runs never read a partially written file
+            file_descriptor, temporary_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(file_descriptor, 'wb') as temporary_file:
+                    np.savez(temporary_file, **dataset.to_arrays())
+                os.replace(temporary_path, cache_path)
+            except BaseException:
+                os.remove(temporary_path)
+                raise
+            return dataset
+        with np.load(cache_path, allow_pickle=False) as arrays:
+            return TimetablingDataset.from_arrays(arrays)
+
+
+dataset_cache = TimetablingDatasetCache(
+    os.environ.get('TIMETABLING_DATASET_CACHE_DIR',
+                   os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dataset_cache')))
+
+
+@functools.lru_cache(maxsize=None)
+def get_default_dataset():
+    return dataset_cache.load_or_parse(get_default_csv_file_list())
@@ -1,4 +1,5 @@
 from random import Random
+from spatial_index import SpatialGridIndex
 
 class DemoDataBuilder:
     def __init__(self, Location, Depot, Customer, Vehicle, VehicleRoutingSolution, calculator):
@@ -127,8 +128,10 @@ class DemoDataBuilder:
         for depot in depot_list:
             location_list.append(depot.location)
 
-        self.distance_calculator.init_distance_maps(location_list)
+        self.distance_calculator.init_distance_matrix(location_list)
 
         return self.VehicleRoutingSolution(name, location_list,
                                       depot_list, vehicle_list, customer_list, self.southWestCorner,
-                                      self.northEastCorner)
\ No newline at end of file
+                                      self.northEastCorner,
+                                      customer_spatial_index=SpatialGridIndex(customer_list,
+                                                                              lambda customer: customer.location))
\ No newline at end of file
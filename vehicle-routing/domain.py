@@ -1,7 +1,13 @@
+import abc
+import hashlib
 import math
+import os
+import tempfile
 from random import Random
+import numpy as np
+from spatial_index import SpatialGridIndex
 from optapy import problem_fact, planning_entity, planning_list_variable, planning_solution, planning_score, \
-    planning_entity_collection_property, problem_fact_collection_property, value_range_provider
+    planning_entity_collection_property, problem_fact_collection_property, value_range_provider, planning_id
 from optapy.score import HardSoftScore
 
 @problem_fact
@@ -10,17 +16,30 @@ class Location:
     latitude: float
     longitude: float
     distance_map: dict['Location', float]
+    index: int
 
     def __init__(self, _id, latitude, longitude, distance_map=None):
         self.id = _id
         self.latitude = latitude
         self.longitude = longitude
         self.distance_map = distance_map
+        self.index = None
+        self.distance_matrix = None
 
     def set_distance_map(self, distance_map):
         self.distance_map = distance_map
 
+    def set_distance_matrix(self, index, distance_matrix):
+        self.index = index
+        self.distance_matrix = distance_matrix
+
+    # A location added while solving has a larger matrix than the locations before it (see
+    # VehicleRoutingSolution.add_location); the larger of the two matrices holds both locations
     def get_distance_to(self, location):
+        if self.distance_matrix is not None:
+            if location.index < self.distance_matrix.shape[0]:
+                return int(self.distance_matrix[self.index, location.index])
+            return int(location.distance_matrix[self.index, location.index])
         return self.distance_map[location]
 
     def get_angle(self, location):
@@ -49,6 +68,10 @@ class Customer:
         self.location = location
         self.demand = demand
 
+    @planning_id
+    def get_id(self):
+        return self.id
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -82,6 +105,122 @@ class Depot:
         return f'Depot {self.id}'
 
 
+# Customer list of a Vehicle that keeps the route's total demand and distance up to date.
+# Single element changes (the ones list moves make) only recalculate the legs next to the changed position,
+# any other change falls back to walking the whole route.
+class CustomerList(list):
+    def __init__(self, depot_location, customers=()):
+        super().__init__(customers)
+        self.depot_location = depot_location
+        self.total_demand = sum(customer.demand for customer in self)
+        self.total_distance_meters = None
+
+    def get_total_distance_meters(self):
+        if self.total_distance_meters is None:
+            self.total_distance_meters = self._calculate_total_distance_meters()
+        return self.total_distance_meters
+
+    def _calculate_total_distance_meters(self):
+        total_distance = 0
+        last_location = self.depot_location
+        for customer in self:
+            total_distance += customer.location.get_distance_to(last_location)
+            last_location = customer.location
+        if last_location is not self.depot_location:
+            total_distance += self.depot_location.get_distance_to(last_location)
+        return total_distance
+
+    def _location_at(self, index):
+        if index < 0 or index >= len(self):
+            return self.depot_location
+        return super().__getitem__(index).location
+
+    def _distance_through(self, previous_location, location, next_location):
+        return location.get_distance_to(previous_location) + next_location.get_distance_to(location) - \
+            next_location.get_distance_to(previous_location)
+
+    def _reset(self):
+        self.total_demand = sum(customer.demand for customer in self)
+        self.total_distance_meters = None
+
+    def _normalize_index(self, index):
+        return index + len(self) if index < 0 else index
+
+    def append(self, customer):
+        self.insert(len(self), customer)
+
+    def insert(self, index, customer):
+        index = min(max(self._normalize_index(index), 0), len(self))
+        if self.total_distance_meters is not None:
+            self.total_distance_meters += self._distance_through(self._location_at(index - 1), customer.location,
+                                                                 self._location_at(index))
+        super().insert(index, customer)
+        self.total_demand += customer.demand
+
+    def pop(self, index=-1):
+        index = self._normalize_index(index)
+        customer = super().pop(index)
+        if self.total_distance_meters is not None:
+            self.total_distance_meters -= self._distance_through(self._location_at(index - 1), customer.location,
+                                                                 self._location_at(index))
+        self.total_demand -= customer.demand
+        return customer
+
+    def remove(self, customer):
+        self.pop(self.index(customer))
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            super().__setitem__(index, value)
+            self._reset()
+            return
+        index = self._normalize_index(index)
+        old_customer = super().__getitem__(index)
+        if self.total_distance_meters is not None:
+            previous_location = self._location_at(index - 1)
+            next_location = self._location_at(index + 1)
+            self.total_distance_meters += \
+                self._distance_through(previous_location, value.location, next_location) - \
+                self._distance_through(previous_location, old_customer.location, next_location)
+        super().__setitem__(index, value)
+        self.total_demand += value.demand - old_customer.demand
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            super().__delitem__(index)
+            self._reset()
+            return
+        self.pop(index)
+
+    def extend(self, customers):
+        super().extend(customers)
+        self._reset()
+
+    def __iadd__(self, customers):
+        self.extend(customers)
+        return self
+
+    def __imul__(self, count):
+        super().__imul__(count)
+        self._reset()
+        return self
+
+    def clear(self):
+        super().clear()
+        self._reset()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self.total_distance_meters = None
+
+    def reverse(self):
+        super().reverse()
+        self.total_distance_meters = None
+
+    def __reduce__(self):
+        return CustomerList, (self.depot_location, list(self))
+
+
 @planning_entity
 class Vehicle:
     id: int
@@ -94,16 +233,26 @@ class Vehicle:
         self.capacity = capacity
         self.depot = depot
         if customer_list is None:
-            self.customer_list = []
+            self.customer_list = CustomerList(depot.location)
         else:
-            self.customer_list = customer_list
+            self.customer_list = CustomerList(depot.location, customer_list)
+
+    @planning_id
+    def get_id(self):
+        return self.id
 
     @planning_list_variable(Customer, ['customer_range'])
     def get_customer_list(self):
         return self.customer_list
 
     def set_customer_list(self, customer_list):
-        self.customer_list = customer_list
+        self.customer_list = CustomerList(self.depot.location, customer_list)
+
+    def remove_customer(self, customer_id):
+        for index, customer in enumerate(self.customer_list):
+            if customer.id == customer_id:
+                del self.customer_list[index]
+                return
 
     def get_route(self):
         if len(self.customer_list) == 0:
@@ -115,20 +264,10 @@ class Vehicle:
         return route
 
     def get_total_demand(self):
-        total_demand = 0
-        for customer in self.customer_list:
-            total_demand += customer.demand
-        return total_demand
+        return self.customer_list.total_demand
 
     def get_total_distance_meters(self):
-        total_distance = 0
-        last_location = self.depot.location
-        for customer in self.customer_list:
-            total_distance += customer.location.get_distance_to(last_location)
-            last_location = customer.location
-        if last_location is not self.depot.location:
-            total_distance += self.depot.location.get_distance_to(last_location)
-        return total_distance
+        return self.customer_list.get_total_distance_meters()
 
     def to_dict(self):
         return {
@@ -145,16 +284,24 @@ class Vehicle:
         return f'Vehicle {self.id}'
 
 
-class EuclideanDistanceCalculator:
+# Base class of the distance calculators. Subclasses implement calculate_distances on NumPy arrays, which is
+# broadcast over blocks of rows so the peak memory of filling the matrix stays bounded.
+class DistanceCalculator(abc.ABC):
     METERS_PER_DEGREE = 111_000
+    MAX_CHUNK_ELEMENTS = 4_000_000
+
+    @abc.abstractmethod
+    def calculate_distances(self, start_latitudes, start_longitudes, end_latitudes, end_longitudes):
+        pass
+
+    def get_cache_identity(self):
+        return type(self).__qualname__
 
     def calculate_distance(self, start, end):
         if start == end:
             return 0
-        latitude_diff = end.latitude - start.latitude
-        longitude_diff = end.longitude - start.longitude
-        return math.ceil(math.sqrt(latitude_diff * latitude_diff + longitude_diff * longitude_diff) *
-                         EuclideanDistanceCalculator.METERS_PER_DEGREE)
+        return math.ceil(float(self.calculate_distances(start.latitude, start.longitude,
+                                                        end.latitude, end.longitude)))
 
     def init_distance_maps(self, location_list):
         for location in location_list:
@@ -163,6 +310,219 @@ class EuclideanDistanceCalculator:
                 distance_map[other_location] = self.calculate_distance(location, other_location)
             location.set_distance_map(distance_map)
 
+    def calculate_distance_matrix(self, location_list):
+        location_count = len(location_list)
+        latitudes = np.fromiter((location.latitude for location in location_list), dtype=np.float64,
+                                count=location_count)
+        longitudes = np.fromiter((location.longitude for location in location_list), dtype=np.float64,
+                                 count=location_count)
+        distance_matrix = np.empty((location_count, location_count), dtype=np.int32)
+        chunk_size = max(DistanceCalculator.MAX_CHUNK_ELEMENTS // max(location_count, 1), 1)
+        for start in range(0, location_count, chunk_size):
+            end = min(start + chunk_size, location_count)
+            distances = self.calculate_distances(latitudes[start:end, np.newaxis], longitudes[start:end, np.newaxis],
+                                                 latitudes[np.newaxis, :], longitudes[np.newaxis, :])
+            distance_matrix[start:end] = np.ceil(distances)
+            rows = np.arange(end - start)
+            distance_matrix[rows, rows + start] = 0
+        return distance_matrix
+
+    # Adds rows and columns for added_location_list to the distance matrix of location_list;
+    # the distances between the existing locations are copied, not recalculated.
+    # Only the added locations are given the extended matrix, the existing ones keep theirs.
+    def extend_distance_matrix(self, distance_matrix, location_list, added_location_list):
+        old_count = len(location_list)
+        location_list = list(location_list) + list(added_location_list)
+        location_count = len(location_list)
+        latitudes = np.array([location.latitude for location in location_list], dtype=np.float64)
+        longitudes = np.array([location.longitude for location in location_list], dtype=np.float64)
+        extended_matrix = np.empty((location_count, location_count), dtype=np.int32)
+        extended_matrix[:old_count, :old_count] = distance_matrix
+        extended_matrix[old_count:, :] = np.ceil(self.calculate_distances(
+            latitudes[old_count:, np.newaxis], longitudes[old_count:, np.newaxis],
+            latitudes[np.newaxis, :], longitudes[np.newaxis, :]))
+        extended_matrix[:old_count, old_count:] = np.ceil(self.calculate_distances(
+            latitudes[:old_count, np.newaxis], longitudes[:old_count, np.newaxis],
+            latitudes[np.newaxis, old_count:], longitudes[np.newaxis, old_count:]))
+        added_indices = np.arange(old_count, location_count)
+        extended_matrix[added_indices, added_indices] = 0
+        for index, location in enumerate(added_location_list, old_count):
+            location.set_distance_matrix(index, extended_matrix)
+        return extended_matrix
+
+    # False for calculators that cannot give the distances of locations added after the matrix was built
+    def can_extend_distance_matrix(self):
+        return True
+
+    def init_distance_matrix(self, location_list, distance_matrix_cache=None):
+        if distance_matrix_cache is None:
+            distance_matrix = self.calculate_distance_matrix(location_list)
+        else:
+            distance_matrix = distance_matrix_cache.load_or_calculate(self, location_list)
+        for index, location in enumerate(location_list):
+            location.set_distance_matrix(index, distance_matrix)
+        return distance_matrix
+
+
+class EuclideanDistanceCalculator(DistanceCalculator):
+    def calculate_distances(self, start_latitudes, start_longitudes, end_latitudes, end_longitudes):
+        latitude_diff = np.subtract(end_latitudes, start_latitudes)
+        longitude_diff = np.subtract(end_longitudes, start_longitudes)
+        return np.sqrt(latitude_diff * latitude_diff + longitude_diff * longitude_diff) * \
+            DistanceCalculator.METERS_PER_DEGREE
+
+
+class ManhattanDistanceCalculator(DistanceCalculator):
+    def calculate_distances(self, start_latitudes, start_longitudes, end_latitudes, end_longitudes):
+        return (np.abs(np.subtract(end_latitudes, start_latitudes)) +
+                np.abs(np.subtract(end_longitudes, start_longitudes))) * DistanceCalculator.METERS_PER_DEGREE
+
+
+class HaversineDistanceCalculator(DistanceCalculator):
+    EARTH_RADIUS_METERS = 6_371_000
+
+    def calculate_distances(self, start_latitudes, start_longitudes, end_latitudes, end_longitudes):
+        start_latitudes = np.radians(start_latitudes)
+        end_latitudes = np.radians(end_latitudes)
+        half_latitude_diff = (end_latitudes - start_latitudes) / 2
+        half_longitude_diff = np.radians(np.subtract(end_longitudes, start_longitudes)) / 2
+        a = np.sin(half_latitude_diff) ** 2 + \
+            np.cos(start_latitudes) * np.cos(end_latitudes) * np.sin(half_longitude_diff) ** 2
+        return 2 * HaversineDistanceCalculator.EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+# Distances read from a square matrix file (.npy or .csv, in meters) whose rows and columns follow the order of
+# the location list it is used with.
+class PrecomputedDistanceCalculator(DistanceCalculator):
+    def __init__(self, path):
+        self.path = path
+        if path.endswith('.npy'):
+            self.distance_matrix = np.load(path, mmap_mode='r')
+        else:
+            self.distance_matrix = np.loadtxt(path, delimiter=',', dtype=np.int32, ndmin=2)
+        if self.distance_matrix.ndim != 2 or self.distance_matrix.shape[0] != self.distance_matrix.shape[1]:
+            raise ValueError(f'The distance matrix ({path}) must be square, but has shape '
+                             f'{self.distance_matrix.shape}.')
+
+    # The matrix only holds the distances between the locations it was computed for
+    def calculate_distances(self, start_latitudes, start_longitudes, end_latitudes, end_longitudes):
+        raise ValueError(f'The precomputed distance matrix ({self.path}) cannot give distances between '
+                         f'coordinates; it only holds the distances between its own locations.')
+
+    def can_extend_distance_matrix(self):
+        return False
+
+    def get_cache_identity(self):
+        return f'{type(self).__qualname__}:{os.path.abspath(self.path)}:{os.path.getmtime(self.path)}'
+
+    def calculate_distance(self, start, end):
+        return int(self.distance_matrix[start.index, end.index])
+
+    def init_distance_maps(self, location_list):
+        self._check_location_count(location_list)
+        for index, location in enumerate(location_list):
+            distance_map = dict()
+            for other_index, other_location in enumerate(location_list):
+                distance_map[other_location] = int(self.distance_matrix[index, other_index])
+            location.set_distance_map(distance_map)
+
+    def calculate_distance_matrix(self, location_list):
+        self._check_location_count(location_list)
+        return np.asarray(self.distance_matrix, dtype=np.int32)
+
+    def _check_location_count(self, location_list):
+        if self.distance_matrix.shape[0] != len(location_list):
+            raise ValueError(f'The distance matrix ({self.path}) has {self.distance_matrix.shape[0]} rows, '
+                             f'but there are {len(location_list)} locations.')
+
+
+# Stores distance matrices as .npy files keyed by the calculator and the ordered location coordinates.
+# Cached matrices are memory-mapped read-only, so restarts and worker processes share one page-cached copy.
+class DistanceMatrixCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def get_cache_key(self, calculator, location_list):
+        coordinates = np.array([(location.latitude, location.longitude) for location in location_list],
+                               dtype=np.float64)
+        digest = hashlib.sha256()
+        digest.update(calculator.get_cache_identity().encode('utf-8'))
+        digest.update(coordinates.tobytes())
+        return digest.hexdigest()
+
+    def get_cache_path(self, calculator, location_list):
+        return os.path.join(self.cache_dir, f'{self.get_cache_key(calculator, location_list)}.npy')
+
+    def load_or_calculate(self, calculator, location_list):
+        return self._load_or_save(self.get_cache_path(calculator, location_list),
+                                  lambda: calculator.calculate_distance_matrix(location_list))
+
+    def load_or_calculate_nearby_indices(self, calculator, location_list, distance_matrix, nearby_size):
+        cache_path = self.get_cache_path(calculator, location_list)[:-len('.npy')] + f'.nearby-{nearby_size}.npy'
+        return self._load_or_save(cache_path,
+                                  lambda: NearbyLocationIndex.calculate_nearby_indices(distance_matrix, nearby_size))
+
+    def _load_or_save(self, cache_path, calculate):
+        if not os.path.exists(cache_path):
+            calculated = calculate()
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file first so concurrent readers never map a partially written file
+            file_descriptor, temporary_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(file_descriptor, 'wb') as temporary_file:
+                    np.save(temporary_file, calculated)
+                os.replace(temporary_path, cache_path)
+            except BaseException:
+                os.remove(temporary_path)
+                raise
+        return np.load(cache_path, mmap_mode='r')
+
+
+# For every location, the indices of its nearby_size closest other locations, sorted by distance.
+# It serves nearby-customer lookups; the solver's move selectors do not use it, as OptaPlanner's nearby
+# selection needs a Java NearbyDistanceMeter class, which OptaPy cannot define for a Python domain.
+class NearbyLocationIndex:
+    DEFAULT_NEARBY_SIZE = 40
+    ROW_CHUNK_SIZE = 1024
+
+    def __init__(self, location_list, nearby_indices):
+        self.location_list = location_list
+        self.nearby_indices = nearby_indices
+
+    @staticmethod
+    def build(location_list, distance_matrix, nearby_size=DEFAULT_NEARBY_SIZE, calculator=None,
+              distance_matrix_cache=None):
+        if distance_matrix_cache is None:
+            nearby_indices = NearbyLocationIndex.calculate_nearby_indices(distance_matrix, nearby_size)
+        else:
+            nearby_indices = distance_matrix_cache.load_or_calculate_nearby_indices(calculator, location_list,
+                                                                                     distance_matrix, nearby_size)
+        return NearbyLocationIndex(location_list, nearby_indices)
+
+    @staticmethod
+    def calculate_nearby_indices(distance_matrix, nearby_size):
+        location_count = distance_matrix.shape[0]
+        nearby_size = max(min(nearby_size, location_count - 1), 0)
+        nearby_indices = np.empty((location_count, nearby_size), dtype=np.int32)
+        if nearby_size == 0:
+            return nearby_indices
+        for start in range(0, location_count, NearbyLocationIndex.ROW_CHUNK_SIZE):
+            end = min(start + NearbyLocationIndex.ROW_CHUNK_SIZE, location_count)
+            rows = np.arange(end - start)
+            # Copy the rows so the (possibly memory-mapped, read-only) matrix is never written to
+            distances = np.array(distance_matrix[start:end], dtype=np.int64)
+            distances[rows, rows + start] = np.iinfo(np.int64).max  # a location is not nearby itself
+            closest = np.argpartition(distances, nearby_size - 1, axis=1)[:, :nearby_size]
+            order = np.argsort(np.take_along_axis(distances, closest, axis=1), axis=1, kind='stable')
+            nearby_indices[start:end] = np.take_along_axis(closest, order, axis=1)
+        return nearby_indices
+
+    def get_nearby_locations(self, location, count=None):
+        nearby_indices = self.nearby_indices[location.index]
+        if count is not None:
+            nearby_indices = nearby_indices[:count]
+        return [self.location_list[index] for index in nearby_indices]
+
 
 class DemoDataBuilder:
     def __init__(self):
@@ -175,11 +535,17 @@ class DemoDataBuilder:
         self.maxDemand = None
         self.vehicleCapacity = None
         self.distance_calculator = EuclideanDistanceCalculator()
+        self.distance_matrix_cache = None
+        self.nearby_size = NearbyLocationIndex.DEFAULT_NEARBY_SIZE
 
     @staticmethod
     def builder():
         return DemoDataBuilder()
 
+    def set_distance_calculator(self, distance_calculator):
+        self.distance_calculator = distance_calculator
+        return self
+
     def set_south_west_corner(self, southWestCorner):
         self.southWestCorner = southWestCorner
         return self
@@ -212,6 +578,14 @@ class DemoDataBuilder:
         self.vehicleCapacity = vehicleCapacity
         return self
 
+    def set_distance_matrix_cache(self, distance_matrix_cache):
+        self.distance_matrix_cache = distance_matrix_cache
+        return self
+
+    def set_nearby_size(self, nearby_size):
+        self.nearby_size = nearby_size
+        return self
+
     def build(self):
         if self.minDemand < 1:
             raise ValueError("minDemand (" + self.minDemand + ") must be greater than zero.")
@@ -286,17 +660,24 @@ class DemoDataBuilder:
         for depot in depot_list:
             location_list.append(depot.location)
 
-        self.distance_calculator.init_distance_maps(location_list)
+        self.distance_calculator.init_distance_matrix(location_list, self.distance_matrix_cache)
 
+        # The nearby index is only built when a nearby lookup first needs it
         return VehicleRoutingSolution(name, location_list,
                                       depot_list, vehicle_list, customer_list, self.southWestCorner,
-                                      self.northEastCorner)
+                                      self.northEastCorner,
+                                      customer_spatial_index=SpatialGridIndex(customer_list,
+                                                                              lambda customer: customer.location),
+                                      distance_calculator=self.distance_calculator,
+                                      distance_matrix_cache=self.distance_matrix_cache, nearby_size=self.nearby_size)
 
 
 @planning_solution
 class VehicleRoutingSolution:
     def __init__(self,  name, location_list, depot_list, vehicle_list, customer_list,
-                 south_west_corner, north_east_corner, score=None):
+                 south_west_corner, north_east_corner, score=None, nearby_location_index=None,
+                 customer_spatial_index=None, distance_calculator=None, distance_matrix_cache=None,
+                 nearby_size=NearbyLocationIndex.DEFAULT_NEARBY_SIZE):
         self.name = name
         self.location_list = location_list
         self.depot_list = depot_list
@@ -305,13 +686,20 @@ class VehicleRoutingSolution:
         self.south_west_corner = south_west_corner
         self.north_east_corner = north_east_corner
         self.score = score
+        self.nearby_location_index = nearby_location_index
+        self.customer_spatial_index = customer_spatial_index
+        self.distance_calculator = distance_calculator
+        self.distance_matrix_cache = distance_matrix_cache
+        self.nearby_size = nearby_size
+        self.customer_by_location_index = None
 
     @staticmethod
-    def empty():
+    def empty(distance_matrix_cache=None):
         problem = DemoDataBuilder.builder().set_min_demand(1).set_max_demand(2).set_vehicle_capacity(25) \
                                  .set_customer_count(77).set_vehicle_count(6).set_depot_count(2) \
                                  .set_south_west_corner(Location(0, 43.751466, 11.177210)) \
-                                 .set_north_east_corner(Location(0, 43.809291, 11.290195)).build()
+                                 .set_north_east_corner(Location(0, 43.809291, 11.290195)) \
+                                 .set_distance_matrix_cache(distance_matrix_cache).build()
         problem.set_score(HardSoftScore.ZERO)
         return problem
 
@@ -343,6 +731,95 @@ class VehicleRoutingSolution:
     def get_bounds(self):
         return [self.south_west_corner, self.north_east_corner]
 
+    def get_customer_spatial_index(self):
+        if self.customer_spatial_index is None:
+            self.customer_spatial_index = SpatialGridIndex(self.customer_list, lambda customer: customer.location)
+        return self.customer_spatial_index
+
+    def get_customers_within_radius(self, location, radius_meters):
+        return self.get_customer_spatial_index().get_items_within_radius(location, radius_meters)
+
+    def get_customers_in_bounding_box(self, south_west, north_east):
+        return self.get_customer_spatial_index().get_items_in_bounding_box(south_west, north_east)
+
+    def get_nearby_location_index(self):
+        if self.nearby_location_index is None:
+            self.nearby_location_index = NearbyLocationIndex.build(self.location_list, self.get_distance_matrix(),
+                                                                   self.nearby_size, self.distance_calculator,
+                                                                   self.distance_matrix_cache)
+        return self.nearby_location_index
+
+    def get_customer_by_location_index(self):
+        if self.customer_by_location_index is None:
+            self.customer_by_location_index = {customer.location.index: customer
+                                               for customer in self.customer_list}
+        return self.customer_by_location_index
+
+    # The customers closest to location by distance matrix (road) distance, closest first
+    def get_nearby_customers(self, location, count=None):
+        customer_by_location_index = self.get_customer_by_location_index()
+        nearby_customers = []
+        for nearby_location in self.get_nearby_location_index().get_nearby_locations(location):
+            customer = customer_by_location_index.get(nearby_location.index)
+            if customer is not None:
+                nearby_customers.append(customer)
+                if count is not None and len(nearby_customers) == count:
+                    break
+        return nearby_customers
+
+    def get_max_id(self):
+        return max((item.id for item_list in (self.location_list, self.depot_list, self.vehicle_list,
+                                              self.customer_list) for item in item_list), default=0)
+
+    # The matrix of the most recently added location, which holds the distances between all locations
+    def get_distance_matrix(self):
+        return self.location_list[-1].distance_matrix
+
+    def can_add_location(self):
+        return self.distance_calculator is not None and self.distance_calculator.can_extend_distance_matrix()
+
+    # The methods below keep the distance matrix and the indexes in sync when the problem changes.
+    # A new location gets its distances to every other location; the nearby index is rebuilt on its next use.
+    # The lists are replaced rather than appended to, as they are shared with the registered problem and the
+    # best solutions, and so are the existing locations, which are left unchanged.
+    def add_location(self, location):
+        self.distance_calculator.extend_distance_matrix(self.get_distance_matrix(), self.location_list, [location])
+        self.location_list = self.location_list + [location]
+        self.nearby_location_index = None
+        # The extended matrix is not on disk, so neither is its nearby index
+        self.distance_matrix_cache = None
+
+    def add_customer(self, customer):
+        self.customer_list = self.customer_list + [customer]
+        self.customer_spatial_index = None
+        self.customer_by_location_index = None
+
+    def find_customer(self, customer_id):
+        return next((customer for customer in self.customer_list if customer.id == customer_id), None)
+
+    def remove_customer(self, customer_id):
+        self.customer_list = [customer for customer in self.customer_list if customer.id != customer_id]
+        self.customer_spatial_index = None
+        self.customer_by_location_index = None
+
+    def find_vehicle(self, vehicle_id):
+        return next((vehicle for vehicle in self.vehicle_list if vehicle.id == vehicle_id), None)
+
+    def find_vehicle_of_customer(self, customer_id):
+        return next((vehicle for vehicle in self.vehicle_list
+                     if any(customer.id == customer_id for customer in vehicle.customer_list)), None)
+
+    def add_vehicle(self, vehicle, index=None):
+        if index is None:
+            index = len(self.vehicle_list)
+        self.vehicle_list = self.vehicle_list[:index] + [vehicle] + self.vehicle_list[index:]
+
+    def remove_vehicle(self, vehicle_id):
+        self.vehicle_list = [vehicle for vehicle in self.vehicle_list if vehicle.id != vehicle_id]
+
+    def find_depot(self, depot_id):
+        return next((depot for depot in self.depot_list if depot.id == depot_id), None)
+
     def get_distance_meters(self):
         return -self.score.getSoftScore() if self.score is not None else 0
 
@@ -0,0 +1,77 @@
+from optapy import problem_change
+
+# Each change does its work in apply(working_solution, problem_change_director), so the same change can be
+# submitted to a running solver (doChange) or applied to a problem that is not being solved
+# (ProblemRegistry.apply_problem_change). Entities and facts to remove are referenced by id, as the solver
+# works on its own copies of them.
+
+
+@problem_change
+class AddCustomerProblemChange:
+    def __init__(self, customer):
+        self.customer = customer
+
+    def apply(self, working_solution, problem_change_director):
+        problem_change_director.addProblemFact(self.customer.location,
+                                               lambda location: working_solution.add_location(location))
+        problem_change_director.addProblemFact(self.customer,
+                                               lambda customer: working_solution.add_customer(customer))
+
+    def doChange(self, working_solution, problem_change_director):
+        self.apply(working_solution, problem_change_director)
+
+
+@problem_change
+class RemoveCustomerProblemChange:
+    def __init__(self, customer_id):
+        self.customer_id = customer_id
+
+    def apply(self, working_solution, problem_change_director):
+        # changeVariable only notifies basic variable listeners, so it cannot change a list variable. The vehicle
+        # visiting the customer is taken out of the working solution instead, and added back without the customer.
+        working_vehicle = working_solution.find_vehicle_of_customer(self.customer_id)
+        if working_vehicle is not None:
+            vehicle_index = working_solution.vehicle_list.index(working_vehicle)
+            problem_change_director.removeEntity(working_vehicle,
+                                                 lambda vehicle: working_solution.remove_vehicle(vehicle.id))
+
+            def add_vehicle_without_customer(vehicle):
+                vehicle.remove_customer(self.customer_id)
+                working_solution.add_vehicle(vehicle, vehicle_index)
+
+            problem_change_director.addEntity(working_vehicle, add_vehicle_without_customer)
+        working_customer = working_solution.find_customer(self.customer_id)
+        if working_customer is not None:
+            problem_change_director.removeProblemFact(working_customer,
+                                                      lambda customer:
+                                                      working_solution.remove_customer(self.customer_id))
+
+    def doChange(self, working_solution, problem_change_director):
+        self.apply(working_solution, problem_change_director)
+
+
+@problem_change
+class AddVehicleProblemChange:
+    def __init__(self, vehicle):
+        self.vehicle = vehicle
+
+    def apply(self, working_solution, problem_change_director):
+        problem_change_director.addEntity(self.vehicle, lambda vehicle: working_solution.add_vehicle(vehicle))
+
+    def doChange(self, working_solution, problem_change_director):
+        self.apply(working_solution, problem_change_director)
+
+
+@problem_change
+class RemoveVehicleProblemChange:
+    def __init__(self, vehicle_id):
+        self.vehicle_id = vehicle_id
+
+    def apply(self, working_solution, problem_change_director):
+        working_vehicle = working_solution.find_vehicle(self.vehicle_id)
+        if working_vehicle is not None:
+            problem_change_director.removeEntity(working_vehicle,
+                                                 lambda vehicle: working_solution.remove_vehicle(self.vehicle_id))
+
+    def doChange(self, working_solution, problem_change_director):
+        self.apply(working_solution, problem_change_director)
@@ -0,0 +1,188 @@
+import collections
+import itertools
+import threading
+
+
+class UnknownProblemError(ValueError):
+    pass
+
+
+class SolverCapacityError(RuntimeError):
+    pass
+
+
+# Stands in for the solver's ProblemChangeDirector when a problem change is applied to a problem that is
+# not being solved: the registered solution is the working solution, so every change is made in place.
+class DirectProblemChangeDirector:
+    def addEntity(self, entity, entity_consumer):
+        entity_consumer(entity)
+
+    def removeEntity(self, entity, entity_consumer):
+        entity_consumer(entity)
+
+    def changeVariable(self, entity, variable_name, entity_consumer):
+        entity_consumer(entity)
+
+    def addProblemFact(self, problem_fact, problem_fact_consumer):
+        problem_fact_consumer(problem_fact)
+
+    def removeProblemFact(self, problem_fact, problem_fact_consumer):
+        problem_fact_consumer(problem_fact)
+
+    def changeProblemProperty(self, problem_fact_or_entity, problem_fact_or_entity_consumer):
+        problem_fact_or_entity_consumer(problem_fact_or_entity)
+
+    def lookUpWorkingObject(self, external_object):
+        return external_object
+
+    def lookUpWorkingObjectOrFail(self, external_object):
+        return external_object
+
+
+class ProblemEntry:
+    def __init__(self, problem_id, solution):
+        self.problem_id = problem_id
+        self.solution = solution
+        self.lock = threading.RLock()
+        self.is_solving = False
+        self.is_queued = False
+        self.solver_manager = None
+
+
+# Holds many problems by id, each with its own lock. Problems are kept in least recently used order;
+# once there are more than max_problem_count, idle (not solving or queued) problems are evicted oldest first.
+# Problems in pinned_problem_ids, such as the default problem of the alias routes, are never evicted.
+# At most max_concurrent_solves problems are solved at the same time.
+class ProblemRegistry:
+    def __init__(self, solver_manager, max_problem_count=32, max_concurrent_solves=4, on_remove=None,
+                 pinned_problem_ids=()):
+        self.solver_manager = solver_manager
+        self.max_problem_count = max_problem_count
+        self.max_concurrent_solves = max_concurrent_solves
+        self.on_remove = on_remove
+        self.pinned_problem_ids = frozenset(pinned_problem_ids)
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.solving_count = 0
+        self.id_sequence = itertools.count(1)
+
+    def add(self, solution, problem_id=None):
+        with self.lock:
+            if problem_id is None:
+                problem_id = next(self.id_sequence)
+                while problem_id in self.entries:
+                    problem_id = next(self.id_sequence)
+            self.entries[problem_id] = ProblemEntry(problem_id, solution)
+            self.entries.move_to_end(problem_id)
+            evicted_entries = self._evict_idle_entries(problem_id)
+        for evicted_entry in evicted_entries:
+            self._notify_removed(evicted_entry)
+        return problem_id
+
+    def _evict_idle_entries(self, added_problem_id):
+        evicted_entries = []
+        for entry in list(self.entries.values()):
+            if len(self.entries) <= self.max_problem_count:
+                break
+            if not entry.is_solving and not entry.is_queued and entry.problem_id != added_problem_id and \
+                    entry.problem_id not in self.pinned_problem_ids:
+                del self.entries[entry.problem_id]
+                evicted_entries.append(entry)
+        return evicted_entries
+
+    def _notify_removed(self, entry):
+        if self.on_remove is not None:
+            self.on_remove(entry.problem_id)
+
+    def get_entry(self, problem_id):
+        with self.lock:
+            entry = self.entries.get(problem_id)
+            if entry is None:
+                raise UnknownProblemError(f'There is no problem with id ({problem_id})')
+            self.entries.move_to_end(problem_id)
+            return entry
+
+    def get_problem_ids(self):
+        with self.lock:
+            return list(self.entries.keys())
+
+    def find_by_id(self, problem_id):
+        return self.get_entry(problem_id).solution
+
+    def save(self, problem_id, solution):
+        entry = self.get_entry(problem_id)
+        with entry.lock:
+            entry.solution = solution
+
+    def remove(self, problem_id):
+        entry = self.get_entry(problem_id)
+        if entry.is_solving:
+            entry.solver_manager.terminateEarly(problem_id)
+        with self.lock:
+            self.entries.pop(problem_id, None)
+        self._notify_removed(entry)
+
+    def is_solving(self, problem_id):
+        return self.get_entry(problem_id).is_solving
+
+    def get_solver_manager(self, problem_id):
+        return self.get_entry(problem_id).solver_manager or self.solver_manager
+
+    # The problem_finder, called on the solver thread, can prepare the problem before it is solved;
+    # by default the registered solution is solved as is. A solver_manager with another solver config
+    # can be passed for this solve only.
+    def solve(self, problem_id, best_solution_consumer=None, final_best_solution_consumer=None,
+              exception_handler=None, problem_finder=None, solver_manager=None):
+        entry = self.get_entry(problem_id)
+        with self.lock:
+            if entry.is_solving:
+                return
+            if self.solving_count >= self.max_concurrent_solves:
+                raise SolverCapacityError(f'Cannot solve problem ({problem_id}): already solving '
+                                          f'{self.solving_count} of at most {self.max_concurrent_solves} problems.')
+            entry.is_solving = True
+            entry.solver_manager = solver_manager or self.solver_manager
+            self.solving_count += 1
+
+        def save(solution):
+            with entry.lock:
+                entry.solution = solution
+            if best_solution_consumer is not None:
+                best_solution_consumer(problem_id, solution)
+
+        def finish(solution):
+            self._release(entry)
+            if final_best_solution_consumer is not None:
+                final_best_solution_consumer(problem_id, solution)
+
+        def handle_exception(the_problem_id, exception):
+            self._release(entry)
+            if exception_handler is not None:
+                exception_handler(the_problem_id, exception)
+
+        try:
+            entry.solver_manager.solveAndListen(problem_id, problem_finder or self.find_by_id, save, finish,
+                                                handle_exception)
+        except BaseException:
+            self._release(entry)
+            raise
+
+    # Submits the problem change to the solver while the problem is being solved, so the solver keeps its state;
+    # otherwise applies it to the registered solution right away. Returns whether it was applied right away.
+    def apply_problem_change(self, problem_id, problem_change):
+        entry = self.get_entry(problem_id)
+        with entry.lock:
+            if entry.is_solving:
+                entry.solver_manager.addProblemChange(problem_id, problem_change)
+                return False
+            problem_change.apply(entry.solution, DirectProblemChangeDirector())
+            return True
+
+    def _release(self, entry):
+        with self.lock:
+            if entry.is_solving:
+                entry.is_solving = False
+                self.solving_count -= 1
+
+    def stop_solving(self, problem_id):
+        self.get_solver_manager(problem_id).terminateEarly(problem_id)
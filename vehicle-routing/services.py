@@ -1,48 +1,335 @@
-from domain import Vehicle, VehicleRoutingSolution
+import collections
+import itertools
+import json
+import math
+import os
+import threading
+from domain import Location, Customer, Vehicle, VehicleRoutingSolution, DistanceMatrixCache
+from problem_registry import ProblemRegistry, UnknownProblemError, SolverCapacityError
+from solver_job_queue import SolverJobQueue
+from problem_changes import AddCustomerProblemChange, RemoveCustomerProblemChange, AddVehicleProblemChange, \
+    RemoveVehicleProblemChange
+from solver_config_factory import SolverSettings, build_solver_config
 from optapy import solver_manager_create, score_manager_create
-import optapy.config
-from optapy.types import Duration
 from optapy.score import HardSoftScore
 from constraints import vehicle_routing_constraints
-from flask import Flask, jsonify
-from org.optaplanner.core.api.solver import SolverStatus
+from flask import Flask, Response, jsonify, request, abort
 
 app = Flask(__name__)
 
-SINGLETON_ID = 1
-solver_config = optapy.config.solver.SolverConfig()
-solver_config \
-    .withSolutionClass(VehicleRoutingSolution) \
-    .withEntityClasses(Vehicle) \
-    .withConstraintProviderClass(vehicle_routing_constraints) \
-    .withTerminationSpentLimit(Duration.ofSeconds(30))
+DEFAULT_PROBLEM_ID = 1
+solver_settings = SolverSettings.load('VRP', spent_limit_seconds=30)
+solver_config = build_solver_config(VehicleRoutingSolution, [Vehicle], vehicle_routing_constraints, solver_settings)
 
 solver_manager = solver_manager_create(solver_config)
 score_manager = score_manager_create(solver_manager)
 last_score = HardSoftScore.ZERO
 
-vehicle_routing_solution = VehicleRoutingSolution.empty()
+distance_matrix_cache = DistanceMatrixCache(
+    os.environ.get('VRP_DISTANCE_MATRIX_CACHE_DIR',
+                   os.path.join(os.path.dirname(os.path.abspath(__file__)), 'distance_matrix_cache')))
 
 
-class Status:
-    def __init__(self, solution, score_explanation, is_solving):
-        self.solution = solution
-        self.score_explanation = score_explanation
-        self.is_solving = is_solving
+# Serialized view of one best solution. It is built once per new best solution in save(), so polling
+# the status never walks the routes or explains the score again.
+class StatusSnapshot:
+    def __init__(self, version, solution, score_explanation):
+        self.version = version
+        self.solution_dict = solution.to_dict()
+        self.solution_json = json.dumps(self.solution_dict)
+        self.score_explanation = str(score_explanation)
+        self.route_by_vehicle_id = {
+            vehicle['id']: tuple(customer['id'] for customer in vehicle['customerList'])
+            for vehicle in self.solution_dict['vehicleList']
+        }
+        self.customer_id_set = frozenset(customer['id'] for customer in self.solution_dict['customerList'])
+
+    # Problem changes add or remove customers and vehicles, which a route diff cannot express
+    def has_same_problem(self, previous_snapshot):
+        return self.route_by_vehicle_id.keys() == previous_snapshot.route_by_vehicle_id.keys() and \
+            self.customer_id_set == previous_snapshot.customer_id_set
+
+    def get_etag(self, is_solving):
+        return f'{self.version}-{"solving" if is_solving else "not-solving"}'
 
-    def to_dict(self):
+    def to_json(self, is_solving):
+        return f'{{"version": {self.version}, ' \
+               f'"solution": {self.solution_json}, ' \
+               f'"scoreExplanation": {json.dumps(self.score_explanation)}, ' \
+               f'"isSolving": {json.dumps(is_solving)}}}'
+
+    def to_diff_dict(self, previous_snapshot):
         return {
-            'solution': self.solution.to_dict(),
+            'version': self.version,
+            'previousVersion': previous_snapshot.version,
+            'score': self.solution_dict['score'],
+            'distanceMeters': self.solution_dict['distanceMeters'],
             'scoreExplanation': self.score_explanation,
-            'isSolving': self.is_solving
+            'vehicleList': [vehicle for vehicle in self.solution_dict['vehicleList']
+                            if previous_snapshot.route_by_vehicle_id.get(vehicle['id']) !=
+                            self.route_by_vehicle_id[vehicle['id']]],
         }
 
 
-@app.route('/vrp/status', methods=['GET'])
-def get_solver_status():
-    global vehicle_routing_solution
-    return jsonify(Status(vehicle_routing_solution, score_manager.explainScore(vehicle_routing_solution).getSummary(),
-                   solver_manager.getSolverStatus(SINGLETON_ID) != SolverStatus.NOT_SOLVING).to_dict())
+# Pending server-sent events of one /vrp/events client. A client that falls too far behind
+# gets a single resync event instead, telling it to fetch the full status again.
+class EventSubscription:
+    MAX_PENDING_EVENTS = 64
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending_events = collections.deque()
+        self.overflowed = False
+
+    def push(self, event_name, data):
+        with self.condition:
+            if len(self.pending_events) >= EventSubscription.MAX_PENDING_EVENTS:
+                self.pending_events.clear()
+                self.overflowed = True
+            else:
+                self.pending_events.append((event_name, data))
+            self.condition.notify()
+
+    def poll(self, timeout):
+        with self.condition:
+            if not self.pending_events and not self.overflowed:
+                self.condition.wait(timeout)
+            if self.overflowed:
+                self.overflowed = False
+                return [('resync', '{}')]
+            events = list(self.pending_events)
+            self.pending_events.clear()
+            return events
+
+
+# Status snapshot and /vrp/events subscriptions of one problem in the registry
+class ProblemState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.status_snapshot = None
+        self.event_subscriptions = set()
+
+    def push_event(self, event_name, data):
+        event_json = json.dumps(data)
+        for subscription in self.event_subscriptions:
+            subscription.push(event_name, event_json)
+
+    def publish_event(self, event_name, data):
+        with self.lock:
+            self.push_event(event_name, data)
+
+    def update_status_snapshot(self, solution):
+        with self.lock:
+            previous_snapshot = self.status_snapshot
+            version = 0 if previous_snapshot is None else previous_snapshot.version + 1
+            self.status_snapshot = StatusSnapshot(version, solution,
+                                                  score_manager.explainScore(solution).getSummary())
+            if previous_snapshot is None:
+                return
+            if self.status_snapshot.has_same_problem(previous_snapshot):
+                self.push_event('bestSolution', self.status_snapshot.to_diff_dict(previous_snapshot))
+            else:
+                self.push_event('resync', {'version': version})
+
+
+KEEP_ALIVE_SECONDS = 15
+problem_states = dict()
+
+
+def remove_problem_state(problem_id):
+    problem_states.pop(problem_id, None)
+
+
+# By default as many solver slots as there are cores left over by the move threads of each solve
+solver_slot_count = int(os.environ.get('VRP_MAX_CONCURRENT_SOLVES', str(solver_settings.get_solver_slot_count())))
+problem_registry = ProblemRegistry(solver_manager,
+                                   max_problem_count=int(os.environ.get('VRP_MAX_PROBLEM_COUNT', '32')),
+                                   max_concurrent_solves=solver_slot_count,
+                                   on_remove=remove_problem_state,
+                                   pinned_problem_ids={DEFAULT_PROBLEM_ID})
+solver_job_queue = SolverJobQueue(problem_registry, solver_slot_count,
+                                  max_queued_job_count=int(os.environ.get('VRP_MAX_QUEUED_JOB_COUNT', '64')))
+
+
+def add_problem(solution, problem_id=None):
+    problem_state = ProblemState()
+    problem_state.update_status_snapshot(solution)
+    # Ids of customers, locations and vehicles added by problem changes
+    problem_state.id_sequence = itertools.count(solution.get_max_id() + 1)
+    problem_id = problem_registry.add(solution, problem_id)
+    problem_states[problem_id] = problem_state
+    return problem_id
+
+
+def get_problem_state(problem_id):
+    problem_registry.get_entry(problem_id)
+    return problem_states[problem_id]
+
+
+add_problem(VehicleRoutingSolution.empty(distance_matrix_cache), DEFAULT_PROBLEM_ID)
+
+
+@app.errorhandler(UnknownProblemError)
+def handle_unknown_problem(error):
+    return jsonify({'details': str(error), 'stack': ''}), 404
+
+
+@app.errorhandler(SolverCapacityError)
+def handle_solver_capacity(error):
+    return jsonify({'details': str(error), 'stack': ''}), 429
+
+
+@app.route('/vrp/problems', methods=['GET'])
+def get_problems():
+    return jsonify(problem_registry.get_problem_ids())
+
+
+@app.route('/vrp/problems', methods=['POST'])
+def create_problem():
+    return {'id': add_problem(VehicleRoutingSolution.empty(distance_matrix_cache))}
+
+
+@app.route('/vrp/problems/<int:problem_id>', methods=['DELETE'])
+def delete_problem(problem_id):
+    problem_registry.remove(problem_id)
+    return dict()
+
+
+@app.route('/vrp/status', methods=['GET'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/status', methods=['GET'])
+def get_solver_status(problem_id):
+    snapshot = get_problem_state(problem_id).status_snapshot
+    is_solving = problem_registry.is_solving(problem_id)
+    response = Response(snapshot.to_json(is_solving), mimetype='application/json')
+    response.set_etag(snapshot.get_etag(is_solving))
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.route('/vrp/events', methods=['GET'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/events', methods=['GET'])
+def get_solution_events(problem_id):
+    problem_state = get_problem_state(problem_id)
+    subscription = EventSubscription()
+    with problem_state.lock:
+        problem_state.event_subscriptions.add(subscription)
+
+    def generate_events():
+        try:
+            yield 'retry: 2000\n\n'
+            while True:
+                events = subscription.poll(KEEP_ALIVE_SECONDS)
+                if not events:
+                    yield ': keep-alive\n\n'
+                for event_name, data in events:
+                    yield f'event: {event_name}\ndata: {data}\n\n'
+        finally:
+            with problem_state.lock:
+                problem_state.event_subscriptions.discard(subscription)
+
+    response = Response(generate_events(), mimetype='text/event-stream')
+    response.cache_control.no_cache = True
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def get_float_arg(name):
+    value = request.args.get(name, type=float)
+    if value is None or not math.isfinite(value):
+        abort(400, f'Query parameter ({name}) is required and must be a finite number.')
+    return value
+
+
+@app.route('/vrp/customers/near', methods=['GET'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/customers/near', methods=['GET'])
+def get_customers_near(problem_id):
+    location = Location(None, get_float_arg('latitude'), get_float_arg('longitude'))
+    customer_list = problem_registry.find_by_id(problem_id) \
+        .get_customers_within_radius(location, get_float_arg('radiusMeters'))
+    return jsonify(list(map(lambda customer: customer.to_dict(), customer_list)))
+
+
+# The customers closest to a customer by distance matrix distance, for example to suggest where to insert it
+@app.route('/vrp/customers/<int:customer_id>/nearby', methods=['GET'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/customers/<int:customer_id>/nearby', methods=['GET'])
+def get_nearby_customers(problem_id, customer_id):
+    solution = problem_registry.find_by_id(problem_id)
+    customer = solution.find_customer(customer_id)
+    if customer is None:
+        abort(404, f'There is no customer with id ({customer_id})')
+    count = request.args.get('count', 10, type=int)
+    if count < 1:
+        abort(400, f'Query parameter (count) must be positive, but is ({count}).')
+    customer_list = solution.get_nearby_customers(customer.location, count)
+    return jsonify(list(map(lambda nearby_customer: nearby_customer.to_dict(), customer_list)))
+
+
+@app.route('/vrp/customers/inBounds', methods=['GET'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/customers/inBounds', methods=['GET'])
+def get_customers_in_bounds(problem_id):
+    south_west = Location(None, get_float_arg('south'), get_float_arg('west'))
+    north_east = Location(None, get_float_arg('north'), get_float_arg('east'))
+    customer_list = problem_registry.find_by_id(problem_id) \
+        .get_customers_in_bounding_box(south_west, north_east)
+    return jsonify(list(map(lambda customer: customer.to_dict(), customer_list)))
+
+
+def get_json_number(data, name, number_type=float):
+    value = data.get(name)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        abort(400, f'Field ({name}) is required and must be a number.')
+    return number_type(value)
+
+
+# Edits go through the solver as problem changes while solving, so it keeps its state and score caches
+def apply_problem_change(problem_id, problem_change):
+    if problem_registry.apply_problem_change(problem_id, problem_change):
+        get_problem_state(problem_id).update_status_snapshot(problem_registry.find_by_id(problem_id))
+
+
+@app.route('/vrp/customers', methods=['POST'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/customers', methods=['POST'])
+def add_customer(problem_id):
+    problem_state = get_problem_state(problem_id)
+    if not problem_registry.find_by_id(problem_id).can_add_location():
+        abort(400, f'Cannot add customers to problem ({problem_id}): its distance matrix is precomputed.')
+    data = request.get_json(silent=True) or dict()
+    location = Location(next(problem_state.id_sequence), get_json_number(data, 'latitude'),
+                        get_json_number(data, 'longitude'))
+    customer = Customer(next(problem_state.id_sequence), location, get_json_number(data, 'demand', int))
+    apply_problem_change(problem_id, AddCustomerProblemChange(customer))
+    return customer.to_dict()
+
+
+@app.route('/vrp/customers/<int:customer_id>', methods=['DELETE'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/customers/<int:customer_id>', methods=['DELETE'])
+def remove_customer(problem_id, customer_id):
+    if problem_registry.find_by_id(problem_id).find_customer(customer_id) is None:
+        abort(404, f'There is no customer with id ({customer_id})')
+    apply_problem_change(problem_id, RemoveCustomerProblemChange(customer_id))
+    return dict()
+
+
+@app.route('/vrp/vehicles', methods=['POST'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/vehicles', methods=['POST'])
+def add_vehicle(problem_id):
+    problem_state = get_problem_state(problem_id)
+    data = request.get_json(silent=True) or dict()
+    depot = problem_registry.find_by_id(problem_id).find_depot(get_json_number(data, 'depotId', int))
+    if depot is None:
+        abort(400, f'There is no depot with id ({data["depotId"]})')
+    vehicle = Vehicle(next(problem_state.id_sequence), get_json_number(data, 'capacity', int), depot)
+    apply_problem_change(problem_id, AddVehicleProblemChange(vehicle))
+    return vehicle.to_dict()
+
+
+@app.route('/vrp/vehicles/<int:vehicle_id>', methods=['DELETE'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/vehicles/<int:vehicle_id>', methods=['DELETE'])
+def remove_vehicle(problem_id, vehicle_id):
+    if problem_registry.find_by_id(problem_id).find_vehicle(vehicle_id) is None:
+        abort(404, f'There is no vehicle with id ({vehicle_id})')
+    apply_problem_change(problem_id, RemoveVehicleProblemChange(vehicle_id))
+    return dict()
 
 
 def error_handler(problem_id, exception):
@@ -50,25 +337,48 @@ def error_handler(problem_id, exception):
     exception.printStackTrace()
 
 
-@app.route('/vrp/solve', methods=['POST'])
-def solve():
-    solver_manager.solveAndListen(SINGLETON_ID, find_by_id, save, error_handler)
-    return dict()
+@app.route('/vrp/solve', methods=['POST'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/solve', methods=['POST'])
+def solve(problem_id):
+    get_problem_state(problem_id)
+    job = solver_job_queue.submit(problem_id,
+                                  priority=request.args.get('priority', 0, type=int),
+                                  time_budget_seconds=request.args.get('timeBudgetSeconds', type=float),
+                                  best_solution_consumer=save,
+                                  final_best_solution_consumer=finish,
+                                  exception_handler=error_handler,
+                                  start_consumer=start)
+    return job.to_dict()
 
 
-@app.route('/vrp/stopSolving', methods=['POST'])
-def stop_solving():
-    solver_manager.terminateEarly(SINGLETON_ID)
+@app.route('/vrp/jobs/<int:job_id>', methods=['GET'])
+def get_solver_job(job_id):
+    job = solver_job_queue.get_job(job_id)
+    if job is None:
+        abort(404, f'There is no solver job with id ({job_id})')
+    return job.to_dict()
+
+
+@app.route('/vrp/stopSolving', methods=['POST'], defaults={'problem_id': DEFAULT_PROBLEM_ID})
+@app.route('/vrp/<int:problem_id>/stopSolving', methods=['POST'])
+def stop_solving(problem_id):
+    solver_job_queue.stop(problem_id)
     return dict()
 
 
-def find_by_id(schedule_id):
-    global vehicle_routing_solution
-    if schedule_id != SINGLETON_ID:
-        raise ValueError(f'There is no schedule with id ({schedule_id})')
-    return vehicle_routing_solution
+def start(problem_id):
+    problem_state = problem_states.get(problem_id)
+    if problem_state is not None:
+        problem_state.publish_event('solvingStarted', {'version': problem_state.status_snapshot.version})
+
+
+def save(problem_id, solution):
+    problem_state = problem_states.get(problem_id)
+    if problem_state is not None:
+        problem_state.update_status_snapshot(solution)
 
 
-def save(solution):
-    global vehicle_routing_solution
-    vehicle_routing_solution = solution
+def finish(problem_id, solution):
+    problem_state = problem_states.get(problem_id)
+    if problem_state is not None:
+        problem_state.publish_event('solvingEnded', {'version': problem_state.status_snapshot.version})
@@ -0,0 +1,180 @@
+import collections
+import enum
+import heapq
+import itertools
+import threading
+import time
+from problem_registry import SolverCapacityError
+
+
+class SolverJobStatus(enum.Enum):
+    QUEUED = 'QUEUED'
+    SOLVING = 'SOLVING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+    CANCELLED = 'CANCELLED'
+
+
+class SolverJob:
+    def __init__(self, job_id, problem_id, priority, time_budget_seconds, best_solution_consumer,
+                 final_best_solution_consumer, exception_handler, start_consumer, problem_finder, solver_manager):
+        self.job_id = job_id
+        self.problem_id = problem_id
+        self.priority = priority
+        self.time_budget_seconds = time_budget_seconds
+        self.best_solution_consumer = best_solution_consumer
+        self.final_best_solution_consumer = final_best_solution_consumer
+        self.exception_handler = exception_handler
+        self.start_consumer = start_consumer
+        self.problem_finder = problem_finder
+        self.solver_manager = solver_manager
+        self.status = SolverJobStatus.QUEUED
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.time_budget_timer = None
+        self.error_message = None
+
+    def to_dict(self):
+        return {
+            'id': self.job_id,
+            'problemId': self.problem_id,
+            'priority': self.priority,
+            'timeBudgetSeconds': self.time_budget_seconds,
+            'status': self.status.value,
+            'submittedAt': self.submitted_at,
+            'startedAt': self.started_at,
+            'finishedAt': self.finished_at,
+            'errorMessage': self.error_message,
+        }
+
+
+# Admission control in front of the ProblemRegistry. Solve requests are queued by priority (higher first,
+# then first come first served) and started only while fewer than solver_slot_count jobs are solving.
+# At most max_queued_job_count jobs wait; a job with a time budget is terminated early once its budget is spent.
+class SolverJobQueue:
+    MAX_FINISHED_JOB_COUNT = 256
+
+    def __init__(self, problem_registry, solver_slot_count, max_queued_job_count=64):
+        self.problem_registry = problem_registry
+        self.solver_slot_count = solver_slot_count
+        self.max_queued_job_count = max_queued_job_count
+        self.lock = threading.Lock()
+        self.queue = []
+        self.job_sequence = itertools.count(1)
+        self.jobs = collections.OrderedDict()
+        self.active_job_by_problem_id = dict()
+        self.solving_count = 0
+
+    def submit(self, problem_id, priority=0, time_budget_seconds=None, best_solution_consumer=None,
+               final_best_solution_consumer=None, exception_handler=None, start_consumer=None, problem_finder=None,
+               solver_manager=None):
+        entry = self.problem_registry.get_entry(problem_id)
+        with self.lock:
+            active_job = self.active_job_by_problem_id.get(problem_id)
+            if active_job is not None:
+                return active_job
+            queued_job_count = len(self.active_job_by_problem_id) - self.solving_count
+            if queued_job_count >= self.max_queued_job_count:
+                raise SolverCapacityError(f'Cannot queue problem ({problem_id}): already {queued_job_count} of at '
+                                          f'most {self.max_queued_job_count} solve jobs are waiting.')
+            job = SolverJob(next(self.job_sequence), problem_id, priority, time_budget_seconds,
+                            best_solution_consumer, final_best_solution_consumer, exception_handler, start_consumer,
+                            problem_finder, solver_manager)
+            entry.is_queued = True
+            self.jobs[job.job_id] = job
+            self.active_job_by_problem_id[problem_id] = job
+            heapq.heappush(self.queue, (-priority, job.job_id, job))
+        self._dispatch()
+        return job
+
+    def get_job(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def stop(self, problem_id):
+        with self.lock:
+            job = self.active_job_by_problem_id.get(problem_id)
+            if job is not None and job.status == SolverJobStatus.QUEUED:
+                self._finish(job, SolverJobStatus.CANCELLED)
+                return
+        self.problem_registry.stop_solving(problem_id)
+
+    def _dispatch(self):
+        jobs_to_start = []
+        with self.lock:
+            while self.queue and self.solving_count < self.solver_slot_count:
+                _, _, job = heapq.heappop(self.queue)
+                if job.status != SolverJobStatus.QUEUED:
+                    continue
+                job.status = SolverJobStatus.SOLVING
+                job.started_at = time.time()
+                self.solving_count += 1
+                jobs_to_start.append(job)
+        for job in jobs_to_start:
+            self._start(job)
+
+    def _start(self, job):
+        def save(problem_id, solution):
+            if job.best_solution_consumer is not None:
+                job.best_solution_consumer(problem_id, solution)
+
+        def finish(problem_id, solution):
+            self._on_job_ended(job, SolverJobStatus.DONE)
+            if job.final_best_solution_consumer is not None:
+                job.final_best_solution_consumer(problem_id, solution)
+
+        def handle_exception(problem_id, exception):
+            job.error_message = str(exception)
+            self._on_job_ended(job, SolverJobStatus.FAILED)
+            if job.exception_handler is not None:
+                job.exception_handler(problem_id, exception)
+
+        # A job can be started from a solver thread when another job ends, so a failure to start
+        # is recorded on the job instead of being raised
+        try:
+            self.problem_registry.get_entry(job.problem_id).is_queued = False
+            self.problem_registry.solve(job.problem_id, save, finish, handle_exception, job.problem_finder,
+                                        job.solver_manager)
+        except Exception as exception:
+            job.error_message = str(exception)
+            self._on_job_ended(job, SolverJobStatus.FAILED)
+            return
+        if job.time_budget_seconds is not None:
+            job.time_budget_timer = threading.Timer(job.time_budget_seconds, self._on_time_budget_spent, [job])
+            job.time_budget_timer.daemon = True
+            job.time_budget_timer.start()
+        if job.start_consumer is not None:
+            job.start_consumer(job.problem_id)
+
+    def _on_time_budget_spent(self, job):
+        try:
+            self.problem_registry.stop_solving(job.problem_id)
+        except ValueError:
+            # The problem was removed meanwhile
+            pass
+
+    def _on_job_ended(self, job, status):
+        with self.lock:
+            if job.status != SolverJobStatus.SOLVING:
+                return
+            self.solving_count -= 1
+            self._finish(job, status)
+        if job.time_budget_timer is not None:
+            job.time_budget_timer.cancel()
+        self._dispatch()
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        if self.active_job_by_problem_id.get(job.problem_id) is job:
+            del self.active_job_by_problem_id[job.problem_id]
+        if status == SolverJobStatus.CANCELLED:
+            try:
+                self.problem_registry.get_entry(job.problem_id).is_queued = False
+            except ValueError:
+                pass
+        finished_job_ids = [job_id for job_id, finished_job in self.jobs.items()
+                            if finished_job.status not in (SolverJobStatus.QUEUED, SolverJobStatus.SOLVING)]
+        for job_id in finished_job_ids[:max(len(finished_job_ids) - SolverJobQueue.MAX_FINISHED_JOB_COUNT, 0)]:
+            del self.jobs[job_id]
@@ -0,0 +1,97 @@
+import math
+import numpy as np
+
+METERS_PER_DEGREE = 111_000
+
+
+# Uniform latitude/longitude grid over a list of items (locations, customers, ...).
+# Items are sorted by cell, so every grid row is one contiguous slice of the sorted arrays
+# and a query only touches the rows its bounding box overlaps.
+class SpatialGridIndex:
+    TARGET_ITEMS_PER_CELL = 4
+
+    def __init__(self, item_list, location_getter=lambda item: item, cell_size_degrees=None):
+        self.item_list = list(item_list)
+        item_count = len(self.item_list)
+        latitudes = np.fromiter((location_getter(item).latitude for item in self.item_list), dtype=np.float64,
+                                count=item_count)
+        longitudes = np.fromiter((location_getter(item).longitude for item in self.item_list), dtype=np.float64,
+                                 count=item_count)
+        if item_count == 0:
+            self.min_latitude = self.min_longitude = 0.0
+            latitude_span = longitude_span = 0.0
+        else:
+            self.min_latitude = float(latitudes.min())
+            self.min_longitude = float(longitudes.min())
+            latitude_span = float(latitudes.max()) - self.min_latitude
+            longitude_span = float(longitudes.max()) - self.min_longitude
+
+        if cell_size_degrees is None:
+            cell_count = max(item_count / SpatialGridIndex.TARGET_ITEMS_PER_CELL, 1)
+            # A degenerate span (all items on one line) falls back to the other one to keep the cell count bounded
+            latitude_extent = latitude_span or longitude_span or 1.0
+            longitude_extent = longitude_span or latitude_span or 1.0
+            area = latitude_extent * longitude_extent
+            cell_size_degrees = math.sqrt(area / cell_count)
+        if cell_size_degrees <= 0:
+            raise ValueError(f'cell_size_degrees ({cell_size_degrees}) must be greater than zero.')
+        self.cell_size_degrees = cell_size_degrees
+        self.row_count = int(latitude_span // cell_size_degrees) + 1
+        self.column_count = int(longitude_span // cell_size_degrees) + 1
+
+        cell_ids = self._get_rows(latitudes) * self.column_count + self._get_columns(longitudes)
+        self.order = np.argsort(cell_ids, kind='stable')
+        self.latitudes = latitudes[self.order]
+        self.longitudes = longitudes[self.order]
+        self.cell_starts = np.searchsorted(cell_ids[self.order],
+                                           np.arange(self.row_count * self.column_count + 1))
+
+    # Clipped before the cast, so query bounds far outside the grid (or infinite) still map to its edge cells
+    def _get_rows(self, latitudes):
+        rows = np.floor((latitudes - self.min_latitude) / self.cell_size_degrees)
+        return np.clip(rows, 0, self.row_count - 1).astype(np.int64)
+
+    def _get_columns(self, longitudes):
+        columns = np.floor((longitudes - self.min_longitude) / self.cell_size_degrees)
+        return np.clip(columns, 0, self.column_count - 1).astype(np.int64)
+
+    def _get_candidate_positions(self, south, west, north, east):
+        if len(self.item_list) == 0:
+            return np.empty(0, dtype=np.int64)
+        first_row, last_row = self._get_rows(np.array([south, north]))
+        first_column, last_column = self._get_columns(np.array([west, east]))
+        slices = []
+        for row in range(first_row, last_row + 1):
+            row_start = row * self.column_count
+            slices.append(np.arange(self.cell_starts[row_start + first_column],
+                                    self.cell_starts[row_start + last_column + 1]))
+        return np.concatenate(slices)
+
+    def query_bounding_box_indices(self, south, west, north, east):
+        # Also true for NaN bounds, which match nothing
+        if not (south <= north and west <= east):
+            return np.empty(0, dtype=np.int64)
+        positions = self._get_candidate_positions(south, west, north, east)
+        latitudes = self.latitudes[positions]
+        longitudes = self.longitudes[positions]
+        inside = (latitudes >= south) & (latitudes <= north) & (longitudes >= west) & (longitudes <= east)
+        return self.order[positions[inside]]
+
+    def query_radius_indices(self, latitude, longitude, radius_meters):
+        if not radius_meters >= 0 or math.isnan(latitude) or math.isnan(longitude):
+            return np.empty(0, dtype=np.int64)
+        radius_degrees = radius_meters / METERS_PER_DEGREE
+        positions = self._get_candidate_positions(latitude - radius_degrees, longitude - radius_degrees,
+                                                  latitude + radius_degrees, longitude + radius_degrees)
+        latitude_diff = self.latitudes[positions] - latitude
+        longitude_diff = self.longitudes[positions] - longitude
+        inside = latitude_diff * latitude_diff + longitude_diff * longitude_diff <= radius_degrees * radius_degrees
+        return self.order[positions[inside]]
+
+    def get_items_in_bounding_box(self, south_west, north_east):
+        return [self.item_list[index] for index in self.query_bounding_box_indices(
+            south_west.latitude, south_west.longitude, north_east.latitude, north_east.longitude)]
+
+    def get_items_within_radius(self, location, radius_meters):
+        return [self.item_list[index] for index in self.query_radius_indices(
+            location.latitude, location.longitude, radius_meters)]
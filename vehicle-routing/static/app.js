@@ -16,8 +16,8 @@ const colors = [
     'slateblue',
     'tomato',
 ];
-let autoRefreshCount = 0;
-let autoRefreshIntervalId = null;
+let lastStatusEtag = null;
+let currentStatus = null;
 
 let initialized = false;
 const depotByIdMap = new Map();
@@ -52,12 +52,21 @@ const fetchHeaders = {
 const formatDistance = (distanceInMeters) => `${Math.floor(distanceInMeters / 1000)}km ${distanceInMeters % 1000}m`;
 
 const getStatus = () => {
-    fetch('/vrp/status', fetchHeaders)
+    fetch('/vrp/status', { ...fetchHeaders, cache: 'no-cache' })
             .then((response) => {
                 if (!response.ok) {
                     return handleErrorResponse('Get status failed', response);
                 } else {
-                    return response.json().then((data) => showProblem(data));
+                    // The status did not change since the last poll, so skip re-rendering it
+                    const etag = response.headers.get('ETag');
+                    if (etag !== null && etag === lastStatusEtag) {
+                        return;
+                    }
+                    lastStatusEtag = etag;
+                    return response.json().then((data) => {
+                        currentStatus = data;
+                        showProblem(data);
+                    });
                 }
             })
             .catch((error) => handleClientError('Failed to process response', error));
@@ -70,10 +79,6 @@ const solve = () => {
                     return handleErrorResponse('Start solving failed', response);
                 } else {
                     updateSolvingStatus(true);
-                    autoRefreshCount = 300;
-                    if (autoRefreshIntervalId == null) {
-                        autoRefreshIntervalId = setInterval(autoRefresh, 500);
-                    }
                 }
             })
             .catch((error) => handleClientError('Failed to process response', error));
@@ -141,19 +146,37 @@ const updateSolvingStatus = (solving) => {
         solveButton.hide();
         stopSolvingButton.show();
     } else {
-        autoRefreshCount = 0;
         solveButton.show();
         stopSolvingButton.hide();
     }
 };
 
-const autoRefresh = () => {
-    getStatus();
-    autoRefreshCount--;
-    if (autoRefreshCount <= 0) {
-        clearInterval(autoRefreshIntervalId);
-        autoRefreshIntervalId = null;
+const applyBestSolutionDiff = (diff) => {
+    if (currentStatus === null || diff.previousVersion !== currentStatus.version) {
+        // Missed an update, fetch the whole status again
+        getStatus();
+        return;
     }
+    const changedVehicleById = new Map(diff.vehicleList.map((vehicle) => [vehicle.id, vehicle]));
+    const solution = currentStatus.solution;
+    solution.vehicleList = solution.vehicleList.map((vehicle) => changedVehicleById.get(vehicle.id) || vehicle);
+    solution.score = diff.score;
+    solution.distanceMeters = diff.distanceMeters;
+    currentStatus.scoreExplanation = diff.scoreExplanation;
+    currentStatus.version = diff.version;
+    currentStatus.isSolving = true;
+    showProblem(currentStatus);
+};
+
+const listenToSolutionEvents = () => {
+    const eventSource = new EventSource('/vrp/events');
+    eventSource.addEventListener('bestSolution', (event) => applyBestSolutionDiff(JSON.parse(event.data)));
+    eventSource.addEventListener('solvingStarted', () => updateSolvingStatus(true));
+    eventSource.addEventListener('solvingEnded', () => {
+        updateSolvingStatus(false);
+        getStatus();
+    });
+    eventSource.addEventListener('resync', getStatus);
 };
 
 const depotPopupContent = (depot, color) => `<h5>Depot ${depot.id}</h5>
@@ -264,6 +287,7 @@ const routeGroup = L.layerGroup().addTo(map);
 
 solveButton.click(solve);
 stopSolvingButton.click(stopSolving);
+listenToSolutionEvents();
 
 updateSolvingStatus();
 $('[data-toggle="tooltip"]').tooltip();
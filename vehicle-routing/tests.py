@@ -1,7 +1,21 @@
-from domain import Location, Depot, Customer, Vehicle, VehicleRoutingSolution, EuclideanDistanceCalculator
+from domain import Location, Depot, Customer, Vehicle, VehicleRoutingSolution, EuclideanDistanceCalculator, \
+    DistanceMatrixCache, NearbyLocationIndex, HaversineDistanceCalculator, ManhattanDistanceCalculator, \
+    PrecomputedDistanceCalculator, DistanceCalculator
+from spatial_index import SpatialGridIndex
+from problem_registry import ProblemRegistry
+from problem_changes import AddCustomerProblemChange, RemoveCustomerProblemChange, AddVehicleProblemChange, \
+    RemoveVehicleProblemChange
+from solver_job_queue import SolverJobQueue, SolverJobStatus
+from solver_config_factory import SolverSettings, build_solver_config
 from constraints import vehicle_routing_constraints, total_distance, vehicle_capacity
 
+from optapy import solver_manager_create
 from optapy.test import ConstraintVerifier, constraint_verifier_build
+import glob
+import os
+import threading
+import numpy
+import pytest
 
 constraint_verifier: ConstraintVerifier = constraint_verifier_build(vehicle_routing_constraints,
                                                                     VehicleRoutingSolution, Vehicle)
@@ -45,3 +59,291 @@ def test_total_distance():
     constraint_verifier.verify_that(total_distance) \
         .given(vehicle_a, customer_1, customer_2) \
         .penalizes_by((4 + 5 + 3) * EuclideanDistanceCalculator.METERS_PER_DEGREE)
+
+
+def test_total_distance_with_distance_matrix():
+    matrix_location1 = Location(1, 0.0, 0.0)
+    matrix_location2 = Location(2, 0.0, 4.0)
+    matrix_location3 = Location(3, 3.0, 0.0)
+    EuclideanDistanceCalculator().init_distance_matrix((matrix_location1, matrix_location2, matrix_location3))
+
+    vehicle_a = Vehicle(1, 100, Depot(1, matrix_location1))
+    customer_1 = Customer(2, matrix_location2, 80)
+    vehicle_a.get_customer_list().append(customer_1)
+    customer_2 = Customer(3, matrix_location3, 40)
+    vehicle_a.get_customer_list().append(customer_2)
+
+    constraint_verifier.verify_that(total_distance) \
+        .given(vehicle_a, customer_1, customer_2) \
+        .penalizes_by((4 + 5 + 3) * EuclideanDistanceCalculator.METERS_PER_DEGREE)
+
+
+def test_distance_matrix_cache(tmp_path):
+    cache = DistanceMatrixCache(str(tmp_path))
+    calculator = EuclideanDistanceCalculator()
+    cached_location_list = [Location(1, 0.0, 0.0), Location(2, 0.0, 4.0), Location(3, 3.0, 0.0)]
+
+    calculated = calculator.init_distance_matrix(cached_location_list, cache)
+    loaded = calculator.init_distance_matrix(cached_location_list, cache)
+
+    assert len(list(tmp_path.glob('*.npy'))) == 1
+    assert (calculated == loaded).all()
+    assert cached_location_list[1].get_distance_to(cached_location_list[2]) == \
+           5 * EuclideanDistanceCalculator.METERS_PER_DEGREE
+
+
+def test_total_distance_after_customer_list_changes():
+    vehicle_a = Vehicle(1, 100, Depot(1, location1))
+    customer_1 = Customer(2, location2, 80)
+    customer_2 = Customer(3, location3, 40)
+    vehicle_a.get_customer_list().append(customer_2)
+    assert vehicle_a.get_total_distance_meters() == (3 + 3) * EuclideanDistanceCalculator.METERS_PER_DEGREE
+
+    vehicle_a.get_customer_list().insert(0, customer_1)
+    vehicle_a.get_customer_list().remove(customer_2)
+    vehicle_a.get_customer_list().append(customer_2)
+    assert vehicle_a.get_total_demand() == 120
+
+    constraint_verifier.verify_that(total_distance) \
+        .given(vehicle_a, customer_1, customer_2) \
+        .penalizes_by((4 + 5 + 3) * EuclideanDistanceCalculator.METERS_PER_DEGREE)
+
+
+def test_nearby_location_index():
+    nearby_location_list = [Location(1, 0.0, 0.0), Location(2, 0.0, 4.0), Location(3, 3.0, 0.0),
+                            Location(4, 1.0, 1.0)]
+    distance_matrix = EuclideanDistanceCalculator().init_distance_matrix(nearby_location_list)
+    nearby_location_index = NearbyLocationIndex.build(nearby_location_list, distance_matrix, 2)
+
+    assert nearby_location_index.get_nearby_locations(nearby_location_list[0]) == \
+           [nearby_location_list[3], nearby_location_list[2]]
+    assert nearby_location_index.get_nearby_locations(nearby_location_list[1], 1) == [nearby_location_list[3]]
+
+
+def test_nearby_customers():
+    depot = Depot(1, Location(1, 0.0, 0.0))
+    customer_list = [Customer(2, Location(2, 0.0, 4.0), 1), Customer(3, Location(3, 3.0, 0.0), 1),
+                     Customer(4, Location(4, 1.0, 1.0), 1)]
+    nearby_location_list = [depot.location] + [customer.location for customer in customer_list]
+    EuclideanDistanceCalculator().init_distance_matrix(nearby_location_list)
+    solution = VehicleRoutingSolution('test', nearby_location_list, [depot], [], customer_list, depot.location,
+                                      customer_list[0].location, distance_calculator=EuclideanDistanceCalculator())
+
+    # The depot location is nearby too, but is not a customer
+    assert solution.get_nearby_customers(customer_list[0].location) == [customer_list[2], customer_list[1]]
+    assert solution.get_nearby_customers(depot.location, 1) == [customer_list[2]]
+    solution.remove_customer(4)
+    assert solution.get_nearby_customers(depot.location, 1) == [customer_list[1]]
+
+
+def test_spatial_grid_index():
+    customer_1 = Customer(2, location2, 80)
+    customer_2 = Customer(3, location3, 40)
+    customer_spatial_index = SpatialGridIndex([customer_1, customer_2], lambda customer: customer.location)
+
+    assert customer_spatial_index.get_items_within_radius(location1, 3 * EuclideanDistanceCalculator.METERS_PER_DEGREE) \
+           == [customer_2]
+    assert customer_spatial_index.get_items_within_radius(location1, 1000) == []
+    assert customer_spatial_index.get_items_in_bounding_box(Location(0, -1.0, 1.0), Location(0, 1.0, 5.0)) == \
+           [customer_1]
+    assert sorted(customer_spatial_index.get_items_within_radius(location1, float('inf')),
+                  key=lambda customer: customer.id) == [customer_1, customer_2]
+    assert customer_spatial_index.get_items_within_radius(location1, float('nan')) == []
+    assert customer_spatial_index.get_items_within_radius(Location(0, float('nan'), 0.0), 1000) == []
+    assert sorted(customer_spatial_index.get_items_in_bounding_box(Location(0, float('-inf'), float('-inf')),
+                                                                   Location(0, float('inf'), float('inf'))),
+                  key=lambda customer: customer.id) == [customer_1, customer_2]
+    assert customer_spatial_index.get_items_in_bounding_box(Location(0, float('nan'), 1.0),
+                                                            Location(0, 1.0, 5.0)) == []
+
+
+def test_distance_calculators(tmp_path):
+    calculator_location_list = [Location(1, 0.0, 0.0), Location(2, 0.0, 4.0), Location(3, 3.0, 0.0)]
+
+    manhattan_matrix = ManhattanDistanceCalculator().calculate_distance_matrix(calculator_location_list)
+    assert manhattan_matrix[1, 2] == (4 + 3) * ManhattanDistanceCalculator.METERS_PER_DEGREE
+
+    haversine_matrix = HaversineDistanceCalculator().calculate_distance_matrix(calculator_location_list)
+    assert haversine_matrix[0, 2] == HaversineDistanceCalculator().calculate_distance(calculator_location_list[0],
+                                                                                      calculator_location_list[2])
+    assert 333_000 < haversine_matrix[0, 2] < 334_000
+
+    euclidean_matrix = EuclideanDistanceCalculator().calculate_distance_matrix(calculator_location_list)
+    matrix_path = str(tmp_path / 'distances.csv')
+    numpy.savetxt(matrix_path, euclidean_matrix, delimiter=',', fmt='%d')
+    precomputed_matrix = PrecomputedDistanceCalculator(matrix_path).init_distance_matrix(calculator_location_list)
+    assert (precomputed_matrix == euclidean_matrix).all()
+    assert calculator_location_list[1].get_distance_to(calculator_location_list[2]) == \
+           5 * EuclideanDistanceCalculator.METERS_PER_DEGREE
+    assert not PrecomputedDistanceCalculator(matrix_path).can_extend_distance_matrix()
+    assert EuclideanDistanceCalculator().can_extend_distance_matrix()
+    with pytest.raises(ValueError):
+        PrecomputedDistanceCalculator(matrix_path).extend_distance_matrix(precomputed_matrix, calculator_location_list,
+                                                                          [Location(4, 1.0, 1.0)])
+    with pytest.raises(TypeError):
+        DistanceCalculator()
+
+
+def test_problem_registry_eviction():
+    problem_registry = ProblemRegistry(None, max_problem_count=2, pinned_problem_ids={1})
+    problem_registry.add('default', 1)
+    for problem_id in (2, 3, 4):
+        problem_registry.add(f'problem {problem_id}', problem_id)
+    # The oldest idle problems are evicted, but never the pinned default problem
+    assert sorted(problem_registry.get_problem_ids()) == [1, 4]
+    assert problem_registry.find_by_id(1) == 'default'
+
+    problem_registry.get_entry(4).is_solving = True
+    problem_registry.add('problem 5', 5)
+    assert sorted(problem_registry.get_problem_ids()) == [1, 4, 5]
+
+
+class FinishOnTerminateSolverManager:
+    def __init__(self):
+        self.solving_by_problem_id = dict()
+
+    def solveAndListen(self, problem_id, problem_finder, best_solution_consumer, final_best_solution_consumer,
+                       exception_handler):
+        self.solving_by_problem_id[problem_id] = (problem_finder, final_best_solution_consumer)
+
+    def terminateEarly(self, problem_id):
+        if problem_id in self.solving_by_problem_id:
+            problem_finder, final_best_solution_consumer = self.solving_by_problem_id.pop(problem_id)
+            final_best_solution_consumer(problem_finder(problem_id))
+
+
+def test_solver_job_queue():
+    solver_manager = FinishOnTerminateSolverManager()
+    problem_registry = ProblemRegistry(solver_manager, max_concurrent_solves=1)
+    for problem_id in (1, 2, 3):
+        problem_registry.add(VehicleRoutingSolution.empty(), problem_id)
+    solver_job_queue = SolverJobQueue(problem_registry, 1, max_queued_job_count=2)
+
+    low_priority_job = solver_job_queue.submit(1)
+    normal_job = solver_job_queue.submit(2)
+    high_priority_job = solver_job_queue.submit(3, priority=5)
+    assert low_priority_job.status == SolverJobStatus.SOLVING
+    assert normal_job.status == SolverJobStatus.QUEUED
+    assert solver_job_queue.submit(2) is normal_job
+
+    solver_manager.terminateEarly(1)
+    assert low_priority_job.status == SolverJobStatus.DONE
+    assert high_priority_job.status == SolverJobStatus.SOLVING
+    assert normal_job.status == SolverJobStatus.QUEUED
+
+    solver_job_queue.stop(2)
+    assert normal_job.status == SolverJobStatus.CANCELLED
+    assert not problem_registry.get_entry(2).is_queued
+
+
+def test_solver_settings(tmp_path, monkeypatch):
+    solver_config_file = tmp_path / 'solver_config.yaml'
+    solver_config_file.write_text('move_thread_count: 4\npartitioned_search: yes\n')
+    monkeypatch.setenv('VRP_SOLVER_CONFIG_FILE', str(solver_config_file))
+    monkeypatch.setenv('VRP_SPENT_LIMIT_SECONDS', '5')
+
+    solver_settings = SolverSettings.load('VRP', spent_limit_seconds=30)
+    assert solver_settings.spent_limit_seconds == 5
+    assert solver_settings.move_thread_count == '4'
+    assert solver_settings.get_cores_per_solve() == 4
+    assert solver_settings.partitioned_search
+    # The partitions share the cores of their solve's slot unless a thread count is set
+    assert solver_settings.get_partition_thread_count() == 4
+    assert SolverSettings(partition_thread_count=3).get_partition_thread_count() == 3
+    assert SolverSettings().get_partition_thread_count() == 1
+    assert solver_settings.environment_mode == 'REPRODUCIBLE'
+
+
+def test_problem_changes_without_solver():
+    depot = Depot(1, Location(1, 0.0, 0.0))
+    customer = Customer(2, Location(2, 0.0, 4.0), 10)
+    vehicle = Vehicle(3, 100, depot, [customer])
+    change_location_list = [depot.location, customer.location]
+    EuclideanDistanceCalculator().init_distance_matrix(change_location_list)
+    solution = VehicleRoutingSolution('test', change_location_list, [depot], [vehicle], [customer], depot.location,
+                                      customer.location, distance_calculator=EuclideanDistanceCalculator())
+    problem_registry = ProblemRegistry(None)
+    problem_registry.add(solution, 1)
+
+    original_customer_list = solution.customer_list
+    original_distance_matrix = customer.location.distance_matrix
+    added_customer = Customer(4, Location(5, 3.0, 0.0), 20)
+    assert problem_registry.apply_problem_change(1, AddCustomerProblemChange(added_customer))
+    assert solution.find_customer(4) is added_customer
+    assert added_customer.location.get_distance_to(customer.location) == \
+           5 * EuclideanDistanceCalculator.METERS_PER_DEGREE
+    assert customer.location.get_distance_to(added_customer.location) == \
+           5 * EuclideanDistanceCalculator.METERS_PER_DEGREE
+    # The lists and locations shared with earlier solutions are left unchanged
+    assert original_customer_list == [customer]
+    assert change_location_list == [depot.location, customer.location]
+    assert customer.location.distance_matrix is original_distance_matrix
+    assert solution.get_customers_within_radius(Location(0, 3.0, 0.0), 1000) == [added_customer]
+
+    problem_registry.apply_problem_change(1, RemoveCustomerProblemChange(2))
+    assert list(vehicle.get_customer_list()) == []
+    assert vehicle.get_total_demand() == 0
+    assert solution.customer_list == [added_customer]
+
+    problem_registry.apply_problem_change(1, AddVehicleProblemChange(Vehicle(6, 50, depot)))
+    problem_registry.apply_problem_change(1, RemoveVehicleProblemChange(3))
+    assert [vehicle.id for vehicle in solution.vehicle_list] == [6]
+
+
+
+def test_remove_customer_while_solving():
+    depot = Depot(1, Location(1, 0.0, 0.0))
+    customer_list = [Customer(location_id, Location(location_id, float(location_id % 3), float(location_id // 3)), 10)
+                     for location_id in range(2, 10)]
+    vehicle_list = [Vehicle(vehicle_id, 100, depot) for vehicle_id in (10, 11)]
+    solving_location_list = [depot.location] + [customer.location for customer in customer_list]
+    EuclideanDistanceCalculator().init_distance_matrix(solving_location_list)
+    solution = VehicleRoutingSolution('test', solving_location_list, [depot], vehicle_list, customer_list,
+                                      depot.location, customer_list[-1].location,
+                                      distance_calculator=EuclideanDistanceCalculator())
+    # FULL_ASSERT fails the solve if the removal is not announced to the solver's score director
+    solver_config = build_solver_config(VehicleRoutingSolution, [Vehicle], vehicle_routing_constraints,
+                                        SolverSettings(spent_limit_seconds=2, environment_mode='FULL_ASSERT'))
+    problem_registry = ProblemRegistry(solver_manager_create(solver_config))
+    problem_registry.add(solution, 1)
+
+    solving_started = threading.Event()
+    solving_ended = threading.Event()
+    final_best_solution_list = []
+    exception_list = []
+
+    def finish(problem_id, final_best_solution):
+        final_best_solution_list.append(final_best_solution)
+        solving_ended.set()
+
+    def handle_exception(problem_id, exception):
+        exception_list.append(exception)
+        solving_ended.set()
+
+    problem_registry.solve(1, lambda problem_id, best_solution: solving_started.set(), finish, handle_exception)
+    assert solving_started.wait(30)
+    assert not problem_registry.apply_problem_change(1, RemoveCustomerProblemChange(5))
+    assert solving_ended.wait(60)
+
+    assert exception_list == []
+    final_best_solution = final_best_solution_list[0]
+    assert [customer.id for customer in final_best_solution.customer_list] == [2, 3, 4, 6, 7, 8, 9]
+    assert sorted(customer.id for vehicle in final_best_solution.vehicle_list
+                  for customer in vehicle.get_customer_list()) == [2, 3, 4, 6, 7, 8, 9]
+    assert [vehicle.id for vehicle in final_best_solution.vehicle_list] == [10, 11]
+    assert final_best_solution.get_score().isFeasible()
+
+
+# The modules shared by the apps are copied into each app, so that every app runs on its own;
+# this fails when one copy is changed without the others
+SHARED_MODULE_LIST = ['solver_config_factory.py', 'problem_registry.py', 'solver_job_queue.py']
+
+
+def test_shared_modules_are_identical():
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    for shared_module in SHARED_MODULE_LIST:
+        with open(os.path.join(app_dir, shared_module), 'rb') as file:
+            content = file.read()
+        for copy_path in glob.glob(os.path.join(app_dir, '..', '*', shared_module)):
+            with open(copy_path, 'rb') as file:
+                assert file.read() == content, f'{os.path.normpath(copy_path)} differs from {shared_module}.'